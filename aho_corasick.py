@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Aho-Corasick 多模式匹配
+关键字过滤和替换词在一次扫描中匹配全部模式，耗时与关键字数量无关
+"""
+
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+class AhoCorasick:
+    """Aho-Corasick 自动机（构建后只读）
+    
+    状态 0 为根；goto[s] 为状态 s 的转移表，fail[s] 为失败指针，
+    output[s] 为在状态 s 结束的全部模式编号（已合并失败链上的输出）。
+    """
+    
+    __slots__ = ("patterns", "goto", "fail", "output")
+    
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Tuple[int, ...]] = [()]
+        
+        seen = set()
+        for pattern in patterns:
+            if not pattern or pattern in seen:
+                continue
+            seen.add(pattern)
+            index = len(self.patterns)
+            self.patterns.append(pattern)
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = next_state
+            self.output[state] += (index,)
+        self._build_failure_links()
+    
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                if self.output[self.fail[next_state]]:
+                    self.output[next_state] += self.output[self.fail[next_state]]
+    
+    def __len__(self) -> int:
+        return len(self.patterns)
+    
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """按结束位置顺序产生 (起始位置, 模式编号)"""
+        goto, fail, output, patterns = self.goto, self.fail, self.output, self.patterns
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                for index in output[state]:
+                    yield position - len(patterns[index]) + 1, index
+    
+    def search(self, text: str) -> Optional[str]:
+        """返回文本中最先出现（最先结束）的模式，没有匹配时返回 None"""
+        for _, index in self.iter_matches(text):
+            return self.patterns[index]
+        return None
+    
+    def find_all(self, text: str) -> List[str]:
+        """返回文本中出现的全部模式（去重，按首次出现顺序）"""
+        found = {}
+        for _, index in self.iter_matches(text):
+            found.setdefault(index, None)
+        return [self.patterns[index] for index in found]
+    
+    def replace(self, text: str, replacements: List[str]) -> str:
+        """一次扫描同时替换：replacements[i] 为第 i 个模式的替换文本
+        
+        重叠时取最左、同一起点取最长的匹配；替换结果不会被再次替换。
+        """
+        patterns = self.patterns
+        # 每个起始位置只保留最长的匹配
+        longest: Dict[int, int] = {}
+        for start, index in self.iter_matches(text):
+            current = longest.get(start)
+            if current is None or len(patterns[index]) > len(patterns[current]):
+                longest[start] = index
+        if not longest:
+            return text
+        
+        parts = []
+        position = 0
+        for start in sorted(longest):
+            if start < position:
+                continue
+            index = longest[start]
+            parts.append(text[position:start])
+            parts.append(replacements[index])
+            position = start + len(patterns[index])
+        parts.append(text[position:])
+        return "".join(parts)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可扩展布隆过滤器
+用于去重前的快速预判：判定"一定不存在"时无需查询精确的指纹存储
+"""
+
+import base64
+import hashlib
+import math
+from typing import Any, Dict, List
+
+class BloomFilter:
+    """固定容量的布隆过滤器（双重哈希，blake2b 128位摘要）"""
+    
+    __slots__ = ("capacity", "error_rate", "num_bits", "num_hashes", "bits", "count")
+    
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+    
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+    
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+    
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+    
+    def is_full(self) -> bool:
+        return self.count >= self.capacity
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "error_rate": self.error_rate,
+            "count": self.count,
+            "bits": base64.b64encode(bytes(self.bits)).decode("ascii")
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "BloomFilter":
+        bloom = cls(data["capacity"], data["error_rate"])
+        bits = base64.b64decode(data["bits"])
+        if len(bits) != len(bloom.bits):
+            raise ValueError("布隆过滤器位数组长度不匹配")
+        bloom.bits = bytearray(bits)
+        bloom.count = data["count"]
+        return bloom
+
+class ScalableBloomFilter:
+    """可扩展布隆过滤器：当前过滤器写满后追加一个容量更大、误判率更低的过滤器，
+    总误判率不超过 error_rate，无需预先知道元素数量"""
+    
+    def __init__(self, initial_capacity: int = 10000, error_rate: float = 0.001,
+                 growth: int = 4, tightening: float = 0.5):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        self.filters: List[BloomFilter] = []
+    
+    def __contains__(self, item: str) -> bool:
+        return any(item in bloom for bloom in reversed(self.filters))
+    
+    def __len__(self) -> int:
+        return sum(bloom.count for bloom in self.filters)
+    
+    def add(self, item: str) -> bool:
+        """加入元素，已（可能）存在时返回 False"""
+        if item in self:
+            return False
+        if not self.filters or self.filters[-1].is_full():
+            n = len(self.filters)
+            self.filters.append(BloomFilter(
+                self.initial_capacity * self.growth ** n,
+                self.error_rate * (1 - self.tightening) * self.tightening ** n
+            ))
+        self.filters[-1].add(item)
+        return True
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "initial_capacity": self.initial_capacity,
+            "error_rate": self.error_rate,
+            "growth": self.growth,
+            "tightening": self.tightening,
+            "filters": [bloom.to_dict() for bloom in self.filters]
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ScalableBloomFilter":
+        scalable = cls(data["initial_capacity"], data["error_rate"], data["growth"], data["tightening"])
+        scalable.filters = [BloomFilter.from_dict(item) for item in data["filters"]]
+        return scalable
@@ -39,6 +39,28 @@ LOG_FORMAT = "[%(asctime)s] - %(levelname)s - %(message)s"
 MAX_RETRIES = 3
 RETRY_DELAY = 5
 
+# 去重指纹存储：memory（默认，内存 + 本地日志，保留12小时）或 sqlite（WAL 模式，可跨数月去重）
+FINGERPRINT_BACKEND = os.getenv('FINGERPRINT_BACKEND', 'memory')
+FINGERPRINT_DB_PATH = os.getenv('FINGERPRINT_DB_PATH', 'message_fingerprints.db')
+FINGERPRINT_MAX_AGE_DAYS = float(os.getenv('FINGERPRINT_MAX_AGE_DAYS', '90'))  # 0 表示不按时间清理
+FINGERPRINT_MAX_PER_PAIR = int(os.getenv('FINGERPRINT_MAX_PER_PAIR', '0'))  # 0 表示不限制数量
+
+# 发送到广播频道的每频道配额：每秒补充的条数和允许的突发条数（群组固定为每分钟20条）。
+# 频道类型在第一次发送成功后从返回的消息得知，之前按群组的严格配额发送
+RATE_LIMIT_CHANNEL_PER_SECOND = float(os.getenv('RATE_LIMIT_CHANNEL_PER_SECOND', '2.0'))
+RATE_LIMIT_CHANNEL_BURST = float(os.getenv('RATE_LIMIT_CHANNEL_BURST', '20'))
+
+# 实时监听媒体组：最后一条消息之后安静多久（秒）认为媒体组已收齐；满10条时立即发送。
+# 这是每个源频道的初始值，之后按该频道相册消息的实际到达间隔自动调整（0.3~5秒）
+MEDIA_GROUP_QUIET_SECONDS = float(os.getenv('MEDIA_GROUP_QUIET_SECONDS', '1.0'))
+# 收到相册的第一条消息时直接用 get_media_group 获取整个相册（多一次请求，省去等待）
+MEDIA_GROUP_EAGER_FETCH = os.getenv('MEDIA_GROUP_EAGER_FETCH', 'false').lower() in ('1', 'true', 'yes')
+
+# 实时监听去重缓存：每个频道对保留的时间（秒）和条数上限；持久化文件为空字符串时只保存在内存
+REALTIME_DEDUPE_TTL_SECONDS = float(os.getenv('REALTIME_DEDUPE_TTL_SECONDS', '86400'))
+REALTIME_DEDUPE_MAX_PER_PAIR = int(os.getenv('REALTIME_DEDUPE_MAX_PER_PAIR', '10000'))
+REALTIME_DEDUPE_PATH = os.getenv('REALTIME_DEDUPE_PATH', 'realtime_dedupe.json')
+
 print(f"✅ 配置加载成功: {BOT_NAME} v{BOT_VERSION}")
 print(f"✅ API_ID: {API_ID[:4]}****{API_ID[-4:] if len(API_ID) > 8 else '***'}")
 print(f"✅ API_HASH: {API_HASH[:8]}****{API_HASH[-8:] if len(API_HASH) > 16 else '***'}")
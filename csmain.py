@@ -101,203 +101,13 @@ recovery_thread = threading.Thread(target=start_floodwait_recovery, daemon=True)
 recovery_thread.start()
 print("🔄 FloodWait自动恢复检查已启动，每5分钟检查一次")
 
-# 启动媒体组超时清理线程
-def start_media_group_cleanup():
-    """启动媒体组超时清理，每60秒清理一次过期的媒体组缓存"""
-    import time
-    import asyncio
-    
-    # 创建一个事件循环来处理异步调用
-    def run_async_cleanup():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        while True:
-            try:
-                # 🔧 修复：延长检查间隔到60秒，减少与实时监听冲突
-                time.sleep(60)  # 从30秒改为60秒
-                
-                # 清理过期的媒体组缓存（线程安全）
-                current_time = time.time()
-                expired_keys = []
-                expired_media_groups = []
-                
-                # 🔧 线程锁保护：在锁内检测并移除过期的媒体组，避免与实时路径竞争
-                with media_group_lock:
-                    for key, messages in list(listen_media_groups.items()):
-                        if messages:
-                            # 🔧 修复：延长过期时间到120秒，避免与5秒实时处理冲突
-                            earliest_time = getattr(messages[0], 'date', None)
-                            if earliest_time:
-                                time_diff = current_time - earliest_time.timestamp()
-                                if time_diff > 120:  # 从60秒改为120秒
-                                    expired_keys.append(key)
-                    
-                    # 在锁内移除并收集过期媒体组，避免重复处理
-                    for key in expired_keys:
-                        if key in listen_media_groups:  # 二次确认还在缓存中
-                            expired_messages = listen_media_groups.pop(key)
-                            expired_media_groups.append((key, expired_messages))
-                
-                # 在锁外处理过期的媒体组
-                for key, expired_messages in expired_media_groups:
-                    chat_id, media_group_id = key
-                    
-                    # 🔧 新增：检查媒体组是否已经在处理中，避免与实时监听器冲突
-                    if is_media_group_processing(media_group_id):
-                        logging.info(f"🧹 媒体组 {media_group_id} 已在实时处理中，跳过清理")
-                        continue
-                    
-                    # 🔧 新增：获取媒体组专用锁
-                    media_group_specific_lock = get_media_group_lock(media_group_id)
-                    
-                    with media_group_specific_lock:
-                        # 再次检查处理状态（双重检查锁定模式）
-                        if is_media_group_processing(media_group_id):
-                            logging.info(f"🧹 媒体组 {media_group_id} 已在处理中（双重检查），跳过清理")
-                            continue
-                        
-                        # 标记为处理中
-                        mark_media_group_processing(media_group_id)
-                        logging.warning(f"🧹 媒体组超时清理: 强制处理媒体组 {media_group_id}，包含 {len(expired_messages)} 条消息（可能不完整）")
-                        
-                        try:
-                            # 查找匹配的频道组配置
-                            for uid, cfg in user_configs.items():
-                                if not cfg.get("realtime_listen"):
-                                    continue
-                                
-                                for pair in cfg.get("channel_pairs", []):
-                                    if not pair.get("enabled", True) or not pair.get("monitor_enabled", False):
-                                        continue
-                                    
-                                    source_channel = str(pair.get("source"))
-                                    if source_channel == str(chat_id) or source_channel.lstrip('@') == str(chat_id).lstrip('@'):
-                                        # 找到匹配的频道组，强制处理媒体组
-                                        logging.info(f"🧹 强制处理过期媒体组: {source_channel} -> {pair.get('target')}")
-                                        
-                                        # 获取有效配置
-                                        effective_config = get_effective_config_for_realtime(uid, source_channel, pair.get('target'))
-                                        
-                                        # 过滤检查
-                                        filtered_messages = [m for m in expired_messages if should_filter_message(m, effective_config)]
-                                        if filtered_messages:
-                                            logging.info(f"🧹 过期媒体组 {media_group_id} 中有 {len(filtered_messages)} 条消息被过滤，跳过处理")
-                                            continue
-                                        
-                                        # 处理媒体组（异步调用）
-                                        loop.run_until_complete(process_expired_media_group(expired_messages, pair, effective_config, uid))
-                                        break
-                        except Exception as e:
-                            logging.error(f"🧹 处理过期媒体组失败: {e}")
-                        finally:
-                            # 🔧 处理完成后清理状态
-                            cleanup_media_group_status(media_group_id)
-                            logging.info(f"🧹 过期媒体组 {media_group_id} 清理完成，释放锁")
-                        
-            except Exception as e:
-                logging.error(f"❌ 媒体组超时清理出错: {e}")
-                time.sleep(60)  # 出错后等待1分钟再试
-    
-    # 启动异步清理
-    run_async_cleanup()
-
-# 启动媒体组清理线程
-media_cleanup_thread = threading.Thread(target=start_media_group_cleanup, daemon=True)
-media_cleanup_thread.start()
-print("🧹 媒体组超时清理已启动，每60秒检查一次")
-
-async def process_expired_media_group(messages, pair, config, user_id):
-    """处理过期的媒体组消息"""
-    try:
-        # 使用统一排序：按ID为主，date为辅
-        sorted_messages = sorted(messages, key=lambda m: (m.id, getattr(m, 'date', 0)))
-        
-        # 去重检查
-        cache_key = (messages[0].chat.id, pair['target'])
-        if cache_key not in realtime_dedupe_cache:
-            realtime_dedupe_cache[cache_key] = set()
-        
-        # 生成媒体组去重键：包含消息范围和数量，避免与实时路径冲突
-        first_id = min(m.id for m in sorted_messages)
-        last_id = max(m.id for m in sorted_messages)
-        media_group_dedup_key = ("media_group", sorted_messages[0].media_group_id, first_id, last_id, len(sorted_messages))
-        if media_group_dedup_key in realtime_dedupe_cache[cache_key]:
-            logging.debug(f"🧹 跳过重复的过期媒体组 {sorted_messages[0].media_group_id} ({first_id}-{last_id}, {len(sorted_messages)}条)")
-            return
-        
-        realtime_dedupe_cache[cache_key].add(media_group_dedup_key)
-        
-        # 收集文本内容
-        caption = ""
-        reply_markup = None
-        full_text_content = ""
-        
-        for m in sorted_messages:
-            if m.caption or m.text:
-                text_content = m.caption or m.text
-                if text_content.strip() and text_content not in full_text_content:
-                    if full_text_content:
-                        full_text_content += "\n\n" + text_content
-                    else:
-                        full_text_content = text_content
-            
-            if m.reply_to_message and m.reply_to_message.text:
-                quoted_text = m.reply_to_message.text
-                if quoted_text.strip() and quoted_text not in full_text_content:
-                    quoted_format = f"💬 引用消息：\n{quoted_text}"
-                    if full_text_content:
-                        full_text_content = quoted_format + "\n\n" + full_text_content
-                    else:
-                        full_text_content = quoted_format
-        
-        # 处理文本内容
-        if full_text_content:
-            caption, reply_markup = process_message_content(full_text_content, config)
-        
-        # 构建媒体列表
-        media_list = []
-        for i, m in enumerate(sorted_messages):
-            if m.photo:
-                media_list.append(InputMediaPhoto(m.photo.file_id, caption=caption if i == 0 else ""))
-            elif m.video:
-                media_list.append(InputMediaVideo(m.video.file_id, caption=caption if i == 0 else ""))
-        
-        if media_list:
-            # 使用全局的client实例发送媒体组
-            from csmain import app
-            
-            # 如果有按钮，将按钮文本添加到第一个媒体的caption中，避免分成两条消息
-            if reply_markup and media_list:
-                button_text = "\n\n📋 按钮："
-                for row in reply_markup.inline_keyboard:
-                    for button in row:
-                        if hasattr(button, 'text') and hasattr(button, 'url') and button.text and button.url:
-                            button_text += f"\n• {button.text}: {button.url}"
-                
-                # 将按钮信息添加到第一个媒体的caption中
-                if media_list[0].caption:
-                    media_list[0].caption += button_text
-                else:
-                    media_list[0].caption = button_text.strip()
-            
-            await app.send_media_group(chat_id=pair['target'], media=media_list)
-            
-            # 移除单独的按钮发送，避免分成两条消息
-            # if reply_markup:
-            #     await safe_send_button_message(app, pair['target'], reply_markup, "过期媒体组")
-            
-            logging.info(f"🧹 成功处理过期媒体组，发送 {len(media_list)} 个媒体文件到 {pair['target']}")
-        
-    except Exception as e:
-        logging.error(f"🧹 处理过期媒体组失败: {e}")
-
 import os
 import time
 import asyncio
 import re
 import logging
 import uuid
+import hashlib
 import json
 import random
 import signal
@@ -316,12 +126,21 @@ def get_config_path(filename):
         return filename
 from datetime import datetime
 from collections import defaultdict
+from functools import partial
 from pyrogram import Client, filters
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InputMediaPhoto, InputMediaVideo
 from pyrogram.enums import ChatType
 from pyrogram.errors.exceptions import BadRequest, FloodWait
 import config
 from urllib.parse import urlparse
+from rate_limiter import HierarchicalRateLimiter
+from send_scheduler import init_send_scheduler, PRIORITY_REALTIME, PRIORITY_UI
+from retry_queue import RetryQueue
+from text_pipeline import get_text_pipeline, invalidate_compiled_caches
+from message_filter import get_message_filter, invalidate_message_filters
+from media_group_aggregator import MediaGroupAggregator
+from realtime_queue import OrderedTargetQueues
+from dedupe_cache import RealtimeDedupeCache
 
 # ==================== FloodWait管理器 ====================
 class FloodWaitManager:
@@ -337,6 +156,11 @@ class FloodWaitManager:
             'send_media_group': 2.5, # 发送媒体组间隔2.5秒（从6.0秒大幅降低）
         }
         
+        # 分级令牌桶：全局 -> 操作类型 -> 目标聊天，不同目标之间并行（广播频道使用单独的配额）
+        self.rate_limiter = HierarchicalRateLimiter(
+            channel_chat_limit=(config.RATE_LIMIT_CHANNEL_PER_SECOND, config.RATE_LIMIT_CHANNEL_BURST)
+        )
+        
         # 启动时清理所有可能的遗留用户级限制数据
         self._cleanup_legacy_user_restrictions()
     
@@ -354,26 +178,18 @@ class FloodWaitManager:
         if keys_to_remove:
             logging.info(f"FloodWaitManager初始化完成，已清理 {len(keys_to_remove)} 个遗留用户级限制")
     
-    async def wait_if_needed(self, operation_type, user_id=None):
-        """检查是否需要等待，如果需要则等待（完全移除用户级限制）"""
-        current_time = time.time()
-        # 完全移除用户级限制，只使用operation_type作为key
-        key = operation_type
+    async def wait_if_needed(self, operation_type, user_id=None, chat_id=None):
+        """按令牌桶限流，必要时等待（完全移除用户级限制）
         
-        # 只保留最基本的操作间隔控制，完全移除所有用户级限制
-        if key in self.last_operation_time:
-            last_time = self.last_operation_time[key]
-            delay_needed = self.operation_delays.get(operation_type, 1)
-            time_since_last = current_time - last_time
-            
-            # 进一步最小化等待时间
-            if time_since_last < delay_needed:
-                sleep_time = max(0.01, delay_needed - time_since_last)  # 最少等待0.01秒
-                logging.debug(f"操作 {operation_type} 间隔控制，等待 {sleep_time:.3f} 秒")
-                await asyncio.sleep(sleep_time)
+        传入 chat_id 时同时受目标聊天的限制，不同目标聊天互不阻塞；
+        令牌在睡眠前预占，并发调用不会同时通过。
+        """
+        waited = await self.rate_limiter.acquire(operation_type, chat_id)
+        if waited > 0:
+            logging.debug(f"操作 {operation_type} 限流等待 {waited:.3f} 秒 (目标: {chat_id})")
         
-        # 更新最后操作时间（只记录全局操作时间）
-        self.last_operation_time[key] = time.time()
+        # 记录最后操作时间（仅用于状态统计）
+        self.last_operation_time[operation_type] = time.time()
     
     def set_flood_wait(self, operation_type, wait_time, user_id=None):
         """设置FloodWait等待时间（已移除用户限制记录）"""
@@ -628,6 +444,8 @@ class FloodWaitManager:
             'copy_message': 3.0,
             'send_media_group': 8.0,
         }
+        self.rate_limiter.set_global_limit(5.0, 5.0)
+        self.rate_limiter.set_operation_limit('send_media_group', 0.5, 1.0)
         logging.info("✅ 紧急模式配置完成，延迟已设置为极保守模式")
 
     def get_optimal_batch_size(self, operation_type):
@@ -671,6 +489,15 @@ class FloodWaitManager:
 # 创建全局FloodWait管理器实例
 flood_wait_manager = FloodWaitManager()
 
+# 创建全局发送调度器（与FloodWait管理器共享令牌桶）：实时监听 > 界面操作 > 历史搬运
+send_scheduler = init_send_scheduler(
+    rate_limiter=flood_wait_manager.rate_limiter,
+    on_flood_wait=flood_wait_manager.set_flood_wait
+)
+
+# 持久化重试队列：搬运中因长时间FloodWait放弃的消息，等待结束后由搬运引擎重放
+retry_queue = RetryQueue(get_config_path("retry_queue.json"))
+
 # ==================== 性能监控系统 ====================
 performance_stats = defaultdict(list)
 
@@ -854,6 +681,16 @@ logging.info("日志系统已启动")
 API_ID = config.API_ID
 API_HASH = config.API_HASH
 BOT_TOKEN = config.BOT_TOKEN
+# 去重指纹存储配置
+FINGERPRINT_BACKEND = config.FINGERPRINT_BACKEND
+FINGERPRINT_DB_PATH = config.FINGERPRINT_DB_PATH
+FINGERPRINT_MAX_AGE_DAYS = config.FINGERPRINT_MAX_AGE_DAYS
+FINGERPRINT_MAX_PER_PAIR = config.FINGERPRINT_MAX_PER_PAIR
+MEDIA_GROUP_QUIET_SECONDS = config.MEDIA_GROUP_QUIET_SECONDS
+MEDIA_GROUP_EAGER_FETCH = config.MEDIA_GROUP_EAGER_FETCH
+REALTIME_DEDUPE_TTL_SECONDS = config.REALTIME_DEDUPE_TTL_SECONDS
+REALTIME_DEDUPE_MAX_PER_PAIR = config.REALTIME_DEDUPE_MAX_PER_PAIR
+REALTIME_DEDUPE_PATH = config.REALTIME_DEDUPE_PATH
 # 新搬运引擎配置
 PROGRESS_SAVE_INTERVAL = 20  # 每处理20条消息保存一次进度（保留用于断点续传）
 
@@ -921,19 +758,18 @@ except Exception as e:
     print(f"⚠️ Firebase存储检查失败: {e}，将使用本地存储")
 
 app = Client(f"{bot_config['bot_id']}_session", api_id=bot_config['api_id'], api_hash=bot_config['api_hash'], bot_token=bot_config['bot_token'])
+send_scheduler.bind_loop(app.loop)
 
 # ==================== 全局状态 ====================
 user_configs = {}  # 存储每个用户的配置，包括频道组和功能设定
 user_states = {} # { user_id: [ {task_id: "...", state: "...", ...} ] }
 user_history = {} # 存储每个用户的历史记录
-listen_media_groups = {}  # {(chat_id, media_group_id): [messages]}
-realtime_dedupe_cache = {}  # 实时监听去重缓存 {(source_chat_id, target_chat_id): set()}
-media_group_lock = threading.Lock()  # 🔧 新增：媒体组缓存线程锁
-
-# 🔧 新增：基于media_group_id的专门锁定机制，防止同一媒体组被多次处理
-media_group_processing_locks = {}  # {media_group_id: threading.Lock()}
-media_group_processing_status = {}  # {media_group_id: "processing"|"completed"}
-media_group_status_lock = threading.Lock()  # 保护处理状态字典的锁
+# 实时监听去重缓存：按 (source_chat_id, target_chat_id) 的 TTL + LRU，可选持久化
+realtime_dedupe_cache = RealtimeDedupeCache(
+    ttl_seconds=REALTIME_DEDUPE_TTL_SECONDS,
+    max_per_pair=REALTIME_DEDUPE_MAX_PER_PAIR,
+    persist_path=REALTIME_DEDUPE_PATH or None
+)
 
 # 新搬运引擎实例和状态
 robust_cloning_engine = None
@@ -980,70 +816,6 @@ running_task_cancellation = {}  # 任务ID -> 取消标志
 # 系统维护按钮已移除
 
 # ==================== 通用辅助 ====================
-def get_media_group_lock(media_group_id):
-    """获取指定媒体组的专用锁，如果不存在则创建"""
-    with media_group_status_lock:
-        if media_group_id not in media_group_processing_locks:
-            media_group_processing_locks[media_group_id] = threading.Lock()
-        return media_group_processing_locks[media_group_id]
-
-def is_media_group_processing(media_group_id):
-    """检查指定媒体组是否正在处理中"""
-    with media_group_status_lock:
-        return media_group_processing_status.get(media_group_id) == "processing"
-
-def mark_media_group_processing(media_group_id):
-    """标记媒体组为处理中状态"""
-    with media_group_status_lock:
-        media_group_processing_status[media_group_id] = "processing"
-
-def mark_media_group_completed(media_group_id):
-    """标记媒体组为已完成状态"""
-    with media_group_status_lock:
-        media_group_processing_status[media_group_id] = "completed"
-
-def cleanup_media_group_status(media_group_id):
-    """清理媒体组的处理状态和锁（在处理完成后调用）"""
-    with media_group_status_lock:
-        media_group_processing_status.pop(media_group_id, None)
-        media_group_processing_locks.pop(media_group_id, None)
-
-def _is_media_group_complete(messages):
-    """检查媒体组是否完整（修复策略：更保守的触发条件，确保完整性）"""
-    if len(messages) < 2:
-        return False
-    
-    # 按ID排序检查连续性
-    sorted_messages = sorted(messages, key=lambda m: m.id)
-    
-    # 🔧 修复：提高触发门槛，确保媒体组完整
-    if len(sorted_messages) >= 3:  # 至少3条消息才考虑完整性检查
-        max_gap = 0
-        for i in range(1, len(sorted_messages)):
-            gap = sorted_messages[i].id - sorted_messages[i-1].id
-            max_gap = max(max_gap, gap)
-        
-        # 🔧 修复：更严格的完整性判断，ID必须连续或间隔很小
-        if max_gap <= 1:  # 只有ID完全连续才认为完整
-            first_time = getattr(sorted_messages[0], 'date', None)
-            last_time = getattr(sorted_messages[-1], 'date', None)
-            if first_time and last_time:
-                time_diff = (last_time - first_time).total_seconds()
-                # 🔧 修复：增加时间差要求，确保媒体组发送完毕
-                if time_diff > 8:  # 从3秒增加到8秒
-                    return True
-    
-    # 🔧 修复：大幅增加超时时间，给媒体组足够的收集时间
-    if len(sorted_messages) >= 1:
-        first_time = getattr(sorted_messages[0], 'date', None)
-        if first_time:
-            time_diff = time.time() - first_time.timestamp()
-            # 🔧 修复：从5秒增加到15秒，确保大媒体组有足够时间
-            if time_diff > 15:
-                return True
-    
-    return False  # 默认认为不完整，继续等待
-
 def parse_channel_identifier(raw: str):
     s = (raw or "").strip()
     
@@ -1135,7 +907,8 @@ def generate_dedupe_key(message, processed_text=None, config=None):
             processed_text, _ = process_message_content(message.caption or message.text, config)
         text_key = (processed_text or message.text or "").strip()
         if text_key:
-            return ("text", hash(text_key))
+            # 稳定的摘要（内置 hash 每次启动都不同，无法持久化）
+            return ("text", hashlib.blake2b(text_key.encode("utf-8"), digest_size=8).hexdigest())
     else:
         # 媒体消息去重
         file_id = None
@@ -1228,6 +1001,10 @@ async def cooperative_sleep(task_obj: dict, seconds: int):
 # ==================== 持久化函数 ====================
 def save_configs():
     """保存配置到文件"""
+    # 配置已修改（关键字、替换词等），丢弃按旧配置编译的文本处理缓存和过滤谓词
+    invalidate_compiled_caches()
+    invalidate_message_filters()
+    invalidate_source_channel_index()
     try:
         logging.info("正在保存用户配置...")
         # 1. 保存到本地文件（作为备份）
@@ -1260,6 +1037,7 @@ def save_configs():
 def load_configs():
     """从文件或Firebase载入用户配置"""
     global user_configs
+    invalidate_source_channel_index()
     
     # 1. 优先尝试从Firebase加载
     try:
@@ -1419,8 +1197,9 @@ def get_main_menu_buttons(user_id):
         ],
         [
             InlineKeyboardButton("🔍 当前配置", callback_data="view_config"),
-            InlineKeyboardButton("❓ 帮助", callback_data="show_help")
-        ]
+            InlineKeyboardButton("🔁 重试队列", callback_data="show_retry_queue")
+        ],
+        [InlineKeyboardButton("❓ 帮助", callback_data="show_help")]
     ]
     
     # 登出按钮已移除（登录系统已删除）
@@ -1689,14 +1468,17 @@ def remove_task(user_id, task_id):
 async def safe_edit_or_reply(message, text, reply_markup=None, user_id=None):
     """安全的编辑或回复消息，包含FloodWait保护"""
     try:
-        # 检查是否需要等待（传递用户ID，支持用户级限制）
-        if user_id:
-            await flood_wait_manager.wait_if_needed('edit_message', user_id)
-        else:
-            await flood_wait_manager.wait_if_needed('edit_message')
-        
-        # 尝试编辑消息
-        await message.edit_text(text, reply_markup=reply_markup)
+        # 目标聊天（缺少 chat 时为 None：调度器单独排队，不占用任何聊天的配额）
+        chat_id = message.chat.id if getattr(message, 'chat', None) else None
+        
+        # 通过发送调度器编辑消息（界面优先级，限流由调度器完成；FloodWait直接抛出由下方处理）
+        await send_scheduler.submit(
+            chat_id,
+            lambda: message.edit_text(text, reply_markup=reply_markup),
+            priority=PRIORITY_UI,
+            operation='edit_message',
+            max_flood_wait=0
+        )
         return True
         
     except FloodWait as e:
@@ -1713,9 +1495,9 @@ async def safe_edit_or_reply(message, text, reply_markup=None, user_id=None):
             logging.warning(f"⚠️ 等待时间过长({wait_time}秒)，改为发送新消息")
             try:
                 if user_id:
-                    await flood_wait_manager.wait_if_needed('send_message', user_id)
+                    await flood_wait_manager.wait_if_needed('send_message', user_id, chat_id=chat_id)
                 else:
-                    await flood_wait_manager.wait_if_needed('send_message')
+                    await flood_wait_manager.wait_if_needed('send_message', chat_id=chat_id)
                 await message.reply_text(text, reply_markup=reply_markup)
                 return True
             except Exception as reply_e:
@@ -1749,9 +1531,9 @@ async def safe_edit_or_reply(message, text, reply_markup=None, user_id=None):
             logging.info(f"消息无法编辑，改为发送新消息: {e}")
             try:
                 if user_id:
-                    await flood_wait_manager.wait_if_needed('send_message', user_id)
+                    await flood_wait_manager.wait_if_needed('send_message', user_id, chat_id=chat_id)
                 else:
-                    await flood_wait_manager.wait_if_needed('send_message')
+                    await flood_wait_manager.wait_if_needed('send_message', chat_id=chat_id)
                 await message.reply_text(text, reply_markup=reply_markup)
                 return True
             except Exception as reply_e:
@@ -1762,9 +1544,9 @@ async def safe_edit_or_reply(message, text, reply_markup=None, user_id=None):
             # 尝试发送新消息
             try:
                 if user_id:
-                    await flood_wait_manager.wait_if_needed('send_message', user_id)
+                    await flood_wait_manager.wait_if_needed('send_message', user_id, chat_id=chat_id)
                 else:
-                    await flood_wait_manager.wait_if_needed('send_message')
+                    await flood_wait_manager.wait_if_needed('send_message', chat_id=chat_id)
                 await message.reply_text(text, reply_markup=reply_markup)
                 return True
             except Exception as reply_e:
@@ -2659,6 +2441,77 @@ async def refresh_floodwait_status(message, user_id):
         logging.error(f"刷新FloodWait状态时出错: {e}")
         await safe_edit_or_reply(message, f"❌ 刷新状态时出现错误: {str(e)}")
 
+# ==================== 重试队列管理 ====================
+async def show_retry_queue_menu(message, user_id):
+    """显示重试队列（因长时间FloodWait放弃、等待重放的消息）"""
+    summary = retry_queue.summary(str(user_id))
+    entries = retry_queue.list_entries(str(user_id))
+    
+    text = "🔁 **重试队列**\n\n"
+    if not entries:
+        text += "✅ 队列为空，没有等待重试的消息。"
+    else:
+        text += f"• 记录数: {summary['entries']}\n"
+        text += f"• 消息数: {summary['messages']}\n"
+        text += f"• 已到期: {summary['due']}\n"
+        if summary['next_retry_in']:
+            text += f"• 最近一次重试: {summary['next_retry_in']} 秒后\n"
+        text += "\n📋 **最近记录:**\n"
+        now = time.time()
+        for entry in entries[:10]:
+            ids = entry['message_ids']
+            id_text = str(ids[0]) if len(ids) == 1 else f"{ids[0]}-{ids[-1]}（{len(ids)}条）"
+            wait_left = max(0, int(entry['retry_after'] - now))
+            text += f"• `{entry['source']}` → `{entry['target']}` 消息 {id_text}，第 {entry['attempts']} 次，{wait_left} 秒后重试\n"
+        if len(entries) > 10:
+            text += f"... 还有 {len(entries) - 10} 条记录\n"
+        text += "\n💡 到期的记录会在后台自动重放，也可以立即重放。"
+    
+    buttons = []
+    if entries:
+        buttons.append([
+            InlineKeyboardButton("▶️ 立即重放", callback_data="retry_queue_replay"),
+            InlineKeyboardButton("🗑️ 清空队列", callback_data="retry_queue_clear")
+        ])
+    buttons.append([InlineKeyboardButton("🔄 刷新", callback_data="show_retry_queue")])
+    buttons.append([InlineKeyboardButton("🔙 返回主菜单", callback_data="show_main_menu")])
+    
+    await safe_edit_or_reply(message, text, reply_markup=InlineKeyboardMarkup(buttons))
+
+async def replay_retry_queue_now(client, message, user_id):
+    """立即重放当前用户的重试队列（忽略剩余等待时间）"""
+    if not NEW_ENGINE_AVAILABLE:
+        await safe_edit_or_reply(message, "❌ 新搬运引擎不可用，无法重放重试队列")
+        return
+    
+    try:
+        await safe_edit_or_reply(message, "🔁 正在重放重试队列，请稍候...")
+        engine = get_robust_cloning_engine(client)
+        result = await engine.replay_retry_queue(user_id=str(user_id), force=True)
+        
+        text = "🔁 **重试队列重放完成**\n\n"
+        text += f"• 处理记录: {result['entries']}\n"
+        text += f"• 成功搬运: {result['successfully_cloned']}\n"
+        text += f"• 再次FloodWait（保留在队列）: {result['retry_queued']}\n"
+        text += f"• 源消息已删除: {result['source_deleted']}\n"
+        text += f"• 重复/已处理/过滤: {result['duplicates_skipped'] + result['already_processed'] + result['filtered_messages']}\n"
+        text += f"• 错误: {result['errors']}\n"
+        
+        buttons = [
+            [InlineKeyboardButton("🔁 查看重试队列", callback_data="show_retry_queue")],
+            [InlineKeyboardButton("🔙 返回主菜单", callback_data="show_main_menu")]
+        ]
+        await safe_edit_or_reply(message, text, reply_markup=InlineKeyboardMarkup(buttons))
+    except Exception as e:
+        logging.error(f"重放重试队列时出错: {e}")
+        await safe_edit_or_reply(message, f"❌ 重放重试队列时出现错误: {str(e)}")
+
+async def clear_retry_queue(message, user_id):
+    """清空当前用户的重试队列"""
+    removed = retry_queue.clear(str(user_id))
+    buttons = [[InlineKeyboardButton("🔙 返回主菜单", callback_data="show_main_menu")]]
+    await safe_edit_or_reply(message, f"🗑️ 已清空重试队列: {removed} 条记录", reply_markup=InlineKeyboardMarkup(buttons))
+
 # ==================== 任务完成通知 ====================
 async def send_task_completion_notification(message, user_id, task_id_short, total_stats, was_cancelled):
     """发送任务完成通知"""
@@ -3120,6 +2973,12 @@ async def callback_handler(client, callback_query):
         await fix_floodwait_now(callback_query.message, user_id)
     elif data == "refresh_floodwait_status":
         await refresh_floodwait_status(callback_query.message, user_id)
+    elif data == "show_retry_queue":
+        await show_retry_queue_menu(callback_query.message, user_id)
+    elif data == "retry_queue_replay":
+        await replay_retry_queue_now(client, callback_query.message, user_id)
+    elif data == "retry_queue_clear":
+        await clear_retry_queue(callback_query.message, user_id)
     elif data.startswith("set_tail_freq:"):
         mode = data.split(":", 1)[1]
         await handle_tail_frequency_set(callback_query.message, user_id, mode)
@@ -3431,6 +3290,56 @@ async def explain_limits_command(client, message):
         await message.reply_text(explain_text_plain)
 
 # ==================== FloodWait状态查询命令 ====================
+def format_send_scheduler_status(limit: int = 5) -> str:
+    """发送调度器状态：排队数和因FloodWait暂停的聊天（等待最久的在前）"""
+    status = send_scheduler.get_status()
+    queued = status["queued"]
+    text = "📤 **发送调度器:**\n"
+    text += f"• 排队: 实时 {queued.get('realtime', 0)} / 界面 {queued.get('ui', 0)} / 历史搬运 {queued.get('bulk', 0)}\n"
+    text += f"• 发送中的聊天: {status['active_chats']}\n"
+    text += f"• 已完成 {status['completed']}，失败 {status['failed']}，FloodWait {status['flood_waits']} 次\n"
+    parked = sorted(((chat, remaining) for chat, remaining in status["parked_chats"].items() if remaining > 0),
+                    key=lambda item: item[1], reverse=True)
+    if parked:
+        text += f"• 暂停中的聊天: {len(parked)} 个\n"
+        for chat, remaining in parked[:limit]:
+            text += f"  - `{chat}`: 剩余 {remaining:.0f} 秒，排队 {status['chat_depths'].get(chat, 0)} 条\n"
+        if len(parked) > limit:
+            text += f"  ... 还有 {len(parked) - limit} 个\n"
+    return text
+
+def format_realtime_queue_status(limit: int = 5) -> str:
+    """实时监听各目标频道的发送队列：深度和延迟（延迟最大的在前）"""
+    stats = realtime_send_queues.get_stats()
+    text = "📡 **实时发送队列:**\n"
+    if not stats:
+        return text + "• 暂无目标频道\n"
+    backlog = sum(item["depth"] for item in stats.values())
+    text += f"• 目标频道: {len(stats)} 个，待发送 {backlog} 条\n"
+    ordered = sorted(stats.items(), key=lambda item: (item[1]["lag"], item[1]["depth"]), reverse=True)
+    for target, item in ordered[:limit]:
+        text += (f"  - `{target}`: 排队 {item['depth']}，当前延迟 {item['lag']:.0f}s（最大 {item['max_lag']:.0f}s），"
+                 f"已发送 {item['sent']}，失败 {item['failed']}，跳过 {item['skipped']}\n")
+    if len(ordered) > limit:
+        text += f"  ... 还有 {len(ordered) - limit} 个\n"
+    return text
+
+def format_media_group_status(limit: int = 5) -> str:
+    """实时监听的媒体组聚合：各源频道当前的自适应安静期和迟到统计（安静期最长的在前）"""
+    stats = media_group_aggregator.get_stats()
+    text = "📦 **媒体组聚合:**\n"
+    text += (f"• 已发出 {stats['groups']} 组（满10条 {stats['flushed_full']}，安静期 {stats['flushed_quiet']}，"
+             f"整组获取 {stats['flushed_fetched']}），收集中 {stats['pending_groups']} 组\n")
+    text += f"• 迟到消息 {stats['late_items']} 条，整组获取失败 {stats['fetch_failures']} 次\n"
+    channels = sorted(stats["channels"].items(), key=lambda item: item[1]["quiet_window"], reverse=True)
+    for chat_id, channel in channels[:limit]:
+        text += (f"  - `{chat_id}`: 安静期 {channel['quiet_window']:.2f}s"
+                 f"（间隔均值 {channel['gap_mean']:.2f}s ± {channel['gap_dev']:.2f}s，{channel['gap_samples']} 个样本），"
+                 f"相册 {channel['albums']}，迟到 {channel['late_items']}\n")
+    if len(channels) > limit:
+        text += f"  ... 还有 {len(channels) - limit} 个频道\n"
+    return text
+
 @app.on_message(filters.command("floodwait") & filters.private)
 async def floodwait_status_command(client, message):
     user_id = message.from_user.id
@@ -3501,6 +3410,10 @@ async def floodwait_status_command(client, message):
     if expired_count > 0:
         status_text += f"\n🧹 已清理 {expired_count} 个过期的限制记录\n"
     
+    status_text += "\n" + format_send_scheduler_status()
+    status_text += "\n" + format_realtime_queue_status()
+    status_text += "\n" + format_media_group_status()
+    
     # 添加建议
     status_text += f"\n**建议**:\n"
     if all_status:
@@ -3668,35 +3581,261 @@ async def handle_text_input(client, message):
             logging.warning(f"发送菜单提示失败: {e}")
 
 # ==================== 实时监听搬运 ====================
-def resolve_user_for_source_channel(chat_id):
-    # 遍历所有用户配置，找出包含该源频道且开启监听的用户
+# 源频道索引：规范化的源频道标识 -> [(用户ID, 频道组, 有效配置)]
+# 只包含开启实时监听、启用且开启监控的频道组；保存配置后标记为待刷新，
+# 下一次查找时只重建配置发生变化的用户的条目
+source_channel_index = {}
+_source_index_entries = {}     # 用户ID -> (配置签名, [该用户登记的标识])
+_source_index_dirty = True
+
+def normalize_source_identifier(identifier):
+    """规范化源频道标识：去掉 @ 前缀，用户名不区分大小写"""
+    return str(identifier).strip().lstrip('@').lower()
+
+def _user_config_signature(cfg):
+    return hashlib.blake2b(json.dumps(cfg, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'), digest_size=16).hexdigest()
+
+def _unindex_user_sources(uid):
+    _, keys = _source_index_entries.pop(uid, (None, []))
+    for key in keys:
+        routes = [route for route in source_channel_index.get(key, []) if route[0] != int(uid)]
+        if routes:
+            source_channel_index[key] = routes
+        else:
+            source_channel_index.pop(key, None)
+
+def _index_user_sources(uid, cfg, signature):
+    keys = []
+    if cfg.get("realtime_listen"):
+        for pair in cfg.get("channel_pairs", []):
+            if not isinstance(pair, dict) or not pair.get("enabled", True) or not pair.get("monitor_enabled", False):
+                continue
+            if not pair.get("source"):
+                continue
+            # 频道组专用过滤设置优先，否则使用全局配置；预先编译过滤谓词和文本流水线
+            effective_config = pair.get("custom_filters") or cfg
+            get_message_filter(effective_config)
+            get_text_pipeline(effective_config)
+            key = normalize_source_identifier(pair.get("source"))
+            source_channel_index.setdefault(key, []).append((int(uid), pair, effective_config))
+            keys.append(key)
+    _source_index_entries[uid] = (signature, keys)
+
+def refresh_source_channel_index():
+    """增量刷新源频道索引：只重建新增、修改或删除的用户的条目"""
+    global _source_index_dirty
+    _source_index_dirty = False
+    changed = 0
+    for uid in list(_source_index_entries):
+        if uid not in user_configs:
+            _unindex_user_sources(uid)
+            changed += 1
+    for uid, cfg in list(user_configs.items()):
+        if not isinstance(cfg, dict):
+            continue
+        signature = _user_config_signature(cfg)
+        entry = _source_index_entries.get(uid)
+        if entry is not None and entry[0] == signature:
+            continue
+        _unindex_user_sources(uid)
+        _index_user_sources(uid, cfg, signature)
+        changed += 1
+    if changed:
+        logging.info(f"🗂️ 源频道索引已更新: {changed} 个用户的配置有变化，共索引 {len(source_channel_index)} 个源频道")
+
+def invalidate_source_channel_index():
+    """配置修改或重新载入后调用，下一次查找时刷新索引"""
+    global _source_index_dirty
+    _source_index_dirty = True
+
+def resolve_user_for_source_channel(chat_id, username=None):
+    """查找监听该源频道的用户和频道组，返回 [(用户ID, 频道组, 有效配置)]
+    
+    频道ID和用户名都会查找（配置中的源频道可能是任意一种形式），同一频道组只返回一次。
+    """
+    if _source_index_dirty:
+        refresh_source_channel_index()
     matched = []
-    logging.info(f"resolve_user_for_source_channel: 查找频道 {chat_id} 的监听配置")
-    
-    for uid, cfg in user_configs.items():
-        logging.debug(f"检查用户 {uid} 的配置: realtime_listen={cfg.get('realtime_listen')}")
-        if not cfg.get("realtime_listen"):
+    seen = set()
+    for identifier in (chat_id, username):
+        if identifier is None or identifier == "":
             continue
-        
-        for i, pair in enumerate(cfg.get("channel_pairs", [])):
-            logging.debug(f"用户 {uid} 频道组 {i}: enabled={pair.get('enabled', True)}, monitor_enabled={pair.get('monitor_enabled', False)}, source={pair.get('source')}")
-            
-            # 检查频道组是否启用且监控已开启
-            if not pair.get("enabled", True) or not pair.get("monitor_enabled", False):
-                continue
-                
-            source_channel = str(pair.get("source"))
-            chat_id_str = str(chat_id)
+        for route in source_channel_index.get(normalize_source_identifier(identifier), ()):
+            if id(route[1]) not in seen:
+                seen.add(id(route[1]))
+                matched.append(route)
+    logging.debug(f"resolve_user_for_source_channel: 频道 {chat_id} (@{username}) 找到 {len(matched)} 个匹配配置")
+    return matched
+
+async def send_realtime_message(uid, target, message_id, send_factory):
+    """实时发送队列中的单条消息"""
+    await send_scheduler.submit(target, send_factory, priority=PRIORITY_REALTIME)
+    logging.info(f"实时监听: 用户 {uid} 成功搬运消息 {message_id} 到 {target}")
+
+def dispatch_realtime_send(target, run, label, reservation=None):
+    """把实时发送交给目标频道的有序队列：有预留位置时填充该位置，否则排到队尾"""
+    if reservation is not None:
+        reservation.fill(run)
+    else:
+        realtime_send_queues.enqueue(target, run, label)
+
+async def relay_media_group_to_pair(client, group_messages, uid, pair, cfg, reservation=None):
+    """把收集完整的媒体组按频道组配置过滤、去重并放入目标频道的发送队列
+    
+    reservation 为收到该媒体组第一条消息时在目标队列中预留的位置（过滤或重复时填充为空）。
+    """
+    media_group_id = group_messages[0].media_group_id
+    logging.info(f"📦 准备处理媒体组 {media_group_id}，最终包含 {len(group_messages)} 条消息（用户 {uid}: {pair.get('source')} -> {pair.get('target')}）")
+    
+    # 过滤整组
+    logging.info(f"🔍 实时监听: 开始过滤检查媒体组 {media_group_id}，包含 {len(group_messages)} 条消息")
+    filtered_messages = [m for m in group_messages if should_filter_message(m, cfg)]
+    if filtered_messages:
+        logging.info(f"🚫 实时监听: 媒体组 {media_group_id} 中有 {len(filtered_messages)} 条消息被过滤，跳过整组")
+        return
+    logging.info(f"✅ 实时监听: 媒体组 {media_group_id} 通过过滤检查，继续处理")
+    
+    # 实时监听媒体组去重检查 - 改进版
+    cache_key = (group_messages[0].chat.id, pair['target'])
+    
+    # 生成基于消息范围和数量的去重键，而非仅 media_group_id
+    first_id = min(m.id for m in group_messages)
+    last_id = max(m.id for m in group_messages)
+    media_group_dedup_key = ("media_group", media_group_id, first_id, last_id, len(group_messages))
+    
+    if realtime_dedupe_cache.check_and_add(cache_key, media_group_dedup_key):
+        logging.debug(f"实时监听: 跳过重复媒体组 {media_group_id} ({first_id}-{last_id}, {len(group_messages)}条)")
+        return
+    
+    media_list = []
+    caption = ""
+    reply_markup = None
+    full_text_content = ""  # 收集所有文本内容
+    
+    # 收集媒体组中的所有文本内容（实时监听版本）
+    for m in group_messages:
+        # 收集caption和text
+        if m.caption or m.text:
+            text_content = m.caption or m.text
+            if text_content.strip() and text_content not in full_text_content:
+                if full_text_content:
+                    full_text_content += "\n\n" + text_content
+                else:
+                    full_text_content = text_content
+        
+        # 收集引用的文本内容
+        if m.reply_to_message and m.reply_to_message.text:
+            quoted_text = m.reply_to_message.text
+            if quoted_text.strip() and quoted_text not in full_text_content:
+                # 添加引用标记
+                quoted_format = f"💬 引用消息：\n{quoted_text}"
+                if full_text_content:
+                    full_text_content = quoted_format + "\n\n" + full_text_content
+                else:
+                    full_text_content = quoted_format
+    
+    # 处理收集到的完整文本内容
+    if full_text_content:
+        caption, reply_markup = process_message_content(full_text_content, cfg)
+    
+    # 构建媒体列表
+    for i, m in enumerate(group_messages):
+        if m.photo:
+            media_list.append(InputMediaPhoto(m.photo.file_id, caption=caption if i == 0 else ""))
+        elif m.video:
+            media_list.append(InputMediaVideo(m.video.file_id, caption=caption if i == 0 else ""))
+    
+    target = pair['target']
+    
+    # 🔧 修复：处理包含媒体的媒体组
+    if media_list:
+        # 如果有按钮，将按钮文本添加到第一个媒体的caption中，避免分成两条消息
+        if reply_markup and media_list:
+            button_text = "\n\n📋 按钮："
+            for row in reply_markup.inline_keyboard:
+                for button in row:
+                    if hasattr(button, 'text') and hasattr(button, 'url') and button.text and button.url:
+                        button_text += f"\n• {button.text}: {button.url}"
             
-            # 比较频道标识符
-            if source_channel == chat_id_str or source_channel.lstrip('@') == chat_id_str.lstrip('@'):
-                logging.info(f"匹配成功: 用户 {uid} 的频道组 {pair.get('source')} -> {pair.get('target')}")
-                matched.append((int(uid), pair))
+            # 将按钮信息添加到第一个媒体的caption中
+            if media_list[0].caption:
+                media_list[0].caption += button_text
             else:
-                logging.info(f"未匹配: 配置的源频道 '{source_channel}' != 实际频道 '{chat_id_str}'")
+                media_list[0].caption = button_text.strip()
+        
+        async def send_album():
+            await send_scheduler.submit(
+                target,
+                lambda: client.send_media_group(chat_id=target, media=media_list),
+                priority=PRIORITY_REALTIME,
+                operation='send_media_group'
+            )
+            logging.info(f"✅ 媒体组发送成功: {len(group_messages)} 条消息 (包含 {len(media_list)} 个媒体)")
+        dispatch_realtime_send(target, send_album, f"媒体组 {media_group_id}", reservation)
     
-    logging.info(f"resolve_user_for_source_channel: 频道 {chat_id} 找到 {len(matched)} 个匹配配置")
-    return matched
+    # 🔧 新增：处理纯文本媒体组（之前被忽略导致拆分的根本原因）
+    else:
+        # 纯文本媒体组：使用send_message发送合并后的文本内容
+        if caption or full_text_content:
+            final_text = caption or full_text_content
+            
+            # 如果有按钮，将按钮信息添加到文本中
+            if reply_markup:
+                button_text = "\n\n📋 按钮："
+                for row in reply_markup.inline_keyboard:
+                    for button in row:
+                        if hasattr(button, 'text') and hasattr(button, 'url') and button.text and button.url:
+                            button_text += f"\n• {button.text}: {button.url}"
+                final_text += button_text
+            
+            async def send_text():
+                await send_scheduler.submit(
+                    target,
+                    lambda: client.send_message(chat_id=target, text=final_text),
+                    priority=PRIORITY_REALTIME
+                )
+                logging.info(f"✅ 纯文本媒体组发送成功: {len(group_messages)} 条消息")
+            dispatch_realtime_send(target, send_text, f"纯文本媒体组 {media_group_id}", reservation)
+        else:
+            logging.warning(f"⚠️ 媒体组无有效内容: {len(group_messages)} 条消息")
+
+async def relay_media_group(group_messages):
+    """媒体组聚合器的回调：发送到所有监听该源频道的频道组"""
+    chat = group_messages[0].chat
+    reservations = media_group_reservations.pop((chat.id, group_messages[0].media_group_id), {})
+    try:
+        for uid, pair, cfg in resolve_user_for_source_channel(chat.id, chat.username):
+            if not pair.get("enabled", True):
+                continue
+            reservation = reservations.pop(id(pair), None)
+            try:
+                await relay_media_group_to_pair(app, group_messages, uid, pair, cfg, reservation)
+            except Exception as e:
+                logging.error(f"媒体组 {group_messages[0].media_group_id} 处理异常（用户 {uid}）: {e}")
+            finally:
+                if reservation is not None and reservation.run is None:
+                    reservation.fill(None)
+    finally:
+        # 收到第一条消息后被删除或停用的频道组：释放预留的位置
+        for reservation in reservations.values():
+            reservation.fill(None)
+
+async def fetch_media_group(message):
+    """一次请求获取消息所在的整个相册"""
+    return await app.get_media_group(message.chat.id, message.id)
+
+# 实时发送队列：每个目标频道按源消息顺序逐条发送，处理器只入队
+realtime_send_queues = OrderedTargetQueues()
+# 媒体组在目标队列中预留的位置 {(源频道ID, media_group_id): {id(频道组): 预留任务}}
+media_group_reservations = {}
+
+# 媒体组聚合器：同一媒体组的消息在安静期内持续收集，安静期结束或满10条后一次性发送；
+# 开启 MEDIA_GROUP_EAGER_FETCH 时收到第一条消息就获取整个相册，不等待安静期
+media_group_aggregator = MediaGroupAggregator(
+    relay_media_group,
+    quiet_seconds=MEDIA_GROUP_QUIET_SECONDS,
+    fetch_group=fetch_media_group if MEDIA_GROUP_EAGER_FETCH else None
+)
 
 @app.on_message(~filters.private)
 @monitor_performance('listen_and_clone')
@@ -3713,199 +3852,29 @@ async def listen_and_clone(client, message):
     chat_identifier = message.chat.username or message.chat.id
     logging.info(f"实时监听: 收到频道消息，频道ID: {chat_identifier}, 消息ID: {message.id}")
     
-    matched_pairs = resolve_user_for_source_channel(chat_identifier)
+    matched_pairs = resolve_user_for_source_channel(message.chat.id, message.chat.username)
     if not matched_pairs:
         logging.info(f"实时监听: 频道 {chat_identifier} 未找到匹配的监听配置")
         return
     
+    # 多媒体组聚合：交给聚合器收集，齐全后一次性发送到所有匹配的频道组
+    if message.media_group_id:
+        if media_group_aggregator.add(message):
+            # 新的媒体组：先在各目标队列中预留位置，保证相册与前后消息的顺序
+            media_group_reservations[(message.chat.id, message.media_group_id)] = {
+                id(pair): realtime_send_queues.reserve(pair['target'], f"媒体组 {message.media_group_id}")
+                for uid, pair, cfg in matched_pairs if pair.get("enabled", True)
+            }
+        return
+    
     logging.info(f"实时监听: 频道 {chat_identifier} 找到 {len(matched_pairs)} 个匹配的监听配置")
-    for uid, pair in matched_pairs:
-        # 获取该频道组的有效配置（专用或全局）
-        cfg = get_effective_config_for_realtime(uid, pair.get('source'), pair.get('target'))
+    for uid, pair, cfg in matched_pairs:
+        # cfg 为索引中预先确定的有效配置（专用或全局）
         logging.info(f"实时监听: 开始处理用户 {uid} 的频道组 {pair.get('source')} -> {pair.get('target')}")
         
         if not pair.get("enabled", True):
             logging.info(f"实时监听: 跳过用户 {uid} 的频道组（已禁用）")
             continue
-        # 多媒体组聚合：等待同 media_group_id 的消息齐全
-        if message.media_group_id:
-            # 🔧 新增：检查媒体组是否已经在处理中，避免重复处理
-            if is_media_group_processing(message.media_group_id):
-                logging.info(f"🔒 媒体组 {message.media_group_id} 已在处理中，跳过")
-                continue
-            
-            # 🔧 新增：获取媒体组专用锁，确保同一媒体组不会被多个线程同时处理
-            media_group_specific_lock = get_media_group_lock(message.media_group_id)
-            
-            with media_group_specific_lock:
-                # 再次检查处理状态（双重检查锁定模式）
-                if is_media_group_processing(message.media_group_id):
-                    logging.info(f"🔒 媒体组 {message.media_group_id} 已在处理中（双重检查），跳过")
-                    continue
-                
-                # 标记为处理中
-                mark_media_group_processing(message.media_group_id)
-                logging.info(f"🔒 媒体组 {message.media_group_id} 开始处理，已加锁")
-                
-                try:
-                    with media_group_lock:  # 🔧 线程锁保护
-                        key = (message.chat.id, message.media_group_id)
-                        listen_media_groups.setdefault(key, []).append(message)
-                        
-                        # 🔧 修复：更积极的触发策略，避免媒体组被拆分
-                        messages = listen_media_groups[key]
-                        should_process = False
-                        
-                        # 🔧 调整：更保守的处理策略，确保媒体组完整
-                        if _is_media_group_complete(messages):
-                            should_process = True
-                            logging.info(f"🔍 媒体组 {message.media_group_id} 确认完整({len(messages)}条)，立即处理")
-                        elif len(messages) >= 20:  # 从10增加到20，避免大媒体组被强制处理
-                            should_process = True
-                            logging.info(f"🔍 媒体组 {message.media_group_id} 消息数过多({len(messages)}条)，强制处理")
-                        elif len(messages) >= 1 and time.time() - getattr(messages[0], 'date', time.time()).timestamp() > 15:
-                            # 🔧 从5秒增加到15秒，给媒体组足够的收集时间
-                            should_process = True
-                            logging.info(f"🔍 媒体组 {message.media_group_id} 等待超时({len(messages)}条，15秒)，强制处理")
-                        
-                        if not should_process:
-                            logging.debug(f"🔍 媒体组 {message.media_group_id} 等待更多消息({len(messages)}条)")
-                            # 🔧 重要：如果不处理，需要取消处理状态标记
-                            mark_media_group_completed(message.media_group_id)
-                            return
-                            
-                        # 🔧 先移除缓存，防止清理线程重复处理
-                        group_messages = sorted(listen_media_groups.pop(key), key=lambda m: (m.id, getattr(m, 'date', 0)))
-                        
-                    # 🔧 媒体组处理逻辑继续...
-                    logging.info(f"📦 准备处理媒体组 {message.media_group_id}，最终包含 {len(group_messages)} 条消息")
-                    
-                    # 过滤整组
-                    logging.info(f"🔍 实时监听: 开始过滤检查媒体组 {message.media_group_id}，包含 {len(group_messages)} 条消息")
-                    filtered_messages = [m for m in group_messages if should_filter_message(m, cfg)]
-                    if filtered_messages:
-                        logging.info(f"🚫 实时监听: 媒体组 {message.media_group_id} 中有 {len(filtered_messages)} 条消息被过滤，跳过整组")
-                        continue
-                    logging.info(f"✅ 实时监听: 媒体组 {message.media_group_id} 通过过滤检查，继续处理")
-                    
-                    # 实时监听媒体组去重检查 - 改进版
-                    cache_key = (message.chat.id, pair['target'])
-                    if cache_key not in realtime_dedupe_cache:
-                        realtime_dedupe_cache[cache_key] = set()
-                    
-                    # 生成基于消息范围和数量的去重键，而非仅 media_group_id
-                    first_id = min(m.id for m in group_messages)
-                    last_id = max(m.id for m in group_messages)
-                    media_group_dedup_key = ("media_group", message.media_group_id, first_id, last_id, len(group_messages))
-                    
-                    if media_group_dedup_key in realtime_dedupe_cache[cache_key]:
-                        logging.debug(f"实时监听: 跳过重复媒体组 {message.media_group_id} ({first_id}-{last_id}, {len(group_messages)}条)")
-                        continue
-                    realtime_dedupe_cache[cache_key].add(media_group_dedup_key)
-                    
-                    media_list = []
-                    caption = ""
-                    reply_markup = None
-                    full_text_content = ""  # 收集所有文本内容
-                    
-                    # 收集媒体组中的所有文本内容（实时监听版本）
-                    for m in group_messages:
-                        # 收集caption和text
-                        if m.caption or m.text:
-                            text_content = m.caption or m.text
-                            if text_content.strip() and text_content not in full_text_content:
-                                if full_text_content:
-                                    full_text_content += "\n\n" + text_content
-                                else:
-                                    full_text_content = text_content
-                        
-                        # 收集引用的文本内容
-                        if m.reply_to_message and m.reply_to_message.text:
-                            quoted_text = m.reply_to_message.text
-                            if quoted_text.strip() and quoted_text not in full_text_content:
-                                # 添加引用标记
-                                quoted_format = f"💬 引用消息：\n{quoted_text}"
-                                if full_text_content:
-                                    full_text_content = quoted_format + "\n\n" + full_text_content
-                                else:
-                                    full_text_content = quoted_format
-                    
-                    # 处理收集到的完整文本内容
-                    if full_text_content:
-                        caption, reply_markup = process_message_content(full_text_content, cfg)
-                    
-                    # 构建媒体列表
-                    for i, m in enumerate(group_messages):
-                        if m.photo:
-                            media_list.append(InputMediaPhoto(m.photo.file_id, caption=caption if i == 0 else ""))
-                        elif m.video:
-                            media_list.append(InputMediaVideo(m.video.file_id, caption=caption if i == 0 else ""))
-                    
-                    # 🔧 修复：处理包含媒体的媒体组
-                    if media_list:
-                        try:
-                            # 如果有按钮，将按钮文本添加到第一个媒体的caption中，避免分成两条消息
-                            if reply_markup and media_list:
-                                button_text = "\n\n📋 按钮："
-                                for row in reply_markup.inline_keyboard:
-                                    for button in row:
-                                        if hasattr(button, 'text') and hasattr(button, 'url') and button.text and button.url:
-                                            button_text += f"\n• {button.text}: {button.url}"
-                                
-                                # 将按钮信息添加到第一个媒体的caption中
-                                if media_list[0].caption:
-                                    media_list[0].caption += button_text
-                                else:
-                                    media_list[0].caption = button_text.strip()
-                            
-                            await client.send_media_group(chat_id=pair['target'], media=media_list)
-                            logging.info(f"✅ 媒体组发送成功: {len(group_messages)} 条消息 (包含 {len(media_list)} 个媒体)")
-                            
-                        except Exception as e:
-                            logging.error(f"媒体组 {message.media_group_id} 处理失败: {e}")
-                        finally:
-                            # 🔧 处理完成后清理状态
-                            cleanup_media_group_status(message.media_group_id)
-                            logging.info(f"🔓 媒体组 {message.media_group_id} 处理完成，释放锁")
-                    
-                    # 🔧 新增：处理纯文本媒体组（之前被忽略导致拆分的根本原因）
-                    else:
-                        try:
-                            # 纯文本媒体组：使用send_message发送合并后的文本内容
-                            if caption or full_text_content:
-                                final_text = caption or full_text_content
-                                
-                                # 如果有按钮，将按钮信息添加到文本中
-                                if reply_markup:
-                                    button_text = "\n\n📋 按钮："
-                                    for row in reply_markup.inline_keyboard:
-                                        for button in row:
-                                            if hasattr(button, 'text') and hasattr(button, 'url') and button.text and button.url:
-                                                button_text += f"\n• {button.text}: {button.url}"
-                                    final_text += button_text
-                                
-                                await client.send_message(
-                                    chat_id=pair['target'], 
-                                    text=final_text
-                                )
-                                logging.info(f"✅ 纯文本媒体组发送成功: {len(group_messages)} 条消息")
-                            else:
-                                logging.warning(f"⚠️ 媒体组无有效内容: {len(group_messages)} 条消息")
-                                
-                        except Exception as e:
-                            logging.error(f"纯文本媒体组 {message.media_group_id} 处理失败: {e}")
-                        finally:
-                            # 🔧 处理完成后清理状态
-                            cleanup_media_group_status(message.media_group_id)
-                            logging.info(f"🔓 纯文本媒体组 {message.media_group_id} 处理完成，释放锁")
-                    
-                    return
-                except Exception as e:
-                    logging.error(f"媒体组处理异常: {e}")
-                    # 🔧 异常情况下也要清理状态
-                    cleanup_media_group_status(message.media_group_id)
-                    logging.info(f"🔓 媒体组 {message.media_group_id} 异常处理完成，释放锁")
-                    return
         # 非媒体组单条
         logging.info(f"🔍 实时监听: 开始过滤检查消息 {message.id}")
         if should_filter_message(message, cfg):
@@ -3917,22 +3886,12 @@ async def listen_and_clone(client, message):
             
             # 实时监听去重检查（使用统一去重函数）
             cache_key = (message.chat.id, pair['target'])
-            if cache_key not in realtime_dedupe_cache:
-                realtime_dedupe_cache[cache_key] = set()
             
-            # 生成去重键并检查
+            # 生成去重键并检查（缓存按保留时间和数量上限自动淘汰最旧的条目）
             dedup_key = generate_dedupe_key(message, processed_text, cfg)
-            if dedup_key and dedup_key in realtime_dedupe_cache[cache_key]:
+            if dedup_key and realtime_dedupe_cache.check_and_add(cache_key, dedup_key):
                 logging.debug(f"实时监听: 跳过重复消息 {message.id} (类型: {dedup_key[0]})")
                 continue
-            elif dedup_key:
-                realtime_dedupe_cache[cache_key].add(dedup_key)
-            
-            # 限制缓存大小，防止内存泄漏
-            if len(realtime_dedupe_cache[cache_key]) > 10000:
-                # 清理最旧的一半缓存
-                cache_list = list(realtime_dedupe_cache[cache_key])
-                realtime_dedupe_cache[cache_key] = set(cache_list[5000:])
             
             # 处理引用信息（实时监听时暂不处理跨消息引用，因为目标消息可能不存在）
             reply_to_id = None
@@ -4003,30 +3962,20 @@ async def listen_and_clone(client, message):
             logging.info(f"实时监听: 消息内容长度: {len(processed_text or '')}")
             logging.info(f"实时监听: 消息类型: {'纯文本' if is_text_only else '媒体'}")
             
-            # 添加重试机制提高稳定性
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    if is_text_only:
-                        logging.info(f"实时监听: 用户 {uid} 发送纯文本消息到 {pair['target']} (尝试 {attempt + 1}/{max_retries})")
-                        await client.send_message(chat_id=pair['target'], text=processed_text, reply_markup=safe_reply_markup, reply_to_message_id=reply_to_id)
-                    else:
-                        logging.info(f"实时监听: 用户 {uid} 复制媒体消息到 {pair['target']} (尝试 {attempt + 1}/{max_retries})")
-                        await client.copy_message(chat_id=pair['target'], from_chat_id=message.chat.id, message_id=message.id, caption=processed_text, reply_markup=safe_reply_markup, reply_to_message_id=reply_to_id)
-                    
-                    logging.info(f"实时监听: 用户 {uid} 成功搬运消息 {message.id} 到 {pair['target']}")
-                    break  # 成功则跳出重试循环
-                    
-                except Exception as send_error:
-                    if attempt == max_retries - 1:
-                        # 最后一次尝试失败，记录错误
-                        logging.error(f"实时监听最终失败: 用户 {uid}, 目标 {pair.get('target')}, 消息 {message.id}, 错误: {send_error}")
-                        raise send_error
-                    else:
-                        # 指数退避重试
-                        retry_delay = 2 ** attempt
-                        logging.warning(f"实时监听重试: 用户 {uid}, 尝试 {attempt + 1}/{max_retries}, {retry_delay}秒后重试, 错误: {send_error}")
-                        await asyncio.sleep(retry_delay)
+            # 放入目标频道的有序队列，由队列按顺序提交到发送调度器（实时优先级），
+            # FloodWait和网络错误的重试由调度器统一处理，不阻塞处理器
+            if is_text_only:
+                logging.info(f"实时监听: 用户 {uid} 发送纯文本消息到 {pair['target']}")
+                send_factory = partial(client.send_message, chat_id=pair['target'], text=processed_text, reply_markup=safe_reply_markup, reply_to_message_id=reply_to_id)
+            else:
+                logging.info(f"实时监听: 用户 {uid} 复制媒体消息到 {pair['target']}")
+                send_factory = partial(client.copy_message, chat_id=pair['target'], from_chat_id=message.chat.id, message_id=message.id, caption=processed_text, reply_markup=safe_reply_markup, reply_to_message_id=reply_to_id)
+            
+            realtime_send_queues.enqueue(
+                pair['target'],
+                partial(send_realtime_message, uid, pair['target'], message.id, send_factory),
+                f"用户 {uid} 消息 {message.id}"
+            )
         except Exception as e:
             logging.error(f"监听搬运单条失败: 用户 {uid}, 目标 {pair.get('target')}, 错误: {e}")
 
@@ -6599,95 +6548,11 @@ def quick_filter_check(message, config):
     return False
 
 def should_filter_message(message, config):
-    """判断消息是否应该被过滤"""
-    # 新增：评论区搬运控制
-    enable_comment_forwarding = config.get("enable_comment_forwarding", False)
-    
-    # 如果关闭评论区搬运，只搬运频道主发布的内容
-    if not enable_comment_forwarding:
-        # 检查消息是否来自频道主
-        # 频道主发布的消息通常没有 from_user 字段，或者 from_user 是频道本身
-        if hasattr(message, 'from_user') and message.from_user:
-            # 如果消息有发送者信息，说明可能是评论或回复
-            logging.debug(f"消息 {message.id} 被评论区过滤: 非频道主发布 (from_user: {message.from_user.id})")
-            return True
-        else:
-            # 没有 from_user 字段，通常是频道主发布的内容
-            logging.debug(f"消息 {message.id} 通过评论区过滤: 频道主发布")
-    
-    # 新增：只搬运频道主信息
-    if config.get("channel_owner_only", False):
-        # 检查消息是否来自频道主
-        if hasattr(message, 'from_user') and message.from_user:
-            # 如果消息有发送者信息，说明不是频道主发布的
-            logging.debug(f"消息 {message.id} 被频道主过滤: 非频道主发布")
-            return True
-    
-    # 新增：只搬运媒体内容
-    if config.get("media_only_mode", False):
-        # 检查消息是否包含媒体内容
-        has_media = any([
-            message.photo,
-            message.video,
-            message.video_note,
-            message.animation,
-            message.document,
-            message.audio,
-            message.voice,
-            message.sticker
-        ])
-        
-        if not has_media:
-            logging.debug(f"消息 {message.id} 被媒体过滤: 不包含媒体内容")
-            return True
-    
-    # 关键字过滤
-    filter_keywords = config.get("filter_keywords", [])
-    text_to_check = ""
-    if message.caption:
-        text_to_check += message.caption.lower()
-    if message.text:
-        text_to_check += message.text.lower()
-    
-    # 添加详细的过滤日志和类型检查
-    if filter_keywords and isinstance(filter_keywords, (list, tuple)):
-        logging.debug(f"🔍 过滤检查: 消息ID {message.id}, 文本长度: {len(text_to_check)}")
-        logging.debug(f"🔍 过滤检查: 关键词数量: {len(filter_keywords)}")
-        
-        # 检查每个关键词
-        for keyword in filter_keywords:
-            if isinstance(keyword, str) and keyword.lower() in text_to_check:
-                logging.info(f"🚫 消息 {message.id} 被关键字过滤: '{keyword}' 匹配文本")
-                return True
-        
-        logging.debug(f"✅ 消息 {message.id} 通过关键字过滤检查")
-    else:
-        if filter_keywords and not isinstance(filter_keywords, (list, tuple)):
-            logging.warning(f"⚠️ 过滤检查: filter_keywords 类型错误，期望列表，实际: {type(filter_keywords)}, 值: {filter_keywords}")
-        logging.debug(f"⚠️ 消息 {message.id} 过滤检查: 未配置关键词或类型错误")
-    
-    # 过滤带按钮的消息（支持策略）
-    filter_buttons_enabled = config.get("filter_buttons")
-    filter_buttons_mode = config.get("filter_buttons_mode", "drop")  # drop | strip | whitelist
-    if filter_buttons_enabled and getattr(message, "reply_markup", None):
-        if filter_buttons_mode == "drop":
-            return True
-
-    # 文件类型过滤
-    filter_extensions = config.get("file_filter_extensions", [])
-    if message.document and filter_extensions and isinstance(filter_extensions, (list, tuple)):
-        filename = getattr(message.document, 'file_name', '')
-        if filename and '.' in filename:
-            ext = filename.lower().rsplit('.', 1)[1]
-            if ext in filter_extensions:
-                return True
-
-    # 媒体类型过滤
-    if message.photo and config.get("filter_photo"):
+    """判断消息是否应该被过滤（与搬运引擎共用编译后的过滤谓词）"""
+    reason = get_message_filter(config).match(message)
+    if reason is not None:
+        logging.debug(f"🚫 消息 {message.id} 被过滤: {reason}")
         return True
-    if message.video and config.get("filter_video"):
-        return True
-
     return False
 
 async def safe_send_button_message(client, chat_id, reply_markup, context="媒体组"):
@@ -7257,73 +7122,19 @@ def process_message_content(text, config, message_index=0):
     if not text:
         return "", None
 
-    # 敏感词替换
-    replacements = config.get("replacement_words", {})
-    for old, new in replacements.items():
-        text = text.replace(old, new)
-        
-    # 移除超链接
-    if config.get("remove_links"):
-        remove_mode = config.get("remove_links_mode", "links_only")
-        
-        if remove_mode == "whole_text":
-            # 如果文本包含超链接，则整个文本都被移除
-            if re.search(r'https?://[^\s/$.?#].[^\s]*', text, flags=re.MULTILINE):
-                text = ""  # 整个文本被移除
-                logging.info(f"🔗 超链接过滤: 文本包含超链接，整个文本被移除")
-        else:  # links_only 模式
-            # 只移除超链接，保留其他文本
-            text = re.sub(r'https?://[^\s/$.?#].[^\s]*', '', text, flags=re.MULTILINE)
-            logging.info(f"🔗 超链接过滤: 只移除超链接，保留其他文本")
-        
-    # 移除Hashtags
-    if config.get("remove_hashtags"):
-        text = re.sub(r'#\w+', '', text)
-        
-    # 移除使用者名称
-    if config.get("remove_usernames"):
-        text = re.sub(r'@\w+', '', text)
+    # 敏感词替换后移除链接/用户名/标签（按配置编译的流水线，配置不变时复用）
+    pipeline = get_text_pipeline(config)
+    text = pipeline.clean(text, replace_first=True)
 
     # 处理小尾巴（根据频率控制）
-    tail_text = config.get("tail_text", "").strip()
     tail_position = config.get("tail_position", "none")
-    if tail_text and should_add_tail_text(config, message_index):
-        if tail_position == "top":
-            text = f"{tail_text}\n\n{text}"
-        elif tail_position == "bottom":
-            text = f"{text}\n\n{tail_text}"
-
-    # 处理按钮（结合过滤策略和频率控制）
-    buttons_config = config.get("buttons", [])
-    if not should_add_buttons(config, message_index):
-        buttons_config = []  # 如果不应该添加按钮，清空按钮配置
-    filter_buttons_enabled = config.get("filter_buttons")
-    filter_buttons_mode = config.get("filter_buttons_mode", "drop")  # drop | strip | whitelist
-    whitelist_domains = set(config.get("button_domain_whitelist", []))
+    if pipeline.tail_text.strip() and tail_position in ("top", "bottom") and should_add_tail_text(config, message_index):
+        text = pipeline.add_tail(text)
+
+    # 处理按钮（结合过滤策略和频率控制，按钮已按过滤策略预先构建）
     reply_markup = None
-    if buttons_config:
-        # 如果启用了过滤并且策略是 strip，则不附加按钮；whitelist 则仅保留白名单域名的按钮
-        effective_buttons = buttons_config
-        if filter_buttons_enabled:
-            if filter_buttons_mode == "strip":
-                effective_buttons = []
-            elif filter_buttons_mode == "whitelist":
-                filtered = []
-                for b in buttons_config:
-                    try:
-                        url = b.get('url', '')
-                        # 粗略域名提取
-                        domain = url.split('//', 1)[-1].split('/', 1)[0].lower()
-                        if domain.startswith('www.'):
-                            domain = domain[4:]
-                        if domain in whitelist_domains:
-                            filtered.append(b)
-                    except:
-                        continue
-                effective_buttons = filtered
-        if effective_buttons:
-            keyboard = [[InlineKeyboardButton(button['text'], url=button['url'])] for button in effective_buttons]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+    if should_add_buttons(config, message_index):
+        reply_markup = pipeline.filtered_reply_markup
 
     return text.strip(), reply_markup
 
@@ -7342,6 +7153,38 @@ def process_message_content(text, config, message_index=0):
 
 
 # ==================== 新搬运引擎接口 ====================
+def create_fingerprint_store():
+    """按配置创建去重指纹的磁盘存储，使用默认内存存储时返回 None"""
+    if FINGERPRINT_BACKEND != "sqlite":
+        return None
+    try:
+        from fingerprint_store import SQLiteFingerprintStore
+        return SQLiteFingerprintStore(
+            get_config_path(FINGERPRINT_DB_PATH),
+            max_age_days=FINGERPRINT_MAX_AGE_DAYS or None,
+            max_per_pair=FINGERPRINT_MAX_PER_PAIR or None
+        )
+    except Exception as e:
+        logging.error(f"SQLite指纹存储初始化失败，回退为内存存储: {e}")
+        return None
+
+def get_robust_cloning_engine(client):
+    """获取（必要时初始化）全局搬运引擎，并启动重试队列的后台重放"""
+    global robust_cloning_engine
+    
+    if robust_cloning_engine is None:
+        # 🔧 新增：传递FloodWaitManager给搬运引擎
+        robust_cloning_engine = RobustCloningEngine(
+            client=client,
+            flood_wait_manager=flood_wait_manager,  # 传递统一管理器
+            send_scheduler=send_scheduler,  # 历史搬运以最低优先级提交到发送调度器
+            retry_queue=retry_queue,  # 长时间FloodWait放弃的消息进入重试队列
+            fingerprint_store=create_fingerprint_store()
+        )
+        logging.info("✅ 搬运引擎已初始化并集成统一FloodWait管理")
+    robust_cloning_engine.start_retry_drain()
+    return robust_cloning_engine
+
 @monitor_performance('start_cloning_with_new_engine')
 async def start_cloning_with_new_engine(client, message, user_id, task):
     """使用新引擎的搬运流程"""
@@ -7356,13 +7199,7 @@ async def start_cloning_with_new_engine(client, message, user_id, task):
         return
     
     # 初始化新搬运引擎
-    if robust_cloning_engine is None:
-        # 🔧 新增：传递FloodWaitManager给搬运引擎
-        robust_cloning_engine = RobustCloningEngine(
-            client=client,
-            flood_wait_manager=flood_wait_manager  # 传递统一管理器
-        )
-        logging.info("✅ 搬运引擎已初始化并集成统一FloodWait管理")
+    get_robust_cloning_engine(client)
     
     # 保存原始任务，避免变量名冲突
     original_task = task
@@ -7620,6 +7457,7 @@ async def start_cloning_with_new_engine(client, message, user_id, task):
                 # 强制设置更频繁的进度更新
                 enhanced_config = effective_config.copy()  # ✅ 使用频道组专用配置
                 enhanced_config["force_frequent_updates"] = True  # 标记强制频繁更新
+                enhanced_config["owner_user_id"] = str(user_id)  # 重试队列按用户归属
                 
                 sub_stats = await robust_cloning_engine.clone_messages_robust(
                     source_chat_id=source,
@@ -7932,6 +7770,11 @@ async def start_cloning_with_new_engine(client, message, user_id, task):
 def signal_handler(signum, frame):
     """信号处理器，优雅停止机器人"""
     logging.info("收到停止信号，正在关闭机器人...")
+    try:
+        realtime_dedupe_cache.save()
+    except Exception as e:
+        logging.error(f"保存实时去重缓存失败: {e}")
+    retry_queue.save()
     try:
         if app.is_connected:
             app.stop()
@@ -8678,8 +8521,12 @@ if __name__ == "__main__":
             save_history()
             save_running_tasks()
             save_user_states()
+            retry_queue.save()
             if NEW_ENGINE_AVAILABLE and robust_cloning_engine:
                 robust_cloning_engine.deduplicator.save_fingerprints()
+                if robust_cloning_engine.deduplicator.store is not None:
+                    # 等待写线程提交剩余指纹
+                    robust_cloning_engine.deduplicator.store.close()
             
             # 保存性能统计
             if performance_stats:
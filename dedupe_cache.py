@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+实时监听去重缓存（按频道对的 TTL + LRU）
+每个 (源频道, 目标频道) 一个按最近使用时间排序的 OrderedDict：查找、插入、淘汰均为 O(1)，
+超过保留时间或数量上限时从最旧的一端淘汰。可选用追加日志持久化，重启后不会重复搬运最近的消息
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from journal import AppendJournal
+
+PairKey = Tuple[Any, Any]
+
+class RealtimeDedupeCache:
+    """按频道对的 TTL + LRU 去重缓存
+    
+    每个频道对的条目按最近一次出现的时间排列（最旧的在前）：再次出现的内容刷新时间并移到末尾，
+    过期条目和超出 max_per_pair 的最旧条目从前端淘汰。去重键为由字符串/数字组成的元组。
+    """
+    
+    def __init__(self, ttl_seconds: float = 86400, max_per_pair: int = 10000,
+                 persist_path: Optional[str] = None, flush_interval: float = 5.0):
+        self.ttl_seconds = ttl_seconds
+        self.max_per_pair = max_per_pair
+        self.flush_interval = flush_interval
+        self.pairs: Dict[PairKey, "OrderedDict[Hashable, float]"] = {}
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+        self.journal = AppendJournal(persist_path) if persist_path else None
+        self.last_flush = time.time()
+        if self.journal is not None:
+            self._load()
+    
+    def _touch(self, pair_key: PairKey, key: Hashable, timestamp: float):
+        entries = self.pairs.get(pair_key)
+        if entries is None:
+            entries = self.pairs[pair_key] = OrderedDict()
+        entries.pop(key, None)
+        entries[key] = timestamp
+    
+    def _evict(self, pair_key: PairKey, now: float):
+        """淘汰过期条目和超出数量上限的最旧条目"""
+        entries = self.pairs.get(pair_key)
+        if not entries:
+            return
+        while entries:
+            key, timestamp = next(iter(entries.items()))
+            if now - timestamp > self.ttl_seconds:
+                self.stats["expired"] += 1
+            elif len(entries) > self.max_per_pair:
+                self.stats["evicted"] += 1
+            else:
+                break
+            del entries[key]
+        if not entries:
+            del self.pairs[pair_key]
+    
+    def check_and_add(self, pair_key: PairKey, key: Hashable) -> bool:
+        """检查去重键是否在保留时间内出现过：出现过返回 True（并刷新时间），否则记录后返回 False"""
+        now = time.time()
+        self._evict(pair_key, now)
+        entries = self.pairs.get(pair_key)
+        seen = entries is not None and key in entries
+        self.stats["hits" if seen else "misses"] += 1
+        
+        self._touch(pair_key, key, now)
+        self._evict(pair_key, now)
+        if self.journal is not None:
+            self.journal.append([list(pair_key), list(key), now])
+            if now - self.last_flush >= self.flush_interval:
+                self.save()
+        return seen
+    
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self.pairs.values())
+    
+    def _snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            "entries": [
+                [list(pair_key), list(key), timestamp]
+                for pair_key, entries in self.pairs.items()
+                for key, timestamp in entries.items()
+                if now - timestamp <= self.ttl_seconds
+            ]
+        }
+    
+    def _load(self):
+        """载入快照并重放日志（记录按时间顺序写入，重放时保持 LRU 顺序）"""
+        try:
+            snapshot = self.journal.load_snapshot() or {}
+            records = sorted(snapshot.get("entries", []), key=lambda record: record[2])
+            for pair_key, key, timestamp in records:
+                self._touch(tuple(pair_key), tuple(key), timestamp)
+            for pair_key, key, timestamp in self.journal.replay():
+                self._touch(tuple(pair_key), tuple(key), timestamp)
+        except Exception as e:
+            logging.error(f"载入实时去重缓存失败: {e}")
+            return
+        now = time.time()
+        for pair_key in list(self.pairs):
+            self._evict(pair_key, now)
+        logging.info(f"实时去重缓存已载入: {len(self.pairs)} 个频道对，共 {len(self)} 条")
+    
+    def save(self):
+        """把新增记录写入日志，日志过长时压缩为快照"""
+        if self.journal is None:
+            return
+        self.last_flush = time.time()
+        self.journal.flush()
+        if self.journal.needs_compaction():
+            self.journal.compact(self._snapshot)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["pairs"] = len(self.pairs)
+        stats["cached"] = len(self)
+        return stats
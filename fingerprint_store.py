@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite 指纹存储（WAL 模式）
+为 MessageDeduplicator 提供可选的磁盘后端：按 (频道对, 内容哈希, 媒体类型, 文件摘要) 建索引，
+内存中只保留少量热点指纹，可以对数月的历史去重而不占用大量内存。
+提交和清理在专用的写线程中执行，不阻塞事件循环
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+class SQLiteFingerprintStore:
+    """SQLite 指纹存储
+    
+    写入先在内存中累积，flush 时交给写线程（独立的连接）提交，调用方不等待；
+    提交完成前的指纹在 contains/contains_comment 中按内存记录判断。查询使用另一个连接，
+    WAL 模式下读不会被写线程的事务阻塞。保留策略按时间（max_age_days）和/或
+    每个频道对的数量（max_per_pair）在写线程中执行，两者为 None 时永久保留。
+    
+    file_id 列保存指纹的 file_key（file_unique_id 的64位摘要），没有文件时为空字符串。
+    """
+    
+    def __init__(self, db_path: str = "message_fingerprints.db", max_age_days: Optional[float] = 90,
+                 max_per_pair: Optional[int] = None, prune_interval: float = 3600):
+        self.db_path = db_path
+        self.max_age_days = max_age_days
+        self.max_per_pair = max_per_pair
+        self.prune_interval = prune_interval
+        self.last_prune = 0.0
+        
+        # 还没有交给写线程的行，以及尚未提交的指纹（查找键 -> 未提交的行数）
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []
+        self._uncommitted: Dict[tuple, int] = {}
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fingerprint-writer")
+        self._write_conn: Optional[sqlite3.Connection] = None
+        
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                pair_key TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                media_type TEXT NOT NULL,
+                file_id TEXT NOT NULL DEFAULT '',
+                is_comment INTEGER NOT NULL DEFAULT 0,
+                comment_user_id INTEGER NOT NULL DEFAULT 0,
+                message_id INTEGER,
+                chat_id INTEGER,
+                timestamp REAL NOT NULL,
+                version INTEGER NOT NULL DEFAULT 1
+            )
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(fingerprints)")}
+        if "version" not in columns:
+            # 早期创建的数据库没有版本列，已有记录视为第1版
+            self.conn.execute("ALTER TABLE fingerprints ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        self.conn.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_fingerprint_lookup
+            ON fingerprints (pair_key, content_hash, media_type, file_id, is_comment, comment_user_id)
+        """)
+        self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_fingerprint_age
+            ON fingerprints (pair_key, timestamp)
+        """)
+        self.conn.commit()
+        logging.info(f"SQLite指纹存储已打开: {db_path}（共 {self.count()} 条）")
+    
+    @staticmethod
+    def _file_key(fingerprint):
+        return "" if fingerprint.file_key is None else fingerprint.file_key
+    
+    @staticmethod
+    def _lookup_key(row: tuple) -> tuple:
+        """行对应的查找键，与 contains/contains_comment 的查询条件一致"""
+        pair_key, content_hash, media_type, file_id, is_comment, comment_user_id = row[:6]
+        if is_comment:
+            return ("comment", pair_key, content_hash, comment_user_id)
+        return ("main", pair_key, content_hash, media_type, file_id)
+    
+    def _is_uncommitted(self, key: tuple) -> bool:
+        with self._lock:
+            return key in self._uncommitted
+    
+    def contains(self, pair_key: str, fingerprint) -> bool:
+        """主消息精确匹配（内容哈希 + 媒体类型 + 文件摘要）"""
+        if self._is_uncommitted(("main", pair_key, fingerprint.content_hash, fingerprint.media_type,
+                                 self._file_key(fingerprint))):
+            return True
+        row = self.conn.execute(
+            "SELECT 1 FROM fingerprints WHERE pair_key=? AND content_hash=? AND media_type=? "
+            "AND file_id=? AND is_comment=0 LIMIT 1",
+            (pair_key, fingerprint.content_hash, fingerprint.media_type, self._file_key(fingerprint))
+        ).fetchone()
+        return row is not None
+    
+    def contains_comment(self, pair_key: str, fingerprint) -> bool:
+        """评论匹配（同一用户 + 相同内容）"""
+        if self._is_uncommitted(("comment", pair_key, fingerprint.content_hash, fingerprint.comment_user_id or 0)):
+            return True
+        row = self.conn.execute(
+            "SELECT 1 FROM fingerprints WHERE pair_key=? AND content_hash=? AND is_comment=1 "
+            "AND comment_user_id=? LIMIT 1",
+            (pair_key, fingerprint.content_hash, fingerprint.comment_user_id or 0)
+        ).fetchone()
+        return row is not None
+    
+    def add(self, pair_key: str, fingerprint):
+        """写入（或刷新时间戳），在下一次 flush 时提交"""
+        row = (pair_key, fingerprint.content_hash, fingerprint.media_type, self._file_key(fingerprint),
+               int(bool(fingerprint.is_comment)), fingerprint.comment_user_id or 0,
+               fingerprint.message_id, fingerprint.chat_id, fingerprint.timestamp, fingerprint.version)
+        key = self._lookup_key(row)
+        with self._lock:
+            self._pending.append(row)
+            self._uncommitted[key] = self._uncommitted.get(key, 0) + 1
+    
+    @property
+    def pending_writes(self) -> int:
+        with self._lock:
+            return len(self._pending)
+    
+    def flush(self) -> int:
+        """把累积的写入交给写线程提交（不等待完成），按间隔执行保留策略，返回交出的条数"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        prune = time.time() - self.last_prune >= self.prune_interval
+        if prune:
+            self.last_prune = time.time()
+        if not rows and not prune:
+            return 0
+        try:
+            self._writer.submit(self._write, rows, prune)
+        except RuntimeError as e:
+            # 写线程已关闭（正在退出）
+            logging.error(f"提交SQLite指纹失败: {e}")
+            return 0
+        return len(rows)
+    
+    def wait(self):
+        """等待已交给写线程的写入全部完成"""
+        try:
+            self._writer.submit(lambda: None).result()
+        except RuntimeError:
+            pass
+    
+    def _writer_connection(self) -> sqlite3.Connection:
+        """写线程的连接（只在写线程中创建和使用）"""
+        if self._write_conn is None:
+            self._write_conn = sqlite3.connect(self.db_path)
+            self._write_conn.execute("PRAGMA synchronous=NORMAL")
+        return self._write_conn
+    
+    def _write(self, rows: List[tuple], prune: bool):
+        """写线程：提交一批指纹，需要时执行保留策略"""
+        if rows:
+            try:
+                conn = self._writer_connection()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO fingerprints (pair_key, content_hash, media_type, file_id, is_comment, "
+                    "comment_user_id, message_id, chat_id, timestamp, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                conn.commit()
+            except Exception as e:
+                logging.error(f"提交SQLite指纹失败，将在下次保存时重试: {e}")
+                try:
+                    self._write_conn.rollback()
+                except Exception:
+                    pass
+                with self._lock:
+                    self._pending[:0] = rows
+                return
+            with self._lock:
+                for row in rows:
+                    key = self._lookup_key(row)
+                    remaining = self._uncommitted.get(key, 0) - 1
+                    if remaining > 0:
+                        self._uncommitted[key] = remaining
+                    else:
+                        self._uncommitted.pop(key, None)
+        if prune:
+            try:
+                self._prune(self._writer_connection())
+            except Exception as e:
+                logging.error(f"清理SQLite指纹失败: {e}")
+    
+    def prune(self) -> int:
+        """按时间和每个频道对的数量清理旧指纹（在写线程中执行并等待完成），返回删除条数"""
+        self.last_prune = time.time()
+        return self._writer.submit(lambda: self._prune(self._writer_connection())).result()
+    
+    def _prune(self, conn: sqlite3.Connection) -> int:
+        deleted = 0
+        if self.max_age_days:
+            cursor = conn.execute(
+                "DELETE FROM fingerprints WHERE timestamp < ?",
+                (time.time() - self.max_age_days * 86400,)
+            )
+            deleted += cursor.rowcount
+        if self.max_per_pair:
+            over_limit = conn.execute(
+                "SELECT pair_key FROM fingerprints GROUP BY pair_key HAVING COUNT(*) > ?",
+                (self.max_per_pair,)
+            ).fetchall()
+            for (pair_key,) in over_limit:
+                cursor = conn.execute(
+                    "DELETE FROM fingerprints WHERE rowid IN (SELECT rowid FROM fingerprints WHERE pair_key=? "
+                    "ORDER BY timestamp DESC LIMIT -1 OFFSET ?)",
+                    (pair_key, self.max_per_pair)
+                )
+                deleted += cursor.rowcount
+        conn.commit()
+        if deleted:
+            logging.info(f"🧹 SQLite指纹存储清理了 {deleted} 条过期指纹")
+        return deleted
+    
+    def upgrade(self, from_version: int, to_version: int, convert) -> int:
+        """迁移：把 from_version 的记录原地转换为 to_version（rowid 不变），返回转换条数
+        
+        convert(content_hash, media_type, file_id) 返回新的 (content_hash, media_type, file_id)。
+        """
+        rows = self.conn.execute(
+            "SELECT rowid, content_hash, media_type, file_id FROM fingerprints WHERE version=?",
+            (from_version,)
+        ).fetchall()
+        for rowid, content_hash, media_type, file_id in rows:
+            self.conn.execute(
+                "UPDATE OR REPLACE fingerprints SET content_hash=?, media_type=?, file_id=?, version=? WHERE rowid=?",
+                (*convert(content_hash, media_type, file_id), to_version, rowid)
+            )
+        self.conn.commit()
+        if rows:
+            logging.info(f"🔄 SQLite指纹存储已将 {len(rows)} 条第{from_version}版指纹转换为第{to_version}版")
+        return len(rows)
+    
+    def drop_outdated(self, version: int) -> int:
+        """迁移：删除旧版本格式的指纹（旧哈希无法与新哈希比较），返回删除条数"""
+        cursor = self.conn.execute("DELETE FROM fingerprints WHERE version < ?", (version,))
+        self.conn.commit()
+        if cursor.rowcount:
+            logging.info(f"🔄 SQLite指纹存储删除了 {cursor.rowcount} 条旧版本指纹")
+        return cursor.rowcount
+    
+    def max_rowid(self) -> int:
+        return self.conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM fingerprints").fetchone()[0]
+    
+    def iter_rows(self, after_rowid: int = 0):
+        """按写入顺序遍历 rowid 之后的指纹（用于重建布隆过滤器）"""
+        return self.conn.execute(
+            "SELECT rowid, pair_key, content_hash, media_type, file_id, is_comment, comment_user_id "
+            "FROM fingerprints WHERE rowid > ? ORDER BY rowid",
+            (after_rowid,)
+        )
+    
+    def count(self, pair_key: str = None) -> int:
+        if pair_key is None:
+            return self.conn.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM fingerprints WHERE pair_key=?", (pair_key,)).fetchone()[0]
+    
+    def _close_writer_connection(self):
+        if self._write_conn is not None:
+            self._write_conn.close()
+            self._write_conn = None
+    
+    def close(self):
+        """提交剩余写入并关闭（等待写线程完成）"""
+        try:
+            self.flush()
+            self._writer.submit(self._close_writer_connection)
+            self._writer.shutdown(wait=True)
+            self.conn.commit()
+            self.conn.close()
+        except Exception as e:
+            logging.error(f"关闭SQLite指纹存储失败: {e}")
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+追加写日志（快照 + 增量日志）
+检查点只追加新增记录并批量 fsync，写入量与新增工作量成正比；
+日志过长时在后台线程把全量数据写成新快照（原子替换）并截断日志
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Any, Callable, Iterator, List, Optional
+
+def atomic_write_bytes(file_path: str, data: bytes):
+    """先写临时文件并 fsync，再原子替换目标文件，中途崩溃不会损坏原文件"""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+def atomic_write_json(file_path: str, data: Any):
+    """原子写入JSON文件"""
+    atomic_write_bytes(file_path, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+class AppendJournal:
+    """快照文件 + 追加写日志
+    
+    文件布局：
+    - snapshot_path：全量快照（JSON；binary=True 时为 snapshot_builder 生成的二进制数据）
+    - snapshot_path + ".journal"：快照之后的增量记录，每行一个JSON
+    - snapshot_path + ".journal.compacting"：正在压缩的旧日志，压缩完成后删除
+    
+    记录重放必须是幂等的：压缩中途崩溃时旧日志会和新快照一起被重放。
+    """
+    
+    def __init__(self, snapshot_path: str, compact_threshold: int = 5000, binary: bool = False):
+        self.snapshot_path = snapshot_path
+        self.binary = binary
+        self.journal_path = f"{snapshot_path}.journal"
+        self.compacting_path = f"{snapshot_path}.journal.compacting"
+        self.compact_threshold = compact_threshold
+        self.pending: List[str] = []
+        self.journal_records = 0  # 当前日志中的记录数（用于判断是否需要压缩）
+        self._compact_thread: Optional[threading.Thread] = None
+    
+    def append(self, record: Any):
+        """记录一条增量（先缓冲在内存，flush 时批量写入）"""
+        self.pending.append(json.dumps(record, ensure_ascii=False, separators=(",", ":")))
+    
+    def flush(self, fsync: bool = True) -> int:
+        """把缓冲的记录追加到日志并 fsync，返回写入条数"""
+        if not self.pending:
+            return 0
+        lines, self.pending = self.pending, []
+        try:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                if fsync:
+                    os.fsync(f.fileno())
+        except Exception as e:
+            # 写入失败时放回缓冲区，下次检查点重试
+            self.pending = lines + self.pending
+            logging.error(f"写入日志 {self.journal_path} 失败: {e}")
+            return 0
+        self.journal_records += len(lines)
+        return len(lines)
+    
+    def load_snapshot(self) -> Any:
+        """读取快照，不存在时返回 None"""
+        if not os.path.exists(self.snapshot_path):
+            return None
+        if self.binary:
+            with open(self.snapshot_path, "rb") as f:
+                return f.read()
+        with open(self.snapshot_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    
+    def replay(self) -> Iterator[Any]:
+        """按写入顺序重放快照之后的记录（末尾写了一半的行会被忽略）"""
+        self.journal_records = 0
+        for path in (self.compacting_path, self.journal_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+            complete, _, torn = content.rpartition("\n")
+            if torn:
+                # 崩溃时写了一半的最后一行：截掉，避免后续追加的记录与它拼在一起
+                logging.warning(f"日志 {path} 末尾有不完整的记录，已截断")
+                with open(path, "r+", encoding="utf-8") as f:
+                    f.truncate(len(complete.encode("utf-8")) + (1 if complete else 0))
+            for line in complete.split("\n"):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.warning(f"跳过日志 {path} 中损坏的记录")
+                    continue
+                if path == self.journal_path:
+                    self.journal_records += 1
+                yield record
+    
+    def needs_compaction(self) -> bool:
+        return self.journal_records >= self.compact_threshold and not self.is_compacting()
+    
+    def is_compacting(self) -> bool:
+        return self._compact_thread is not None and self._compact_thread.is_alive()
+    
+    def compact(self, snapshot_builder: Callable[[], Any], background: bool = True):
+        """压缩：生成全量快照并截断日志
+        
+        snapshot_builder 在调用线程中执行（与追加记录在同一线程，数据一致）；
+        随后旧日志改名为 .compacting，新的记录写入新日志，快照在后台线程写入。
+        """
+        if self.is_compacting():
+            return
+        self.flush()
+        snapshot = snapshot_builder()
+        try:
+            if os.path.exists(self.journal_path):
+                if os.path.exists(self.compacting_path):
+                    # 上次压缩未完成：旧日志的记录已包含在本次快照中
+                    os.remove(self.compacting_path)
+                os.replace(self.journal_path, self.compacting_path)
+        except Exception as e:
+            logging.error(f"轮换日志 {self.journal_path} 失败: {e}")
+            return
+        self.journal_records = 0
+        
+        if background:
+            self._compact_thread = threading.Thread(target=self._write_snapshot, args=(snapshot,), daemon=True)
+            self._compact_thread.start()
+        else:
+            self._write_snapshot(snapshot)
+    
+    def _write_snapshot(self, snapshot: Any):
+        try:
+            if self.binary:
+                atomic_write_bytes(self.snapshot_path, snapshot)
+            else:
+                atomic_write_json(self.snapshot_path, snapshot)
+            if os.path.exists(self.compacting_path):
+                os.remove(self.compacting_path)
+            logging.debug(f"日志已压缩为快照: {self.snapshot_path}")
+        except Exception as e:
+            # 快照写入失败时保留 .compacting，下次加载仍会重放
+            logging.error(f"压缩日志 {self.journal_path} 失败: {e}")
+    
+    def wait_for_compaction(self, timeout: Optional[float] = None):
+        """等待后台压缩完成（退出前调用）"""
+        if self._compact_thread is not None:
+            self._compact_thread.join(timeout)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+媒体组聚合器（asyncio）
+实时监听收到的媒体组消息按 (频道ID, media_group_id) 缓存，每个媒体组一个防抖定时器：
+每收到一条新消息就重新计时，安静期结束或达到10条上限时一次性交给回调处理。
+安静期按源频道自适应：根据该频道相册内消息的到达间隔估计，间隔稳定的频道很快发送，
+出现迟到消息的频道自动放宽。可选在收到第一条消息时直接获取整个相册（一次请求），
+不必等待安静期。全部在事件循环中运行，不使用线程和锁
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+# Telegram 相册最多10条
+MAX_MEDIA_GROUP_ITEMS = 10
+
+# 自适应安静期的上下限（秒）
+MIN_QUIET_SECONDS = 0.3
+MAX_QUIET_SECONDS = 5.0
+
+# 记住最近交出的媒体组，用于识别迟到（或已随整组获取发出）的消息
+RECENT_FLUSHED_SIZE = 1024
+
+GroupKey = Tuple[Any, str]
+
+class PendingMediaGroup:
+    """正在收集的媒体组"""
+    
+    __slots__ = ("messages", "timer", "first_seen", "last_seen")
+    
+    def __init__(self, now: float):
+        self.messages: List[Any] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.first_seen = now
+        self.last_seen = now
+
+class ChannelArrivalStats:
+    """一个源频道的相册到达统计
+    
+    到达间隔的均值和平均偏差用指数加权估计（与 TCP 估计重传超时的方法相同），
+    安静期取 均值 + 4 × 偏差，限制在上下限之间；还没有样本时使用默认安静期。
+    """
+    
+    __slots__ = ("gap_mean", "gap_dev", "samples", "albums", "items", "full_flushes", "late_items")
+    
+    ALPHA = 0.125  # 均值的平滑系数
+    BETA = 0.25    # 偏差的平滑系数
+    
+    def __init__(self):
+        self.gap_mean = 0.0
+        self.gap_dev = 0.0
+        self.samples = 0
+        self.albums = 0
+        self.items = 0
+        self.full_flushes = 0
+        self.late_items = 0
+    
+    def observe_gap(self, gap: float):
+        """记录相册内相邻两条消息的到达间隔（秒）"""
+        if self.samples == 0:
+            self.gap_mean = gap
+            self.gap_dev = gap / 2
+        else:
+            error = gap - self.gap_mean
+            self.gap_mean += self.ALPHA * error
+            self.gap_dev += self.BETA * (abs(error) - self.gap_dev)
+        self.samples += 1
+    
+    def quiet_window(self, default: float, minimum: float, maximum: float) -> float:
+        if not self.samples:
+            return default
+        return min(maximum, max(minimum, self.gap_mean + 4 * self.gap_dev))
+    
+    def to_dict(self, default: float, minimum: float, maximum: float) -> Dict[str, Any]:
+        return {
+            "albums": self.albums,
+            "items": self.items,
+            "full_flushes": self.full_flushes,
+            "late_items": self.late_items,
+            "gap_samples": self.samples,
+            "gap_mean": round(self.gap_mean, 3),
+            "gap_dev": round(self.gap_dev, 3),
+            "quiet_window": round(self.quiet_window(default, minimum, maximum), 3),
+        }
+
+class MediaGroupAggregator:
+    """按媒体组防抖聚合消息
+    
+    on_flush(messages) 接收按消息ID排序的完整媒体组，在独立的任务中执行，
+    不阻塞收消息的处理器；同一媒体组只会交出一次（迟到的消息会另起一组，
+    并作为该频道的到达间隔样本，使之后的安静期变长）。
+    
+    设置 fetch_group(message) 时（返回该消息所在的整个相册，例如 client.get_media_group），
+    第一条消息到达就发起获取，同一媒体组的后续消息共享这次请求；获取成功后立即交出整组，
+    已随整组交出的消息之后再到达时直接丢弃。获取失败时退回安静期判断。
+    """
+    
+    def __init__(self, on_flush: Callable[[List[Any]], Awaitable[Any]],
+                 quiet_seconds: float = 1.0, max_items: int = MAX_MEDIA_GROUP_ITEMS,
+                 min_quiet_seconds: float = MIN_QUIET_SECONDS, max_quiet_seconds: float = MAX_QUIET_SECONDS,
+                 fetch_group: Optional[Callable[[Any], Awaitable[List[Any]]]] = None):
+        self.on_flush = on_flush
+        self.fetch_group = fetch_group
+        self.quiet_seconds = quiet_seconds
+        self.max_items = max_items
+        self.min_quiet_seconds = min(min_quiet_seconds, quiet_seconds)
+        self.max_quiet_seconds = max(max_quiet_seconds, quiet_seconds)
+        self.pending: Dict[GroupKey, PendingMediaGroup] = {}
+        self.channels: Dict[Any, ChannelArrivalStats] = {}
+        # 媒体组 -> (最后一条消息的到达时间, 已交出的消息ID)
+        self._recent_flushed: "OrderedDict[GroupKey, Tuple[float, frozenset]]" = OrderedDict()
+        self._fetches: Dict[GroupKey, asyncio.Task] = {}  # 进行中的整组获取
+        self._flush_tasks: Set[asyncio.Task] = set()
+        self.stats = {"groups": 0, "messages": 0, "flushed_full": 0, "flushed_quiet": 0, "flushed_fetched": 0,
+                      "fetch_failures": 0, "late_items": 0, "already_sent": 0}
+    
+    def _channel(self, chat_id) -> ChannelArrivalStats:
+        channel = self.channels.get(chat_id)
+        if channel is None:
+            channel = self.channels[chat_id] = ChannelArrivalStats()
+        return channel
+    
+    def quiet_window(self, chat_id) -> float:
+        """该源频道当前的安静期（秒）"""
+        channel = self.channels.get(chat_id)
+        if channel is None:
+            return self.quiet_seconds
+        return channel.quiet_window(self.quiet_seconds, self.min_quiet_seconds, self.max_quiet_seconds)
+    
+    def add(self, message) -> bool:
+        """加入一条媒体组消息（必须在事件循环中调用），开始收集一个新的媒体组时返回 True"""
+        chat_id = message.chat.id
+        key = (chat_id, message.media_group_id)
+        now = time.monotonic()
+        channel = self._channel(chat_id)
+        channel.items += 1
+        self.stats["messages"] += 1
+        
+        group = self.pending.get(key)
+        is_new = group is None
+        if group is None:
+            flushed = self._recent_flushed.get(key)
+            if flushed is not None and message.id in flushed[1]:
+                # 已随整组获取发出
+                self.stats["already_sent"] += 1
+                return False
+            flushed_at = flushed[0] if flushed is not None else None
+            if flushed_at is not None:
+                # 媒体组已经发出后才到达：安静期太短，把这次间隔作为样本
+                channel.late_items += 1
+                self.stats["late_items"] += 1
+                channel.observe_gap(min(now - flushed_at, self.max_quiet_seconds))
+                logging.warning(f"⚠️ 媒体组 {key[1]} 有消息在发送后到达（迟到 {now - flushed_at:.1f}s），"
+                                f"频道 {chat_id} 的安静期调整为 {self.quiet_window(chat_id):.1f}s")
+            group = self.pending[key] = PendingMediaGroup(now)
+            if self.fetch_group is not None and key not in self._fetches:
+                task = asyncio.get_running_loop().create_task(self._fetch(key, message))
+                self._fetches[key] = task
+        else:
+            channel.observe_gap(min(now - group.last_seen, self.max_quiet_seconds))
+        group.messages.append(message)
+        group.last_seen = now
+        
+        if group.timer is not None:
+            group.timer.cancel()
+            group.timer = None
+        
+        if len(group.messages) >= self.max_items:
+            channel.full_flushes += 1
+            self.stats["flushed_full"] += 1
+            self._flush(key, "已满")
+            return is_new
+        group.timer = asyncio.get_running_loop().call_later(self.quiet_window(chat_id), self._on_quiet, key)
+        return is_new
+    
+    def _on_quiet(self, key: GroupKey) -> None:
+        group = self.pending.get(key)
+        if group is None:
+            return
+        group.timer = None
+        if key in self._fetches:
+            # 整组获取仍在进行，由获取结果决定何时交出
+            return
+        self.stats["flushed_quiet"] += 1
+        self._flush(key, "安静期结束")
+    
+    async def _fetch(self, key: GroupKey, message) -> None:
+        """获取整个相册：成功后与已收到的消息合并并立即交出"""
+        try:
+            fetched = await asyncio.wait_for(self.fetch_group(message), timeout=self.max_quiet_seconds)
+        except Exception as e:
+            fetched = None
+            self.stats["fetch_failures"] += 1
+            logging.warning(f"⚠️ 获取媒体组 {key[1]} 失败，等待安静期: {e}")
+        finally:
+            self._fetches.pop(key, None)
+        
+        group = self.pending.get(key)
+        if group is None:
+            return
+        if fetched:
+            # 之前已交出的部分（迟到消息另起一组的情况）不再重复交出
+            flushed = self._recent_flushed.get(key)
+            sent = flushed[1] if flushed is not None else frozenset()
+            by_id = {m.id: m for m in fetched if m.id not in sent}
+            for m in group.messages:
+                by_id.setdefault(m.id, m)
+            group.messages = list(by_id.values())
+            self.stats["flushed_fetched"] += 1
+            self._flush(key, "已获取整组")
+        elif group.timer is None:
+            # 安静期已经结束
+            self.stats["flushed_quiet"] += 1
+            self._flush(key, "安静期结束")
+    
+    def _flush(self, key: GroupKey, reason: str) -> None:
+        group = self.pending.pop(key, None)
+        if group is None:
+            return
+        if group.timer is not None:
+            group.timer.cancel()
+        self.stats["groups"] += 1
+        self._channel(key[0]).albums += 1
+        previous = self._recent_flushed.get(key)
+        sent = frozenset(m.id for m in group.messages)
+        self._recent_flushed[key] = (group.last_seen, sent | previous[1] if previous is not None else sent)
+        self._recent_flushed.move_to_end(key)
+        if len(self._recent_flushed) > RECENT_FLUSHED_SIZE:
+            self._recent_flushed.popitem(last=False)
+        
+        messages = sorted(group.messages, key=lambda m: m.id)
+        logging.info(f"📦 媒体组 {key[1]} 收集完成({reason})：{len(messages)} 条，"
+                     f"首末消息间隔 {group.last_seen - group.first_seen:.1f}s")
+        task = asyncio.get_running_loop().create_task(self._run_flush(key, messages))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+    
+    async def _run_flush(self, key: GroupKey, messages: List[Any]) -> None:
+        try:
+            await self.on_flush(messages)
+        except Exception as e:
+            logging.error(f"❌ 处理媒体组 {key[1]} 失败: {e}")
+    
+    def get_channel_stats(self) -> Dict[Any, Dict[str, Any]]:
+        """各源频道的相册到达统计和当前安静期"""
+        return {
+            chat_id: channel.to_dict(self.quiet_seconds, self.min_quiet_seconds, self.max_quiet_seconds)
+            for chat_id, channel in self.channels.items()
+        }
+    
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats["pending_groups"] = len(self.pending)
+        stats["channels"] = self.get_channel_stats()
+        return stats
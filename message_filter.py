@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+编译后的消息过滤谓词
+把频道组的有效配置编译为一组按顺序执行的检查（便宜的检查在前，文本扫描放最后），
+实时监听和历史搬运引擎共用同一实现；编译结果按配置对象缓存，保存配置时失效
+"""
+
+import logging
+from array import array
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from text_pipeline import get_keyword_matcher
+
+# 视为"媒体消息"的属性
+MEDIA_ATTRIBUTES = ("photo", "video", "video_note", "animation", "document", "audio", "voice", "sticker")
+# MessageBatch.media_kinds 中的媒体类型编码
+MEDIA_KIND_NONE = 0
+MEDIA_KIND_PHOTO = MEDIA_ATTRIBUTES.index("photo") + 1
+MEDIA_KIND_VIDEO = MEDIA_ATTRIBUTES.index("video") + 1
+MEDIA_KIND_DOCUMENT = MEDIA_ATTRIBUTES.index("document") + 1
+
+def _has_sender(message) -> bool:
+    # 频道主发布的消息通常没有 from_user 字段，有发送者信息说明是评论或回复
+    return bool(getattr(message, "from_user", None))
+
+def _has_no_media(message) -> bool:
+    return not any(getattr(message, attr, None) for attr in MEDIA_ATTRIBUTES)
+
+def _has_buttons(message) -> bool:
+    return bool(getattr(message, "reply_markup", None))
+
+class MessageBatch:
+    """一批消息的列式表示（最多 200 条）
+    
+    过滤和分类需要的属性在构建时一次性提取为列：消息ID、媒体类型、是否有发送者、
+    是否带按钮、文本长度、媒体组ID、文档扩展名；之后的检查都在列上对整批执行。
+    无效消息（None 或缺少 id/chat）不进入批次，数量记录在 invalid。
+    """
+    
+    __slots__ = ("messages", "ids", "media_kinds", "has_from_user", "has_buttons",
+                 "text_lengths", "media_group_ids", "doc_extensions", "filter_reasons", "invalid")
+    
+    def __init__(self, messages: Iterable[Any] = ()):
+        self.messages: List[Any] = []
+        self.ids = array("q")
+        self.media_kinds = array("B")      # MEDIA_KIND_NONE 或 MEDIA_ATTRIBUTES 中的序号 + 1
+        self.has_from_user = bytearray()
+        self.has_buttons = bytearray()
+        self.text_lengths = array("l")
+        self.media_group_ids: List[Optional[str]] = []
+        self.doc_extensions: List[Optional[str]] = []
+        self.filter_reasons: Optional[List[Optional[str]]] = None
+        self.invalid = 0
+        
+        for message in messages:
+            if message is None or getattr(message, "id", None) is None or getattr(message, "chat", None) is None:
+                self.invalid += 1
+                continue
+            self.messages.append(message)
+            self.ids.append(message.id)
+            kind = MEDIA_KIND_NONE
+            for position, attr in enumerate(MEDIA_ATTRIBUTES, 1):
+                if getattr(message, attr, None):
+                    kind = position
+                    break
+            self.media_kinds.append(kind)
+            self.has_from_user.append(1 if getattr(message, "from_user", None) else 0)
+            self.has_buttons.append(1 if getattr(message, "reply_markup", None) else 0)
+            self.text_lengths.append(len(message.text or message.caption or ""))
+            self.media_group_ids.append(getattr(message, "media_group_id", None) or None)
+            extension = None
+            if kind == MEDIA_KIND_DOCUMENT:
+                filename = getattr(message.document, "file_name", "") or ""
+                if "." in filename:
+                    extension = filename.lower().rsplit(".", 1)[1]
+            self.doc_extensions.append(extension)
+    
+    def __len__(self) -> int:
+        return len(self.messages)
+    
+    def take(self, indexes: Iterable[int]) -> "MessageBatch":
+        """按下标取子批次（复用已提取的列，不再读取消息属性）"""
+        indexes = list(indexes)
+        subset = MessageBatch()
+        subset.messages = [self.messages[i] for i in indexes]
+        subset.ids = array("q", (self.ids[i] for i in indexes))
+        subset.media_kinds = array("B", (self.media_kinds[i] for i in indexes))
+        subset.has_from_user = bytearray(self.has_from_user[i] for i in indexes)
+        subset.has_buttons = bytearray(self.has_buttons[i] for i in indexes)
+        subset.text_lengths = array("l", (self.text_lengths[i] for i in indexes))
+        subset.media_group_ids = [self.media_group_ids[i] for i in indexes]
+        subset.doc_extensions = [self.doc_extensions[i] for i in indexes]
+        if self.filter_reasons is not None:
+            subset.filter_reasons = [self.filter_reasons[i] for i in indexes]
+        return subset
+    
+    def split_media_groups(self) -> Tuple[Dict[str, List[int]], List[int]]:
+        """分类：媒体组ID -> 下标列表（保持原顺序），以及单独消息的下标列表"""
+        media_groups: Dict[str, List[int]] = {}
+        standalone: List[int] = []
+        for index, media_group_id in enumerate(self.media_group_ids):
+            if media_group_id:
+                media_groups.setdefault(media_group_id, []).append(index)
+            else:
+                standalone.append(index)
+        return media_groups, standalone
+    
+    def apply_filter(self, message_filter: "MessageFilter") -> List[Optional[str]]:
+        """对整批执行过滤，结果（每条消息的过滤原因或 None）保存在 filter_reasons"""
+        self.filter_reasons = message_filter.match_batch(self)
+        return self.filter_reasons
+
+class MessageFilter:
+    """编译后的过滤谓词：任一检查命中即过滤
+    
+    checks 为 (原因, 单条检查, 整批检查) 列表，只包含配置中启用的检查，
+    处理消息时不再读取配置。整批检查接收 MessageBatch 和待检查的下标，
+    返回命中的下标集合。
+    """
+    
+    __slots__ = ("checks",)
+    
+    def __init__(self, config: Dict[str, Any]):
+        checks: List[Tuple[str, Callable[[Any], bool], Callable[[MessageBatch, Iterable[int]], Set[int]]]] = []
+        
+        # 发送者检查（评论区搬运控制 / 只搬运频道主信息）：只读一个属性
+        def sender_batch(batch, indexes):
+            column = batch.has_from_user
+            return {i for i in indexes if column[i]}
+        if not config.get("enable_comment_forwarding", False):
+            checks.append(("评论区过滤: 非频道主发布", _has_sender, sender_batch))
+        elif config.get("channel_owner_only", False):
+            checks.append(("频道主过滤: 非频道主发布", _has_sender, sender_batch))
+        
+        # 媒体类型过滤
+        def media_kind_batch(kind):
+            def batch_check(batch, indexes):
+                column = batch.media_kinds
+                return {i for i in indexes if column[i] == kind}
+            return batch_check
+        if config.get("filter_photo"):
+            checks.append(("图片过滤", lambda message: bool(message.photo), media_kind_batch(MEDIA_KIND_PHOTO)))
+        if config.get("filter_video"):
+            checks.append(("视频过滤", lambda message: bool(message.video), media_kind_batch(MEDIA_KIND_VIDEO)))
+        
+        # 过滤带按钮的消息（strip/whitelist 策略在文本处理时处理按钮，不过滤消息）
+        if config.get("filter_buttons") and config.get("filter_buttons_mode", "drop") == "drop":
+            def buttons_batch(batch, indexes):
+                column = batch.has_buttons
+                return {i for i in indexes if column[i]}
+            checks.append(("按钮过滤", _has_buttons, buttons_batch))
+        
+        # 只搬运媒体内容
+        if config.get("media_only_mode", False):
+            checks.append(("媒体过滤: 不包含媒体内容", _has_no_media, media_kind_batch(MEDIA_KIND_NONE)))
+        
+        # 文件类型过滤
+        filter_extensions = config.get("file_filter_extensions", [])
+        if filter_extensions and isinstance(filter_extensions, (list, tuple)):
+            extensions = frozenset(str(ext).lower().lstrip(".") for ext in filter_extensions)
+            
+            def extension_filtered(message) -> bool:
+                document = message.document
+                if not document:
+                    return False
+                filename = getattr(document, "file_name", "") or ""
+                return "." in filename and filename.lower().rsplit(".", 1)[1] in extensions
+            
+            def extension_batch(batch, indexes):
+                column = batch.doc_extensions
+                return {i for i in indexes if column[i] in extensions}
+            checks.append(("文件类型过滤", extension_filtered, extension_batch))
+        
+        # 关键字过滤：扫描文本，放在最后
+        filter_keywords = config.get("filter_keywords", [])
+        if filter_keywords and not isinstance(filter_keywords, (list, tuple)):
+            logging.warning(f"⚠️ 过滤检查: filter_keywords 类型错误，期望列表，实际: {type(filter_keywords)}, 值: {filter_keywords}")
+        keyword_matcher = get_keyword_matcher(filter_keywords)
+        if keyword_matcher is not None:
+            def keyword_filtered(message) -> bool:
+                text_to_check = ""
+                if message.caption:
+                    text_to_check += message.caption.lower()
+                if message.text:
+                    text_to_check += message.text.lower()
+                return keyword_matcher.search(text_to_check) is not None
+            
+            def keyword_batch(batch, indexes):
+                # 没有文本的消息不需要扫描
+                lengths, messages = batch.text_lengths, batch.messages
+                return {i for i in indexes if lengths[i] and keyword_filtered(messages[i])}
+            checks.append(("关键字过滤", keyword_filtered, keyword_batch))
+        
+        self.checks = checks
+    
+    def match(self, message) -> Optional[str]:
+        """返回命中的过滤原因，不需要过滤时返回 None"""
+        for reason, check, _ in self.checks:
+            if check(message):
+                return reason
+        return None
+    
+    def match_batch(self, batch: MessageBatch) -> List[Optional[str]]:
+        """对整批消息执行全部检查，返回与 batch.messages 对齐的过滤原因列表
+        
+        每个检查只作用于尚未被过滤的消息，命中的下标从候选集合中移除，
+        结果与逐条调用 match 相同。
+        """
+        reasons: List[Optional[str]] = [None] * len(batch)
+        candidates = set(range(len(batch)))
+        for reason, _, batch_check in self.checks:
+            if not candidates:
+                break
+            hits = batch_check(batch, candidates)
+            for index in hits:
+                reasons[index] = reason
+            candidates -= hits
+        return reasons
+    
+    def __call__(self, message) -> bool:
+        return self.match(message) is not None
+
+# 编译缓存：id(配置) -> (配置, 过滤谓词)；保留配置对象的引用，保证 id 不会被复用
+_filter_cache: "OrderedDict[int, Tuple[dict, MessageFilter]]" = OrderedDict()
+FILTER_CACHE_SIZE = 512
+
+def get_message_filter(config: Dict[str, Any]) -> MessageFilter:
+    """获取配置对应的过滤谓词（同一配置对象只编译一次，保存配置后重新编译）"""
+    key = id(config)
+    entry = _filter_cache.get(key)
+    if entry is not None and entry[0] is config:
+        _filter_cache.move_to_end(key)
+        return entry[1]
+    message_filter = MessageFilter(config)
+    _filter_cache[key] = (config, message_filter)
+    if len(_filter_cache) > FILTER_CACHE_SIZE:
+        _filter_cache.popitem(last=False)
+    return message_filter
+
+def invalidate_message_filters():
+    """配置修改后清空已编译的过滤谓词"""
+    _filter_cache.clear()
@@ -2,33 +2,104 @@
 # 专门解决重复消息问题的重新设计版本
 
 import asyncio
+import base64
+import bisect
 import logging
 import time
 import hashlib
 import json
 import os
 import re
+import struct
+import unicodedata
 from typing import Dict, List, Set, Tuple, Optional, Any
+from collections import OrderedDict
 from dataclasses import dataclass
-from pyrogram import Client
+from pyrogram import Client, raw
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 
-@dataclass
+from send_scheduler import PRIORITY_BULK, parse_flood_wait
+from journal import AppendJournal, atomic_write_json
+from bloom_filter import ScalableBloomFilter
+from text_pipeline import get_text_pipeline, normalize_button_url
+from message_filter import MessageBatch, get_message_filter
+
+# 指纹格式版本：3 = 紧凑二进制表示；2 = 完整文本的带密钥BLAKE2 + file_unique_id（可无损转换为第3版）；
+# 1 = 旧格式，包含消息ID，无法跨消息去重
+FINGERPRINT_VERSION = 3
+# 指纹哈希密钥：所有机器人使用相同密钥时可以共享去重结果
+FINGERPRINT_HASH_KEY = os.getenv("FINGERPRINT_HASH_KEY", "wangbybot-fingerprint").encode("utf-8")[:64]
+
+# SimHash：64位指纹，按8位分成8段；汉明距离不超过7的两个指纹至少有一段完全相同
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 8
+SIMHASH_BAND_BITS = SIMHASH_BITS // SIMHASH_BANDS
+
+def simhash64(text: str) -> Optional[int]:
+    """计算文本的64位SimHash（字符3-gram特征，兼容中文），空文本返回 None"""
+    normalized = re.sub(r"\s+", " ", text or "").strip().lower()
+    if not normalized:
+        return None
+    grams = [normalized[i:i + 3] for i in range(max(1, len(normalized) - 2))]
+    weights = [0] * SIMHASH_BITS
+    for gram in grams:
+        value = int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "little")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(SIMHASH_BITS) if weights[bit] > 0)
+
+def simhash_bands(value: int) -> List[Tuple[int, int]]:
+    """SimHash分段：(段号, 段值)"""
+    mask = (1 << SIMHASH_BAND_BITS) - 1
+    return [(band, value >> (band * SIMHASH_BAND_BITS) & mask) for band in range(SIMHASH_BANDS)]
+
+# 媒体类型编码（指纹中以小整数保存）
+MEDIA_TYPES = ("unknown", "text", "photo", "video", "document", "animation", "audio", "voice", "sticker")
+MEDIA_TYPE_CODES = {name: code for code, name in enumerate(MEDIA_TYPES)}
+
+def digest64(data: str) -> int:
+    """64位有符号摘要（可直接存入SQLite INTEGER）"""
+    return int.from_bytes(hashlib.blake2b(data.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+def convert_v2_fields(content_hash: str, media_type: str, file_id: Optional[str]) -> Tuple[int, int, Optional[int]]:
+    """第2版指纹字段（十六进制哈希、媒体类型名、file_unique_id）转换为第3版的紧凑表示"""
+    try:
+        content_hash = int.from_bytes(bytes.fromhex(content_hash), "big", signed=True)
+    except ValueError:
+        content_hash = digest64(content_hash)
+    return content_hash, MEDIA_TYPE_CODES.get(media_type, 0), digest64(file_id) if file_id else None
+
+# 二进制指纹快照：文件头后按频道对依次保存 (键长度, 指纹数量, 键, 定长指纹记录...)
+FINGERPRINT_SNAPSHOT_MAGIC = b"WBFP3"
+FINGERPRINT_SNAPSHOT_PAIR = struct.Struct("<HI")
+
+@dataclass(slots=True)
 class MessageFingerprint:
-    """消息指纹 - 用于精确去重"""
+    """消息指纹 - 用于精确去重
+    
+    紧凑表示：无 __dict__；内容哈希为64位整数，媒体类型为小整数编码，
+    文件以 file_unique_id 的64位摘要表示。二进制序列化见 pack/unpack。
+    """
     message_id: int
     chat_id: int
-    content_hash: str
-    media_type: str
-    file_id: Optional[str]
+    content_hash: int
+    media_type: int
+    file_key: Optional[int]
     timestamp: float
     # 新增：评论特殊标识
     is_comment: bool = False
     comment_user_id: Optional[int] = None
+    # 评论文本的SimHash，用于严格模式的近似重复检测
+    simhash: Optional[int] = None
+    # 指纹格式版本（旧文件中的记录没有该字段，视为第1版）
+    version: int = 1
+    
+    # 二进制记录：内容哈希、媒体类型、标志位、文件摘要、消息ID、频道ID、时间戳、评论用户ID、SimHash
+    RECORD = struct.Struct("<qBBqqqdqQ")
     
     def __hash__(self):
         """使对象可以被哈希，可以放入set中"""
-        return hash((self.content_hash, self.media_type, self.file_id))
+        return hash((self.content_hash, self.media_type, self.file_key))
     
     def __eq__(self, other):
         """定义相等比较 - 优化版本，支持评论去重"""
@@ -47,40 +118,114 @@ class MessageFingerprint:
         # 其他特征比较
         return (self.content_hash == other.content_hash and 
                 self.media_type == other.media_type and 
-                self.file_id == other.file_id)
+                self.file_key == other.file_key)
     
-    def to_dict(self):
-        return {
-            'message_id': self.message_id,
-            'chat_id': self.chat_id,
-            'content_hash': self.content_hash,
-            'media_type': self.media_type,
-            'file_id': self.file_id,
-            'timestamp': self.timestamp
-        }
+    def pack(self) -> bytes:
+        """序列化为定长二进制记录"""
+        flags = (int(bool(self.is_comment))
+                 | (self.file_key is not None) << 1
+                 | (self.comment_user_id is not None) << 2
+                 | (self.simhash is not None) << 3)
+        return self.RECORD.pack(
+            self.content_hash, self.media_type, flags, self.file_key or 0,
+            self.message_id, self.chat_id, self.timestamp,
+            self.comment_user_id or 0, self.simhash or 0
+        )
+    
+    @classmethod
+    def unpack(cls, record: bytes, offset: int = 0) -> "MessageFingerprint":
+        return cls.from_fields(cls.RECORD.unpack_from(record, offset))
+    
+    @classmethod
+    def from_fields(cls, fields: tuple) -> "MessageFingerprint":
+        """从 RECORD 解出的字段元组构造（批量加载时配合 RECORD.iter_unpack 使用）"""
+        (content_hash, media_type, flags, file_key, message_id, chat_id,
+         timestamp, comment_user_id, simhash) = fields
+        return cls(
+            message_id=message_id,
+            chat_id=chat_id,
+            content_hash=content_hash,
+            media_type=media_type,
+            file_key=file_key if flags & 2 else None,
+            timestamp=timestamp,
+            is_comment=bool(flags & 1),
+            comment_user_id=comment_user_id if flags & 4 else None,
+            simhash=simhash if flags & 8 else None,
+            version=FINGERPRINT_VERSION
+        )
     
     @classmethod
     def from_dict(cls, data):
+        """从旧版JSON记录恢复（第2版的十六进制哈希/媒体类型名/file_unique_id 会转换为紧凑表示）"""
+        data = dict(data)
+        data["content_hash"], data["media_type"], data["file_key"] = convert_v2_fields(
+            data["content_hash"], data["media_type"], data.pop("file_id", None)
+        )
+        if data.get("version", 1) == 2:
+            # 第2版与第3版哈希内容相同，只是表示方式不同
+            data["version"] = FINGERPRINT_VERSION
         return cls(**data)
 
 class MessageDeduplicator:
     """高精度消息去重器"""
     
-    def __init__(self, max_cache_size: int = 1000):
-        self.fingerprints: Dict[str, Set[MessageFingerprint]] = {}
+    def __init__(self, max_cache_size: int = 1000, store=None):
+        # 每个频道对按加入顺序保存指纹（最旧的在前），淘汰时从头部弹出，每次加入 O(1)
+        self.fingerprints: Dict[str, "OrderedDict[MessageFingerprint, MessageFingerprint]"] = {}
+        # 淘汰策略：每个频道对最多 max_cache_size 条，且不超过 max_age_seconds（与快照保留时间一致）
         self.max_cache_size = max_cache_size  # 限制缓存大小，防止内存溢出
-        self.cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
-        self.load_fingerprints()
+        self.max_age_seconds = 43200  # 12小时
+        self.cache_stats = {"hits": 0, "misses": 0, "store_hits": 0, "evictions": 0,
+                            "expired": 0, "bloom_negatives": 0}
+        # 评论索引：频道对 -> 用户ID -> {内容哈希: [SimHash, 引用数]}，精确匹配 O(1)
+        self._comment_index: Dict[str, Dict[int, Dict[int, list]]] = {}
+        # SimHash分段索引：频道对 -> (用户ID, 段号, 段值) -> {SimHash: 引用数}，严格模式只比较候选
+        self._simhash_index: Dict[str, Dict[Tuple[int, int, int], Dict[int, int]]] = {}
+        # 严格模式下判定为相似评论的最大汉明距离（短评论改动一两个词约为5-7位，无关内容约为32位）
+        self.simhash_max_distance = SIMHASH_BANDS - 1
+        # 可选的磁盘指纹存储（如 SQLiteFingerprintStore）：设置后内存中的指纹只作为热点缓存
+        self.store = store
+        # 指纹持久化：二进制快照 + 追加写日志，检查点只写入新增指纹（未使用磁盘存储时）
+        self.journal = AppendJournal("message_fingerprints.bin", binary=True)
+        # 旧版JSON格式的指纹文件，加载时迁移到二进制快照后删除
+        self.legacy_journal = AppendJournal("message_fingerprints.json")
+        # 每个频道对一个布隆过滤器，判定"一定不存在"时跳过磁盘存储查询（与磁盘存储一起启用）
+        self.bloom_filters: Dict[str, ScalableBloomFilter] = {}
+        self.bloom_save_interval = 300
+        self._bloom_dirty = False
+        self._bloom_saved_at = 0.0
+        if self.store is None:
+            self.load_fingerprints()
+        else:
+            self.bloom_path = f"{self.store.db_path}.bloom.json"
+            if self.store.upgrade(2, FINGERPRINT_VERSION, self._convert_store_row) and os.path.exists(self.bloom_path):
+                # 布隆过滤器中是旧格式的元素，需要从指纹存储重建
+                os.remove(self.bloom_path)
+            self.store.drop_outdated(FINGERPRINT_VERSION)
+            self._load_bloom_filters()
+    
+    @staticmethod
+    def _convert_store_row(content_hash: str, media_type: str, file_id: str) -> Tuple[int, int, Any]:
+        content_hash, media_type, file_key = convert_v2_fields(content_hash, media_type, file_id)
+        return content_hash, media_type, "" if file_key is None else file_key
+    
+    @staticmethod
+    def _normalize_text(text: str) -> str:
+        """文本归一化：NFKC（全角/半角统一）、合并空白、去除首尾空白"""
+        return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
     
-    def _generate_content_hash(self, message: Message, processed_text: str = None) -> str:
-        """生成内容哈希 - 优化版本，支持评论去重"""
-        # 快速特征提取
+    def _generate_content_hash(self, message: Message, processed_text: str = None) -> int:
+        """生成内容哈希（FINGERPRINT_VERSION 第3版）：完整文本和媒体 file_unique_id 的带密钥BLAKE2，
+        取64位有符号整数（第3版的紧凑表示；哈希内容与第2版的十六进制哈希相同）
+        
+        不包含消息ID，也不使用按进程加盐的 hash()，同一内容在不同消息、重启后以及不同机器人之间
+        得到相同的哈希。
+        """
         text_content = processed_text or message.text or message.caption or ""
         
-        # 基础特征
-        features = [f"id:{message.id}"]
+        features = []
         
-        # 新增：区分评论和主消息
+        # 区分评论和主消息
         if hasattr(message, 'from_user') and message.from_user:
             # 这是评论，添加用户ID作为特征
             features.append(f"comment_user:{message.from_user.id}")
@@ -89,53 +234,33 @@ class MessageDeduplicator:
             # 这是主消息
             features.append(f"comment_type:main")
         
-        if text_content.strip():
-            # 只使用文本长度和前50字符，提高性能
-            features.append(f"text_hash:{hash(text_content[:50])}")
-            features.append(f"len:{len(text_content)}")
+        normalized_text = self._normalize_text(text_content)
+        if normalized_text:
+            features.append(f"text:{normalized_text}")
         
-        # 增加更多特征以提高去重精度
         if message.forward_from:
             features.append(f"fwd:{message.forward_from.id}")
         if message.reply_to_message:
-            features.append(f"reply:{message.reply_to_message.id}")
-            # 新增：为回复添加更精确的特征
             features.append(f"reply_to_id:{message.reply_to_message.id}")
         
-        # 简化的媒体特征
-        if message.photo:
-            features.append(f"photo:{message.photo.file_id[-10:]}")
-        elif message.video:
-            features.append(f"video:{message.video.file_id[-10:]}")
-        elif message.document:
-            features.append(f"doc:{message.document.file_id[-10:]}")
-        elif message.animation:
-            features.append(f"gif:{message.animation.file_id[-10:]}")
+        # 媒体使用 file_unique_id（file_id 随机器人和会话变化）
+        media_type, unique_id = self._get_media_info(message)
+        if unique_id:
+            features.append(f"{media_type}:{unique_id}")
         
-        # 快速哈希
-        combined = "|".join(features)
-        return hashlib.md5(combined.encode('utf-8')).hexdigest()[:16]  # 使用MD5并截取16位，更快
+        combined = "\x1f".join(features)
+        digest = hashlib.blake2b(combined.encode('utf-8'), digest_size=8, key=FINGERPRINT_HASH_KEY).digest()
+        return int.from_bytes(digest, "big", signed=True)
     
     def _get_media_info(self, message: Message) -> Tuple[str, Optional[str]]:
-        """获取媒体类型和文件ID"""
-        if message.photo:
-            return "photo", message.photo.file_id
-        elif message.video:
-            return "video", message.video.file_id
-        elif message.document:
-            return "document", message.document.file_id
-        elif message.animation:
-            return "animation", message.animation.file_id
-        elif message.audio:
-            return "audio", message.audio.file_id
-        elif message.voice:
-            return "voice", message.voice.file_id
-        elif message.sticker:
-            return "sticker", message.sticker.file_id
-        elif message.text or message.caption:
+        """获取媒体类型和文件唯一ID（file_unique_id 对同一文件在所有机器人中相同）"""
+        for media_type in ("photo", "video", "document", "animation", "audio", "voice", "sticker"):
+            media = getattr(message, media_type, None)
+            if media:
+                return media_type, getattr(media, "file_unique_id", None) or media.file_id
+        if message.text or message.caption:
             return "text", None
-        else:
-            return "unknown", None
+        return "unknown", None
     
     def create_fingerprint(self, message: Message, processed_text: str = None) -> Optional[MessageFingerprint]:
         """创建消息指纹 - 优化版本，支持评论去重"""
@@ -146,22 +271,25 @@ class MessageDeduplicator:
             
         try:
             content_hash = self._generate_content_hash(message, processed_text)
-            media_type, file_id = self._get_media_info(message)
+            media_type, unique_id = self._get_media_info(message)
             
             # 新增：为评论添加特殊标识
             is_comment = hasattr(message, 'from_user') and message.from_user is not None
             comment_id = message.from_user.id if is_comment else None
+            comment_simhash = simhash64(processed_text or message.text or message.caption or "") if is_comment else None
             
             return MessageFingerprint(
                 message_id=message.id,
                 chat_id=message.chat.id,
                 content_hash=content_hash,
-                media_type=media_type,
-                file_id=file_id,
+                media_type=MEDIA_TYPE_CODES[media_type],
+                file_key=digest64(unique_id) if unique_id else None,
                 timestamp=time.time(),
                 # 新增：评论特殊标识
                 is_comment=is_comment,
-                comment_user_id=comment_id
+                comment_user_id=comment_id,
+                simhash=comment_simhash,
+                version=FINGERPRINT_VERSION
             )
         except Exception as e:
             logging.error(f"创建消息指纹失败: {e}")
@@ -172,8 +300,10 @@ class MessageDeduplicator:
         key = f"{source_chat_id}_{target_chat_id}"
         
         if key not in self.fingerprints:
-            self.fingerprints[key] = set()
-            return False
+            self.fingerprints[key] = OrderedDict()
+            if self.store is None:
+                self.cache_stats["misses"] += 1
+                return False
         
         # 新增：评论使用更宽松的去重规则
         if fingerprint.is_comment:
@@ -181,8 +311,20 @@ class MessageDeduplicator:
         
         # 主消息使用严格去重
         if fingerprint in self.fingerprints[key]:
-            logging.debug(f"发现重复主消息: {fingerprint.content_hash[:8]}...")
+            self.cache_stats["hits"] += 1
+            logging.debug(f"发现重复主消息: {fingerprint.content_hash & 0xffffffff:08x}...")
             return True
+        self.cache_stats["misses"] += 1
+        
+        # 热点缓存未命中时查询磁盘存储（布隆过滤器判定一定不存在时跳过查询）
+        if self.store is not None:
+            if not self._bloom_may_contain(key, fingerprint):
+                return False
+            if self.store.contains(key, fingerprint):
+                self.cache_stats["store_hits"] += 1
+                self._remember(key, fingerprint)
+                logging.debug(f"发现重复主消息（指纹存储）: {fingerprint.content_hash & 0xffffffff:08x}...")
+                return True
         
         return False
     
@@ -191,6 +333,7 @@ class MessageDeduplicator:
         key = f"{source_chat_id}_{target_chat_id}"
         
         if key not in self.fingerprints:
+            self.cache_stats["misses"] += 1
             return False
         
         # 评论去重规则：
@@ -202,44 +345,91 @@ class MessageDeduplicator:
         config = getattr(self, 'config', {})
         comment_dedup_mode = config.get('comment_dedup_mode', 'normal')  # normal, strict, loose
         
-        for existing_fp in self.fingerprints[key]:
-            if existing_fp.is_comment:
-                # 基础检查：用户ID + 内容完全匹配
-                if (existing_fp.comment_user_id == fingerprint.comment_user_id and
-                    existing_fp.content_hash == fingerprint.content_hash):
-                    logging.debug(f"发现重复评论: 用户 {fingerprint.comment_user_id} 的相同内容")
-                    return True
-                
-                # 严格模式：检查相似内容
-                if comment_dedup_mode == 'strict':
-                    # 检查内容相似度（简化版本）
-                    if existing_fp.comment_user_id == fingerprint.comment_user_id:
-                        # 如果同一用户发送了相似内容，可能是重复
-                        content_similarity = self._calculate_content_similarity(
-                            existing_fp.content_hash, fingerprint.content_hash
-                        )
-                        if content_similarity > 0.8:  # 80%相似度阈值
-                            logging.debug(f"严格模式：发现相似评论: 用户 {fingerprint.comment_user_id}")
-                            return True
+        # 基础检查：用户ID + 内容完全匹配（评论索引）
+        user_comments = self._comment_index.get(key, {}).get(fingerprint.comment_user_id)
+        if user_comments and fingerprint.content_hash in user_comments:
+            self.cache_stats["hits"] += 1
+            logging.debug(f"发现重复评论: 用户 {fingerprint.comment_user_id} 的相同内容")
+            return True
+        
+        # 严格模式：同一用户的近似重复内容（SimHash汉明距离）
+        if comment_dedup_mode == 'strict' and fingerprint.simhash is not None:
+            if self._find_similar_comment(key, fingerprint.comment_user_id, fingerprint.simhash):
+                self.cache_stats["hits"] += 1
+                logging.debug(f"严格模式：发现相似评论: 用户 {fingerprint.comment_user_id}")
+                return True
+        self.cache_stats["misses"] += 1
+        
+        # 热点缓存未命中时按 用户ID + 内容 查询磁盘存储
+        if (self.store is not None and self._bloom_may_contain(key, fingerprint)
+                and self.store.contains_comment(key, fingerprint)):
+            self.cache_stats["store_hits"] += 1
+            logging.debug(f"发现重复评论（指纹存储）: 用户 {fingerprint.comment_user_id} 的相同内容")
+            return True
         
         logging.debug(f"评论通过去重检查: 用户 {fingerprint.comment_user_id} (模式: {comment_dedup_mode})")
         return False
     
-    def _calculate_content_similarity(self, hash1: str, hash2: str) -> float:
-        """计算内容相似度（简化版本）"""
-        try:
-            # 简单的哈希相似度计算
-            if hash1 == hash2:
-                return 1.0
-            
-            # 计算哈希字符串的相似度
-            if len(hash1) != len(hash2):
-                return 0.0
-            
-            matches = sum(1 for a, b in zip(hash1, hash2) if a == b)
-            return matches / len(hash1)
-        except Exception:
-            return 0.0
+    def _find_similar_comment(self, key: str, user_id: Optional[int], value: int) -> bool:
+        """在同一用户的评论中查找汉明距离不超过阈值的SimHash（只比较至少一段相同的候选）"""
+        bands = self._simhash_index.get(key)
+        if not bands:
+            return False
+        checked = set()
+        for band, band_value in simhash_bands(value):
+            for candidate in bands.get((user_id, band, band_value), ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                if bin(candidate ^ value).count("1") <= self.simhash_max_distance:
+                    return True
+        return False
+    
+    def _index_comment(self, key: str, fingerprint: MessageFingerprint):
+        """把评论指纹加入评论索引和SimHash分段索引（按引用计数，淘汰时可逐条移除）"""
+        user_id = fingerprint.comment_user_id
+        user_comments = self._comment_index.setdefault(key, {}).setdefault(user_id, {})
+        entry = user_comments.get(fingerprint.content_hash)
+        if entry is None:
+            user_comments[fingerprint.content_hash] = [fingerprint.simhash, 1]
+        else:
+            entry[1] += 1
+        if fingerprint.simhash is not None:
+            bands = self._simhash_index.setdefault(key, {})
+            for band, band_value in simhash_bands(fingerprint.simhash):
+                candidates = bands.setdefault((user_id, band, band_value), {})
+                candidates[fingerprint.simhash] = candidates.get(fingerprint.simhash, 0) + 1
+    
+    def _unindex_comment(self, key: str, fingerprint: MessageFingerprint):
+        """评论指纹被淘汰时从索引中移除"""
+        user_id = fingerprint.comment_user_id
+        user_comments = self._comment_index.get(key, {}).get(user_id)
+        entry = user_comments.get(fingerprint.content_hash) if user_comments else None
+        if entry is not None:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del user_comments[fingerprint.content_hash]
+                if not user_comments:
+                    del self._comment_index[key][user_id]
+        if fingerprint.simhash is not None:
+            bands = self._simhash_index.get(key, {})
+            for band, band_value in simhash_bands(fingerprint.simhash):
+                candidates = bands.get((user_id, band, band_value))
+                if not candidates or fingerprint.simhash not in candidates:
+                    continue
+                candidates[fingerprint.simhash] -= 1
+                if candidates[fingerprint.simhash] <= 0:
+                    del candidates[fingerprint.simhash]
+                    if not candidates:
+                        del bands[(user_id, band, band_value)]
+    
+    def _rebuild_comment_index(self, key: str):
+        """指纹集合被整体替换（加载）后重建该频道对的评论索引"""
+        self._comment_index.pop(key, None)
+        self._simhash_index.pop(key, None)
+        for fingerprint in self.fingerprints.get(key, ()):
+            if fingerprint.is_comment:
+                self._index_comment(key, fingerprint)
     
     def _learn_comment_pattern(self, chat_id: str, base_message_id: int, found_comment_ids: List[int]):
         """学习评论ID模式，用于未来推测"""
@@ -294,76 +484,223 @@ class MessageDeduplicator:
     
     def add_fingerprint(self, source_chat_id: int, target_chat_id: int, fingerprint: MessageFingerprint):
         """添加消息指纹"""
-        from collections import OrderedDict
-        
-        # 建议：使用LRU缓存替代简单的大小限制
-        if not hasattr(self, '_lru_cache'):
-            self._lru_cache = OrderedDict()
-        
         key = f"{source_chat_id}_{target_chat_id}"
-        
-        if key not in self.fingerprints:
-            self.fingerprints[key] = set()
-        
-        self.fingerprints[key].add(fingerprint)
-        
-        # LRU缓存管理
-        self._lru_cache[key] = fingerprint
-        self._lru_cache.move_to_end(key)
-        
-        if len(self._lru_cache) > self.max_cache_size:
-            self._lru_cache.popitem(last=False)
-        
-        # 限制缓存大小 - 性能优化版本
-        if len(self.fingerprints[key]) > self.max_cache_size:
-            # 保留最新的50%指纹，清理旧的
-            current_size = len(self.fingerprints[key])
-            sorted_fps = sorted(self.fingerprints[key], key=lambda x: x.timestamp, reverse=True)
-            keep_count = self.max_cache_size // 2
-            
-            self.fingerprints[key] = set(sorted_fps[:keep_count])
-            self.cache_stats["evictions"] += 1
-            
-            logging.info(f"🧹 清理去重缓存: {key} {current_size} -> {len(self.fingerprints[key])} 条指纹")
-            print(f"[性能优化] 缓存清理: {key} 保留最新 {keep_count} 条")
+        self._remember(key, fingerprint)
+        if self.store is not None:
+            self.store.add(key, fingerprint)
+            self._bloom_add(key, fingerprint)
+        else:
+            self.journal.append([key, base64.b64encode(fingerprint.pack()).decode("ascii")])
+    
+    def _remember(self, key: str, fingerprint: MessageFingerprint):
+        """把指纹放到热点缓存末尾（已存在时刷新为最新），再按淘汰策略从头部移除"""
+        fps = self.fingerprints.get(key)
+        if fps is None:
+            fps = self.fingerprints[key] = OrderedDict()
+        old = fps.pop(fingerprint, None)
+        if old is not None and old.is_comment:
+            self._unindex_comment(key, old)
+        fps[fingerprint] = fingerprint
+        if fingerprint.is_comment:
+            self._index_comment(key, fingerprint)
+        self._evict(key)
+    
+    def _evict(self, key: str, now: float = None):
+        """从最旧的一端淘汰超出数量或超过保留时间的指纹（均摊 O(1)）"""
+        fps = self.fingerprints[key]
+        cutoff = (now or time.time()) - self.max_age_seconds
+        while fps:
+            oldest = next(iter(fps))
+            if len(fps) > self.max_cache_size:
+                self.cache_stats["evictions"] += 1
+            elif oldest.timestamp < cutoff:
+                self.cache_stats["expired"] += 1
+            else:
+                break
+            fps.popitem(last=False)
+            if oldest.is_comment:
+                self._unindex_comment(key, oldest)
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """热点缓存统计：命中/未命中/淘汰次数、命中率和当前缓存的指纹数"""
+        lookups = self.cache_stats["hits"] + self.cache_stats["misses"]
+        return {
+            **self.cache_stats,
+            "hit_rate": round(self.cache_stats["hits"] / lookups, 3) if lookups else 0.0,
+            "cached": sum(len(fps) for fps in self.fingerprints.values()),
+            "pairs": len(self.fingerprints)
+        }
+    
+    def _build_fingerprint_snapshot(self) -> bytes:
+        """生成二进制指纹快照（日志压缩时写入）"""
+        chunks = [FINGERPRINT_SNAPSHOT_MAGIC]
+        current_time = time.time()
+        for key, fps in self.fingerprints.items():
+            # 只保存保留时间内的指纹（数量已由淘汰策略限制），按加入顺序写入
+            recent_fps = [fp for fp in fps if current_time - fp.timestamp < self.max_age_seconds]
+            if not recent_fps:
+                continue
+            key_bytes = key.encode("utf-8")
+            chunks.append(FINGERPRINT_SNAPSHOT_PAIR.pack(len(key_bytes), len(recent_fps)))
+            chunks.append(key_bytes)
+            chunks.extend(fp.pack() for fp in recent_fps)
+        return b"".join(chunks)
+    
+    @staticmethod
+    def _parse_fingerprint_snapshot(snapshot: bytes) -> Dict[str, List[MessageFingerprint]]:
+        """解析二进制指纹快照"""
+        data = {}
+        if not snapshot.startswith(FINGERPRINT_SNAPSHOT_MAGIC):
+            raise ValueError("指纹快照文件头不匹配")
+        view = memoryview(snapshot)
+        record = MessageFingerprint.RECORD
+        offset = len(FINGERPRINT_SNAPSHOT_MAGIC)
+        while offset < len(snapshot):
+            key_length, count = FINGERPRINT_SNAPSHOT_PAIR.unpack_from(snapshot, offset)
+            offset += FINGERPRINT_SNAPSHOT_PAIR.size
+            key = bytes(view[offset:offset + key_length]).decode("utf-8")
+            offset += key_length
+            end = offset + count * record.size
+            if end > len(snapshot):
+                raise ValueError("指纹快照文件不完整")
+            data[key] = [MessageFingerprint.from_fields(fields) for fields in record.iter_unpack(view[offset:end])]
+            offset = end
+        return data
+    
+    @staticmethod
+    def _bloom_key(content_hash: Any, media_type: Any, file_key: Any,
+                   is_comment: bool, comment_user_id: Optional[int]) -> str:
+        """布隆过滤器的元素：与指纹存储的匹配条件一致（主消息看内容+媒体，评论看用户+内容）
+        
+        指纹存储中的列按文本保存，这里统一格式化为字符串，内存指纹和存储行得到相同的元素。
+        """
+        if is_comment:
+            return f"c|{comment_user_id or 0}|{content_hash}"
+        return f"m|{content_hash}|{media_type}|{'' if file_key is None else file_key}"
+    
+    def _bloom_may_contain(self, key: str, fingerprint: MessageFingerprint) -> bool:
+        bloom = self.bloom_filters.get(key)
+        item = self._bloom_key(fingerprint.content_hash, fingerprint.media_type, fingerprint.file_key,
+                               fingerprint.is_comment, fingerprint.comment_user_id)
+        if bloom is None or item not in bloom:
+            self.cache_stats["bloom_negatives"] += 1
+            return False
+        return True
+    
+    def _bloom_add(self, key: str, fingerprint: MessageFingerprint):
+        bloom = self.bloom_filters.get(key)
+        if bloom is None:
+            bloom = self.bloom_filters[key] = ScalableBloomFilter()
+        if bloom.add(self._bloom_key(fingerprint.content_hash, fingerprint.media_type, fingerprint.file_key,
+                                     fingerprint.is_comment, fingerprint.comment_user_id)):
+            self._bloom_dirty = True
+    
+    def _save_bloom_filters(self):
+        """保存布隆过滤器，并记录已覆盖到的指纹存储 rowid（加载时只需补齐之后的指纹）"""
+        try:
+            atomic_write_json(self.bloom_path, {
+                "rowid": self.store.max_rowid(),
+                "pairs": {key: bloom.to_dict() for key, bloom in self.bloom_filters.items()}
+            })
+            self._bloom_dirty = False
+            self._bloom_saved_at = time.time()
+        except Exception as e:
+            logging.error(f"保存布隆过滤器失败: {e}")
+    
+    def _load_bloom_filters(self):
+        """加载布隆过滤器，并用指纹存储中之后写入的指纹补齐（文件缺失或损坏时全量重建）"""
+        rowid = 0
+        try:
+            if os.path.exists(self.bloom_path):
+                with open(self.bloom_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.bloom_filters = {
+                    key: ScalableBloomFilter.from_dict(item) for key, item in data.get("pairs", {}).items()
+                }
+                rowid = data.get("rowid", 0)
+        except Exception as e:
+            logging.error(f"加载布隆过滤器失败，将从指纹存储重建: {e}")
+            self.bloom_filters = {}
+            rowid = 0
+        
+        added = 0
+        for _, key, content_hash, media_type, file_key, is_comment, comment_user_id in self.store.iter_rows(rowid):
+            bloom = self.bloom_filters.get(key)
+            if bloom is None:
+                bloom = self.bloom_filters[key] = ScalableBloomFilter()
+            bloom.add(self._bloom_key(content_hash, media_type, file_key or None, bool(is_comment), comment_user_id))
+            added += 1
+        if added:
+            self._bloom_dirty = True
+            self._save_bloom_filters()
+        logging.info(f"布隆过滤器已加载: {len(self.bloom_filters)} 个频道对，补齐 {added} 条指纹")
     
     def save_fingerprints(self):
-        """保存指纹到文件"""
+        """保存指纹：追加写入新增指纹，日志过长时在后台压缩为快照（使用磁盘存储时提交事务）"""
         try:
-            data = {}
-            current_time = time.time()
-            for key, fps in self.fingerprints.items():
-                # 只保存最近12小时的指纹，减少磁盘写入
-                recent_fps = [fp for fp in fps if current_time - fp.timestamp < 43200]
-                
-                # 限制每个频道的保存数量
-                if len(recent_fps) > self.max_cache_size:
-                    recent_fps.sort(key=lambda x: x.timestamp, reverse=True)
-                    recent_fps = recent_fps[:self.max_cache_size]
-                
-                data[key] = [fp.to_dict() for fp in recent_fps]
-            
-            with open("message_fingerprints.json", "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            if self.store is not None:
+                written = self.store.flush()
+                if written:
+                    logging.info(f"消息指纹已提交到指纹存储: 新增 {written} 条")
+                if self._bloom_dirty and time.time() - self._bloom_saved_at >= self.bloom_save_interval:
+                    self._save_bloom_filters()
+                return
             
-            logging.info("消息指纹已保存")
+            written = self.journal.flush()
+            if self.journal.needs_compaction():
+                self.journal.compact(self._build_fingerprint_snapshot)
+                logging.info("消息指纹日志已压缩")
+            elif written:
+                logging.info(f"消息指纹已保存: 新增 {written} 条")
         except Exception as e:
             logging.error(f"保存消息指纹失败: {e}")
     
+    def _load_legacy_fingerprints(self) -> Dict[str, List[MessageFingerprint]]:
+        """读取旧版JSON格式的指纹快照和日志"""
+        data = {}
+        records = self.legacy_journal.load_snapshot() or {}
+        for record in self.legacy_journal.replay():
+            records.setdefault(record.pop("key"), []).append(record)
+        for key, fps_data in records.items():
+            data[key] = [MessageFingerprint.from_dict(fp_data) for fp_data in fps_data]
+        return data
+    
+    def _remove_legacy_fingerprints(self):
+        legacy = self.legacy_journal
+        for path in (legacy.snapshot_path, legacy.journal_path, legacy.compacting_path):
+            if os.path.exists(path):
+                os.remove(path)
+    
     def load_fingerprints(self):
-        """从文件加载指纹"""
+        """从二进制快照和追加日志加载指纹
+        
+        旧版JSON指纹文件会被转换并写入二进制快照；无法与新指纹比较的第1版指纹直接丢弃。
+        """
         try:
-            if os.path.exists("message_fingerprints.json"):
-                with open("message_fingerprints.json", "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                
+            legacy = self.legacy_journal
+            has_legacy = any(os.path.exists(path) for path in
+                             (legacy.snapshot_path, legacy.journal_path, legacy.compacting_path))
+            data = self._load_legacy_fingerprints() if has_legacy else {}
+            
+            snapshot = self.journal.load_snapshot()
+            if snapshot:
+                for key, fps in self._parse_fingerprint_snapshot(snapshot).items():
+                    data.setdefault(key, []).extend(fps)
+            for key, record in self.journal.replay():
+                data.setdefault(key, []).append(MessageFingerprint.unpack(base64.b64decode(record)))
+            
+            if data:
                 current_time = time.time()
-                for key, fps_data in data.items():
+                outdated = 0
+                for key, fps_list in data.items():
                     fps = []
-                    for fp_data in fps_data:
-                        fp = MessageFingerprint.from_dict(fp_data)
-                        # 只加载最近12小时的指纹，减少内存占用
-                        if current_time - fp.timestamp < 43200:  # 12小时 = 43200秒
+                    # 日志中的记录追加在快照之后，倒序遍历优先保留最新的指纹
+                    for fp in reversed(fps_list):
+                        if fp.version < FINGERPRINT_VERSION:
+                            outdated += 1
+                            continue
+                        # 只加载保留时间内的指纹，减少内存占用
+                        if current_time - fp.timestamp < self.max_age_seconds:
                             fps.append(fp)
                         
                         # 限制每个频道的最大指纹数量
@@ -371,24 +708,311 @@ class MessageDeduplicator:
                             break
                     
                     if fps:
-                        # 只保留最新的指纹
-                        fps.sort(key=lambda x: x.timestamp, reverse=True)
-                        self.fingerprints[key] = set(fps[:self.max_cache_size])
+                        # 按时间从旧到新放入缓存，保持淘汰顺序
+                        fps.sort(key=lambda x: x.timestamp)
+                        self.fingerprints[key] = OrderedDict((fp, fp) for fp in fps)
+                        self._rebuild_comment_index(key)
                         logging.info(f"加载指纹缓存: {key} 加载 {len(self.fingerprints[key])} 条")
                 
                 logging.info("消息指纹已加载")
+                
+                if outdated:
+                    logging.info(f"🔄 丢弃 {outdated} 条无法迁移的第1版指纹")
+            
+            if has_legacy:
+                # 迁移：写入二进制快照成功后再删除旧文件
+                self.journal.compact(self._build_fingerprint_snapshot, background=False)
+                if os.path.exists(self.journal.snapshot_path):
+                    self._remove_legacy_fingerprints()
+                    logging.info(f"🔄 指纹文件已迁移为第{FINGERPRINT_VERSION}版二进制格式")
         except Exception as e:
             logging.error(f"加载消息指纹失败: {e}")
 
+# Telegram 单次 get_messages 最多接受 200 个消息ID
+MAX_IDS_PER_REQUEST = 200
+# Telegram 单次 ForwardMessages 最多转发 100 条消息
+MAX_IDS_PER_BULK_SEND = 100
+
+class AdaptiveBatchController:
+    """自适应批次控制器 - 根据拉取延迟、有效消息密度和近期FloodWait调整批次大小与批次间延迟"""
+    
+    def __init__(self, batch_size_range: Tuple[int, int], batch_delay_range: Tuple[float, float],
+                 target_latency: float = 1.5, flood_cooldown: float = 60.0):
+        min_batch, max_batch = batch_size_range
+        # 密集区间遵守性能模式的批次上限；稀疏区间放宽到单次请求上限
+        self.dense_max_size = max(1, min(max_batch, MAX_IDS_PER_REQUEST))
+        self.min_size = max(1, min(min_batch, self.dense_max_size))
+        self.max_size = MAX_IDS_PER_REQUEST
+        self.min_delay, self.max_delay = batch_delay_range
+        self.flood_max_delay = max(self.max_delay * 4, 2.0)  # FloodWait后允许的最长批次间延迟
+        self.target_latency = target_latency
+        self.flood_cooldown = flood_cooldown
+        
+        self.batch_size = self.min_size
+        self.delay = self.min_delay
+        self.latency_ewma: Optional[float] = None
+        self.density_ewma: Optional[float] = None
+        self.last_flood_wait = 0.0
+        self.stats = {"grow": 0, "shrink": 0, "flood_waits": 0}
+    
+    def note_flood_wait(self, at: float = None):
+        """记录一次FloodWait：立即减半批次并拉长延迟"""
+        self.last_flood_wait = at or time.time()
+        self.stats["flood_waits"] += 1
+        self._shrink(0.5)
+        self.delay = min(self.flood_max_delay, max(self.delay * 2, self.min_delay, 0.5))
+    
+    def record(self, latency: float, requested: int, valid: int, last_flood_wait: float = 0.0):
+        """记录一次 get_messages 的结果并调整下一批的大小"""
+        alpha = 0.3
+        density = (valid / requested) if requested else 1.0
+        self.latency_ewma = latency if self.latency_ewma is None else (1 - alpha) * self.latency_ewma + alpha * latency
+        self.density_ewma = density if self.density_ewma is None else (1 - alpha) * self.density_ewma + alpha * density
+        
+        if last_flood_wait > self.last_flood_wait:
+            # 其他路径（发送阶段）遇到的FloodWait
+            self.note_flood_wait(last_flood_wait)
+            return
+        
+        if time.time() - self.last_flood_wait < self.flood_cooldown:
+            # 冷却期内不扩大批次
+            return
+        
+        if self.latency_ewma > self.target_latency * 2:
+            # 请求明显变慢：乘性减小
+            self._shrink(0.75)
+            self.delay = min(self.max_delay, self.delay + 0.1)
+        elif self.density_ewma < 0.5:
+            # 稀疏区间（大量已删除消息）：每次请求拿到的有效消息少，加倍批次
+            self._grow(self.batch_size, self.max_size)
+            self._decay_delay()
+        elif self.latency_ewma <= self.target_latency:
+            # 密集且响应快：加性增大
+            self._grow(max(5, self.batch_size // 4), self.dense_max_size)
+            self._decay_delay()
+        
+        # 区间重新变密集时回落到性能模式上限
+        if self.density_ewma >= 0.5 and self.batch_size > self.dense_max_size:
+            self.batch_size = self.dense_max_size
+    
+    def _grow(self, step: int, limit: int):
+        new_size = min(limit, self.batch_size + step)
+        if new_size > self.batch_size:
+            self.batch_size = new_size
+            self.stats["grow"] += 1
+    
+    def _shrink(self, factor: float):
+        new_size = max(self.min_size, int(self.batch_size * factor))
+        if new_size < self.batch_size:
+            self.batch_size = new_size
+            self.stats["shrink"] += 1
+    
+    def _decay_delay(self):
+        self.delay = max(self.min_delay, self.delay * 0.8)
+    
+    def next_range(self, current_id: int, end_id: int) -> Tuple[int, int]:
+        """返回下一批的ID范围"""
+        return current_id, min(current_id + self.batch_size - 1, end_id)
+
+# 空区间索引文件格式版本（第1版可能包含稀疏探测推断、未实际拉取的区间，加载时丢弃）
+GAP_INDEX_VERSION = 2
+
+class GapIndex:
+    """已知空区间索引 - 按源频道记录已确认不存在消息的ID区间（已删除区域），持久化到文件
+    
+    区间为闭区间 [start, end]，同一频道内按起点排序且互不重叠，查询使用二分查找。
+    只记录实际拉取过且全部为空、并且上方已发现有内容的区间，频道最新消息之后的ID不会被记为空
+    （新消息仍可能出现）。频道按 channel_key 归一化后的数字ID（或用户名）记录。
+    """
+    
+    def __init__(self, file_path: str = "gap_index.json"):
+        self.file_path = file_path
+        self.ranges: Dict[str, List[List[int]]] = {}
+        self._dirty = False
+        self.load()
+    
+    @staticmethod
+    def channel_key(channel: Any) -> str:
+        """频道键：数字ID统一为整数字符串，用户名去掉 @ 并转为小写"""
+        text = str(channel).strip()
+        try:
+            return str(int(text))
+        except ValueError:
+            return text.lstrip("@").lower()
+    
+    def skip_to(self, channel: Any, message_id: int) -> int:
+        """如果 message_id 落在已知空区间内，返回区间之后的第一个ID，否则原样返回"""
+        ranges = self.ranges.get(self.channel_key(channel))
+        if not ranges:
+            return message_id
+        idx = bisect.bisect_right(ranges, [message_id, float("inf")]) - 1
+        if idx >= 0 and ranges[idx][0] <= message_id <= ranges[idx][1]:
+            return ranges[idx][1] + 1
+        return message_id
+    
+    def add_range(self, channel: Any, start: int, end: int):
+        """记录一个空区间，并与相邻/重叠的区间合并"""
+        if end < start:
+            return
+        ranges = self.ranges.setdefault(self.channel_key(channel), [])
+        idx = bisect.bisect_left(ranges, [start, start])
+        # 向前合并
+        if idx > 0 and ranges[idx - 1][1] >= start - 1:
+            idx -= 1
+            start = min(start, ranges[idx][0])
+        # 向后吞并所有重叠或相邻的区间
+        merge_end = idx
+        while merge_end < len(ranges) and ranges[merge_end][0] <= end + 1:
+            end = max(end, ranges[merge_end][1])
+            merge_end += 1
+        ranges[idx:merge_end] = [[start, end]]
+        self._dirty = True
+    
+    def save(self):
+        """保存空区间索引（无变化时跳过写入）"""
+        if not self._dirty:
+            return
+        try:
+            atomic_write_json(self.file_path, {"version": GAP_INDEX_VERSION, "channels": self.ranges})
+            self._dirty = False
+            logging.debug(f"空区间索引已保存: {sum(len(r) for r in self.ranges.values())} 个区间")
+        except Exception as e:
+            logging.error(f"保存空区间索引失败: {e}")
+    
+    def load(self):
+        """从文件加载空区间索引"""
+        try:
+            if os.path.exists(self.file_path):
+                with open(self.file_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") != GAP_INDEX_VERSION:
+                    logging.warning("⚠️ 空区间索引为旧版格式（可能包含未实际拉取的区间），已丢弃并重新记录")
+                    self._dirty = True
+                    return
+                self.ranges = {}
+                for channel, ranges in data.get("channels", {}).items():
+                    for start, end in sorted([int(r[0]), int(r[1])] for r in ranges):
+                        self.add_range(channel, start, end)
+                self._dirty = False
+                logging.info(f"已加载空区间索引: {len(self.ranges)} 个频道")
+        except Exception as e:
+            logging.error(f"加载空区间索引失败: {e}")
+            self.ranges = {}
+
+class IdRangeSet:
+    """按有序不相交区间存储的消息ID集合
+    
+    搬运的消息ID基本连续，几十万个ID通常只占几个区间：成员检查为二分查找 O(log n)，
+    按递增顺序追加（搬运的常见情况）为均摊 O(1)，乱序插入时与相邻区间合并。
+    """
+    
+    __slots__ = ("starts", "ends", "count")
+    
+    def __init__(self, ids=None):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.count = 0
+        if ids:
+            for message_id in sorted(ids):
+                self.add(message_id)
+    
+    def __contains__(self, message_id: int) -> bool:
+        idx = bisect.bisect_right(self.starts, message_id) - 1
+        return idx >= 0 and message_id <= self.ends[idx]
+    
+    def __len__(self) -> int:
+        return self.count
+    
+    def __iter__(self):
+        for start, end in zip(self.starts, self.ends):
+            yield from range(start, end + 1)
+    
+    def add(self, message_id: int):
+        """加入一个ID（已存在时不变）"""
+        # 快速路径：在末尾递增追加
+        if self.ends and message_id > self.starts[-1]:
+            if message_id <= self.ends[-1]:
+                return
+            if message_id == self.ends[-1] + 1:
+                self.ends[-1] = message_id
+            else:
+                self.starts.append(message_id)
+                self.ends.append(message_id)
+            self.count += 1
+            return
+        
+        idx = bisect.bisect_right(self.starts, message_id) - 1
+        if idx >= 0 and message_id <= self.ends[idx]:
+            return
+        joins_prev = idx >= 0 and self.ends[idx] == message_id - 1
+        joins_next = idx + 1 < len(self.starts) and self.starts[idx + 1] == message_id + 1
+        if joins_prev and joins_next:
+            self.ends[idx] = self.ends[idx + 1]
+            del self.starts[idx + 1]
+            del self.ends[idx + 1]
+        elif joins_prev:
+            self.ends[idx] = message_id
+        elif joins_next:
+            self.starts[idx + 1] = message_id
+        else:
+            self.starts.insert(idx + 1, message_id)
+            self.ends.insert(idx + 1, message_id)
+        self.count += 1
+    
+    def update(self, ids):
+        for message_id in ids:
+            self.add(message_id)
+    
+    def contains_many(self, ids) -> bytearray:
+        """批量成员检查：返回与 ids 对齐的标记（1 = 已在集合中）
+        
+        ids 排序后与区间做一次归并遍历，整批只需 O(n log n + 区间数)。
+        """
+        ids = list(ids)
+        flags = bytearray(len(ids))
+        starts, ends = self.starts, self.ends
+        if not starts:
+            return flags
+        idx = 0
+        for position in sorted(range(len(ids)), key=ids.__getitem__):
+            message_id = ids[position]
+            while idx < len(ends) and ends[idx] < message_id:
+                idx += 1
+            if idx == len(ends):
+                break
+            if starts[idx] <= message_id:
+                flags[position] = 1
+        return flags
+    
+    def to_ranges(self) -> List[List[int]]:
+        return [[start, end] for start, end in zip(self.starts, self.ends)]
+    
+    @classmethod
+    def from_ranges(cls, ranges: List[List[int]]) -> "IdRangeSet":
+        id_set = cls()
+        for start, end in sorted((int(r[0]), int(r[1])) for r in ranges):
+            if id_set.ends and start <= id_set.ends[-1] + 1:
+                # 合并重叠或相邻的区间
+                if end > id_set.ends[-1]:
+                    id_set.count += end - id_set.ends[-1]
+                    id_set.ends[-1] = end
+                continue
+            id_set.starts.append(start)
+            id_set.ends.append(end)
+            id_set.count += end - start + 1
+        return id_set
+
 class RobustCloningEngine:
     """鲁棒的搬运引擎"""
     
-    def __init__(self, client: Client, source_entity=None, target_entity=None, performance_mode="balanced", flood_wait_manager=None, silent_mode=True):
+    def __init__(self, client: Client, source_entity=None, target_entity=None, performance_mode="balanced", flood_wait_manager=None, silent_mode=True, send_scheduler=None, retry_queue=None, fingerprint_store=None):
         self.client = client
         self.source_entity = source_entity
         self.target_entity = target_entity
-        self.deduplicator = MessageDeduplicator()
-        self.processed_message_ids: Dict[str, Set[int]] = {}  # 记录已处理的消息ID
+        self.deduplicator = MessageDeduplicator(store=fingerprint_store)
+        self.gap_index = GapIndex()  # 按源频道共享的已知空区间索引
+        self.processed_message_ids: Dict[str, IdRangeSet] = {}  # 记录已处理的消息ID（区间集合）
+        self._processed_journals: Dict[str, AppendJournal] = {}  # 已处理消息ID的追加日志
         self.performance_mode = performance_mode
         self.silent_mode = silent_mode
         self.batch_progress_enabled = not silent_mode
@@ -396,6 +1020,15 @@ class RobustCloningEngine:
         # 🔧 新增：统一的FloodWait管理器
         self.flood_wait_manager = flood_wait_manager
         
+        # 中央发送调度器（可选）：设置后所有发送以历史搬运优先级提交，FloodWait只暂停对应目标
+        self.send_scheduler = send_scheduler
+        
+        # 持久化重试队列（可选）：因FloodWait放弃发送的消息记入队列，等待结束后重放
+        self.retry_queue = retry_queue
+        self._flood_wait_failures: Dict[Tuple[str, int], int] = {}  # (目标, 消息ID) -> FloodWait秒数
+        self._retry_drain_task: Optional[asyncio.Task] = None
+        self._retry_replay_lock = asyncio.Lock()
+        
         # 根据静默模式和性能模式设置参数
         if silent_mode:
             # 静默模式下使用更大的批次以提高效率
@@ -444,6 +1077,15 @@ class RobustCloningEngine:
                 self.save_frequency = 100
                 self.log_frequency = 40
         
+        # 最近一次FloodWait的时间，供自适应批次控制器参考
+        self.last_flood_wait_time = 0.0
+        
+        # 预取流水线深度：发送阶段之前最多缓冲的消息批次数（0 表示关闭预取，按顺序拉取）
+        self.prefetch_batches = 2
+        
+        # 空区间索引的频道键缓存：用户名 -> 数字频道ID
+        self._gap_channel_keys: Dict[str, str] = {}
+        
         # 支持强制频繁更新模式
         self.force_frequent_updates = False
         
@@ -451,39 +1093,61 @@ class RobustCloningEngine:
         self.button_counter = 0
         self.tail_counter = 0
     
+    def _get_processed_journal(self, task_key: str) -> AppendJournal:
+        """已处理消息ID的追加日志（快照为 processed_ids_{task_key}.json）"""
+        journal = self._processed_journals.get(task_key)
+        if journal is None:
+            journal = AppendJournal(f"processed_ids_{task_key}.json")
+            self._processed_journals[task_key] = journal
+        return journal
+    
     def _load_processed_ids(self, task_key: str):
-        """加载已处理的消息ID列表"""
-        filename = f"processed_ids_{task_key}.json"
+        """加载已处理的消息ID：区间快照 {"ranges": [[起, 止], ...]}（兼容旧版的ID列表）+ 追加日志"""
+        journal = self._get_processed_journal(task_key)
         try:
-            if os.path.exists(filename):
-                with open(filename, "r") as f:
-                    data = json.load(f)
-                    self.processed_message_ids[task_key] = set(data)
-                logging.info(f"加载已处理消息ID: {len(self.processed_message_ids[task_key])} 条")
+            data = journal.load_snapshot()
+            if isinstance(data, dict):
+                processed = IdRangeSet.from_ranges(data.get("ranges", []))
+            else:
+                processed = IdRangeSet(data or [])
+            for message_id in journal.replay():
+                processed.add(message_id)
+            
+            if data is not None or len(processed):
+                self.processed_message_ids[task_key] = processed
+                logging.info(f"加载已处理消息ID: {len(processed)} 条")
+            if isinstance(data, list):
+                # 旧版ID列表格式，立即压缩为区间快照
+                journal.compact(lambda: {"ranges": processed.to_ranges()})
         except Exception as e:
             logging.error(f"加载已处理消息ID失败: {e}")
-            self.processed_message_ids[task_key] = set()
+            self.processed_message_ids[task_key] = IdRangeSet()
     
     def _save_processed_ids(self, task_key: str):
-        """保存已处理的消息ID列表"""
-        filename = f"processed_ids_{task_key}.json"
+        """保存已处理的消息ID：追加写入新增ID，日志过长时在后台压缩为区间快照"""
         try:
             if task_key in self.processed_message_ids:
-                data = list(self.processed_message_ids[task_key])
-                with open(filename, "w") as f:
-                    json.dump(data, f)
+                journal = self._get_processed_journal(task_key)
+                journal.flush()
+                if journal.needs_compaction():
+                    ranges = self.processed_message_ids[task_key].to_ranges()
+                    journal.compact(lambda: {"ranges": ranges})
         except Exception as e:
             logging.error(f"保存已处理消息ID失败: {e}")
     
     def _is_message_processed(self, task_key: str, message_id: int) -> bool:
         """检查消息是否已被处理"""
-        return message_id in self.processed_message_ids.get(task_key, set())
+        processed = self.processed_message_ids.get(task_key)
+        return processed is not None and message_id in processed
     
     def _mark_message_processed(self, task_key: str, message_id: int):
         """标记消息为已处理"""
         if task_key not in self.processed_message_ids:
-            self.processed_message_ids[task_key] = set()
-        self.processed_message_ids[task_key].add(message_id)
+            self.processed_message_ids[task_key] = IdRangeSet()
+        processed = self.processed_message_ids[task_key]
+        if message_id not in processed:
+            processed.add(message_id)
+            self._get_processed_journal(task_key).append(message_id)
     
     def _is_media_group_processed(self, task_key: str, media_group_id: str) -> bool:
         """检查媒体组是否已处理过"""
@@ -544,6 +1208,7 @@ class RobustCloningEngine:
             "already_processed": 0,
             "invalid_messages": 0,
             "filtered_messages": 0,
+            "retry_queued": 0,
             "requested_range": end_id - start_id + 1,
             "current_offset_id": start_id  # 添加当前处理的消息ID
         }
@@ -557,13 +1222,29 @@ class RobustCloningEngine:
         
         logging.info(f"开始鲁棒搬运: {source_chat_id} -> {target_chat_id}, 范围: {start_id}-{end_id}")
         
+        prefetch_task = None
+        batch_iter = None
         try:
-            # 使用性能模式配置的批量大小
-            task_hash = hash(task_id) if task_id else 0
-            min_batch, max_batch = self.batch_size_range
-            batch_size = min_batch + (task_hash % (max_batch - min_batch + 1))
+            # 自适应批次：根据拉取延迟、有效消息密度和FloodWait动态调整批次大小与延迟
+            batch_controller = AdaptiveBatchController(self.batch_size_range, self.batch_delay_range)
             current_id = start_id
             
+            # 批次来源：拉取确认为空的区间总是写入空区间索引；gap_skip_enabled（默认开启）时
+            # 跳过此前已确认为空的区间
+            batch_iter = self._iter_message_batches(
+                source_chat_id, start_id, end_id, batch_controller,
+                gap_skip=config.get("gap_skip_enabled", True),
+                gap_channel=await self._gap_channel_key(source_chat_id)
+            )
+            
+            # 预取流水线：后台按顺序拉取后续批次，与发送阶段重叠；有界队列提供背压，内存占用受限
+            prefetch_depth = max(0, int(config.get("prefetch_batches", self.prefetch_batches) or 0))
+            prefetch_queue = None
+            if prefetch_depth > 0:
+                prefetch_queue = asyncio.Queue(maxsize=prefetch_depth)
+                prefetch_task = asyncio.create_task(self._prefetch_batches(batch_iter, prefetch_queue))
+                logging.info(f"📥 启用预取流水线: 预取深度 {prefetch_depth} 批, 初始批次大小 {batch_controller.batch_size}")
+            
             while current_id <= end_id:
                 # 检查是否被取消（提高检查频率）
                 if cancellation_check and cancellation_check():
@@ -575,9 +1256,19 @@ class RobustCloningEngine:
                 if current_id > end_id + 10000:
                     logging.error(f"❌ 检测到异常ID值: {current_id}, 目标: {end_id}, 可能存在无限循环")
                     break
-                    
-                batch_end = min(current_id + batch_size - 1, end_id)
-                message_ids = list(range(current_id, batch_end + 1))
+                
+                if prefetch_queue is not None:
+                    # 从预取队列取下一批（批次范围由预取阶段决定）
+                    fetched = await prefetch_queue.get()
+                    if isinstance(fetched, BaseException):
+                        # 预取阶段失败或被取消
+                        raise fetched
+                else:
+                    fetched = await anext(batch_iter, None)
+                if fetched is None:
+                    logging.info(f"📥 已拉取全部批次")
+                    break
+                current_id, batch_end, fetched_messages, fetch_error = fetched
                 
                 # 更新当前处理的ID
                 stats["current_offset_id"] = current_id
@@ -588,16 +1279,14 @@ class RobustCloningEngine:
                     logging.info(f"🔄 处理进度: {progress:.1f}% | 当前ID: {current_id} | 目标ID: {end_id}")
                 
                 try:
-                    # 使用性能模式配置的延迟
-                    if task_id:
-                        min_delay, max_delay = self.batch_delay_range
-                        delay = min_delay + (hash(task_id) % int((max_delay - min_delay) * 10)) / 10
-                        await asyncio.sleep(delay)
+                    if fetch_error is not None:
+                        raise fetch_error
+                    messages = fetched_messages
                     
-                    # 获取一批消息
-                    messages = await self.client.get_messages(source_chat_id, message_ids)
-                    if not isinstance(messages, list):
-                        messages = [messages]
+                    if not messages:
+                        # 已知空区间，无需处理
+                        current_id = batch_end + 1
+                        continue
                     
                     # 新增：如果启用了评论区搬运，尝试获取相关评论
                     if config.get("enable_comment_forwarding", False):
@@ -757,15 +1446,14 @@ class RobustCloningEngine:
                     else:
                         logging.debug(f"ℹ️ 评论区搬运未启用，跳过评论获取")
                     
-                    # 过滤掉无效消息
-                    valid_messages = [msg for msg in messages if msg is not None]
-                    invalid_count = len(messages) - len(valid_messages)
-                    if invalid_count > 0:
-                        stats["invalid_messages"] += invalid_count
-                        logging.debug(f"过滤了 {invalid_count} 个无效消息")
+                    # 一次性提取整批消息的属性（无效消息不进入批次）
+                    message_batch = MessageBatch(messages)
+                    if message_batch.invalid > 0:
+                        stats["invalid_messages"] += message_batch.invalid
+                        logging.debug(f"过滤了 {message_batch.invalid} 个无效消息")
                     
                     # 检查是否整个批次都是无效消息
-                    if not valid_messages:
+                    if not message_batch:
                         logging.warning(f"⚠️ 批次 {current_id}-{batch_end} 全部无效，可能存在ID跳跃")
                         
                         # 检查是否已经超过范围末尾
@@ -778,21 +1466,15 @@ class RobustCloningEngine:
                             current_id = batch_end + 1
                             continue
                     
-                    # 媒体组聚合处理
-                    media_groups = {}  # {media_group_id: [messages]}
-                    standalone_messages = []  # 单独的消息
+                    # 整批执行过滤检查，结果随子批次传给单独消息的批量处理
+                    message_batch.apply_filter(get_message_filter(config))
                     
-                    # 分类消息：媒体组 vs 单独消息
-                    for message in valid_messages:
-                        if hasattr(message, 'media_group_id') and message.media_group_id:
-                            if message.media_group_id not in media_groups:
-                                media_groups[message.media_group_id] = []
-                            media_groups[message.media_group_id].append(message)
-                        else:
-                            standalone_messages.append(message)
+                    # 分类消息：媒体组 {media_group_id: [下标]} vs 单独消息 [下标]
+                    media_groups, standalone_indexes = message_batch.split_media_groups()
                     
                     # 处理媒体组
-                    for media_group_id, group_messages in media_groups.items():
+                    for media_group_id, group_indexes in media_groups.items():
+                        group_messages = [message_batch.messages[i] for i in group_indexes]
                         await self._process_media_group(
                             group_messages, target_chat_id, config, stats, task_key
                         )
@@ -811,11 +1493,11 @@ class RobustCloningEngine:
                         await asyncio.sleep(self.media_group_delay)
                     
                     # 处理单独消息 - 使用批量处理
-                    if standalone_messages:
-                        # 将消息分成小批次处理
-                        batch_size = 10  # 每批处理10条消息
-                        for i in range(0, len(standalone_messages), batch_size):
-                            batch = standalone_messages[i:i + batch_size]
+                    if standalone_indexes:
+                        # 将消息分成小批次处理；批量转发模式下放大批次，让未改动的连续消息合并为一次请求
+                        send_chunk_size = MAX_IDS_PER_BULK_SEND if self._get_bulk_send_mode(config) else 10
+                        for i in range(0, len(standalone_indexes), send_chunk_size):
+                            chunk = message_batch.take(standalone_indexes[i:i + send_chunk_size])
                             
                             # 检查取消状态
                             if cancellation_check and cancellation_check():
@@ -824,7 +1506,7 @@ class RobustCloningEngine:
                             
                             # 批量处理这一批消息
                             await self._process_messages_batch(
-                                batch, target_chat_id, config, stats, task_key
+                                chunk.messages, target_chat_id, config, stats, task_key, message_batch=chunk
                             )
                             
                             # 批次间进度回调
@@ -839,35 +1521,20 @@ class RobustCloningEngine:
                 
                 except Exception as e:
                     logging.error(f"获取消息批次失败 {current_id}-{batch_end}: {e}")
-                    stats["errors"] += batch_size
+                    stats["errors"] += batch_end - current_id + 1
                     
                     # 修复：即使出现异常，也要确保ID正确更新
                     logging.info(f"🔧 异常后ID修复：当前ID {current_id} -> {batch_end + 1}")
                     current_id = batch_end + 1
                 
-                # 更新ID - 修复ID跳跃问题
-                if valid_messages:
-                    # 如果有有效消息，使用最后一条消息的ID + 1
-                    last_message_id = max(msg.id for msg in valid_messages if msg and hasattr(msg, 'id') and msg.id is not None)
-                    current_id = last_message_id + 1
-                    
-                    # 检查是否出现ID跳跃
-                    expected_next_id = batch_end + 1
-                    if current_id > expected_next_id + 100:  # 如果跳跃超过100个ID
-                        logging.warning(f"⚠️ 检测到ID跳跃！当前ID: {current_id}, 预期ID: {expected_next_id}, 跳跃: {current_id - expected_next_id}")
-                        
-                        # 如果跳跃过大，尝试跳回到合理范围
-                        if current_id > end_id + 1000:
-                            logging.warning(f"⚠️ ID跳跃过大，尝试跳回到合理范围")
-                            current_id = min(current_id, end_id + 100)
-                else:
-                    # 如果没有有效消息，正常递增
-                    current_id = batch_end + 1
+                # 更新ID - 批次范围连续且由批次来源决定，直接推进到下一批
+                current_id = batch_end + 1
                 
                 # 使用性能模式配置的保存频率
                 if stats["total_processed"] % self.save_frequency == 0:
                     self._save_processed_ids(task_key)
                     self.deduplicator.save_fingerprints()
+                    self.gap_index.save()
                 
                 # 新增：异常恢复检查
                 if current_id > end_id + 1000:
@@ -876,9 +1543,24 @@ class RobustCloningEngine:
                     logging.info(f"🔧 ID恢复后: {current_id}")
         
         finally:
+            # 停止预取阶段，释放已缓冲的批次
+            if prefetch_task and not prefetch_task.done():
+                prefetch_task.cancel()
+                try:
+                    await prefetch_task
+                except (asyncio.CancelledError, Exception):
+                    pass
+            elif batch_iter is not None:
+                await batch_iter.aclose()
+            
             # 最终保存
             self._save_processed_ids(task_key)
             self.deduplicator.save_fingerprints()
+            self.gap_index.save()
+            cache_stats = self.deduplicator.get_cache_stats()
+            logging.info(f"📊 去重缓存: 命中 {cache_stats['hits']}，未命中 {cache_stats['misses']}，"
+                         f"命中率 {cache_stats['hit_rate']:.1%}，淘汰 {cache_stats['evictions']}，"
+                         f"过期 {cache_stats['expired']}，缓存 {cache_stats['cached']} 条")
         
         # 强制范围完整性检查 - 确保任务处理到真正的end_id
         if stats["current_offset_id"] < end_id:
@@ -954,12 +1636,13 @@ class RobustCloningEngine:
                                     success = await self._send_message_safe(
                                         message, target_chat_id, processed_text, reply_markup
                                     )
+                                    flood_wait = self._flood_wait_failures.pop((str(target_chat_id), message.id), None)
                                     
                                     if success:
                                         self._mark_message_processed(task_key, message.id)
                                         self.deduplicator.add_fingerprint(message.chat.id, target_chat_id, fingerprint)
                                         stats["successfully_cloned"] += 1
-                                    else:
+                                    elif not self._queue_for_retry([message], target_chat_id, config, stats, task_key, flood_wait):
                                         stats["errors"] += 1
                                         
                                 except Exception as e:
@@ -1013,87 +1696,156 @@ class RobustCloningEngine:
         
         return stats
     
-    def _should_filter_message(self, message: Message, config: Dict[str, Any]) -> bool:
-        """检查消息是否应该被过滤 - 从主程序移植"""
-        # 新增：评论区搬运控制
-        enable_comment_forwarding = config.get("enable_comment_forwarding", False)
-        
-        # 如果关闭评论区搬运，只搬运频道主发布的内容
-        if not enable_comment_forwarding:
-            # 检查消息是否来自频道主
-            # 频道主发布的消息通常没有 from_user 字段，或者 from_user 是频道本身
-            if hasattr(message, 'from_user') and message.from_user:
-                # 如果消息有发送者信息，说明可能是评论或回复
-                logging.debug(f"消息 {message.id} 被评论区过滤: 非频道主发布 (from_user: {message.from_user.id})")
-                return True
-            else:
-                # 没有 from_user 字段，通常是频道主发布的内容
-                logging.debug(f"消息 {message.id} 通过评论区过滤: 频道主发布")
-        
-        # 新增：只搬运频道主信息
-        if config.get("channel_owner_only", False):
-            # 检查消息是否来自频道主
-            if hasattr(message, 'from_user') and message.from_user:
-                # 如果消息有发送者信息，说明不是频道主发布的
-                logging.debug(f"消息 {message.id} 被频道主过滤: 非频道主发布")
-                return True
-        
-        # 新增：只搬运媒体内容
-        if config.get("media_only_mode", False):
-            # 检查消息是否包含媒体内容
-            has_media = any([
-                message.photo,
-                message.video,
-                message.video_note,
-                message.animation,
-                message.document,
-                message.audio,
-                message.voice,
-                message.sticker
-            ])
-            
-            if not has_media:
-                logging.debug(f"消息 {message.id} 被媒体过滤: 不包含媒体内容")
-                return True
+    async def _fetch_message_batch(
+        self,
+        source_chat_id: str,
+        message_ids: List[int],
+        batch_controller: Optional[AdaptiveBatchController] = None
+    ) -> List[Optional[Message]]:
+        """按ID列表拉取一批消息，统一返回列表，并把延迟和有效密度反馈给批次控制器"""
+        started = time.time()
+        try:
+            messages = await self.client.get_messages(source_chat_id, message_ids)
+        except Exception as e:
+            if batch_controller and "FLOOD_WAIT" in str(e):
+                self.last_flood_wait_time = time.time()
+                batch_controller.note_flood_wait(self.last_flood_wait_time)
+            raise
+        if not isinstance(messages, list):
+            messages = [messages]
+        
+        if batch_controller:
+            valid_count = sum(1 for msg in messages if self._has_content(msg))
+            batch_controller.record(time.time() - started, len(message_ids), valid_count, self.last_flood_wait_time)
+            logging.debug(
+                f"📏 自适应批次: 请求 {len(message_ids)} 有效 {valid_count} 耗时 {time.time() - started:.2f}s -> "
+                f"下一批 {batch_controller.batch_size}, 延迟 {batch_controller.delay:.2f}s"
+            )
+        return messages
+    
+    @staticmethod
+    def _has_content(message: Optional[Message]) -> bool:
+        """消息是否真实存在（已删除的ID返回 None 或 empty 消息）"""
+        return message is not None and not getattr(message, "empty", False)
+    
+    async def _iter_message_batches(
+        self,
+        source_chat_id: str,
+        start_id: int,
+        end_id: int,
+        batch_controller: AdaptiveBatchController,
+        gap_skip: bool = False,
+        gap_channel: Optional[str] = None
+    ):
+        """按顺序产出消息批次 (批次起始ID, 批次结束ID, 消息列表, 异常)
+        
+        gap_channel 为空区间索引的频道键：
+        - 实际拉取后全部为空的连续批次在后方发现内容时总是写入空区间索引，供重跑和同源的其他频道组跳过
+        - 启用 gap_skip 时，落在已知空区间内的ID直接以空列表产出，不发请求
+        每个ID都会被拉取或落在此前已拉取确认的空区间内，不会按推断跳过任何ID。
+        """
+        gap_channel = gap_channel or source_chat_id
+        current_id = start_id
+        gap_start = None  # 当前连续空区间（已拉取确认）的起点
+        
+        while current_id <= end_id:
+            if gap_skip:
+                skip_to = self.gap_index.skip_to(gap_channel, current_id)
+                if skip_to > current_id:
+                    skip_end = min(skip_to - 1, end_id)
+                    logging.info(f"⏭️ 跳过已知空区间 {current_id}-{skip_end}")
+                    yield current_id, skip_end, [], None
+                    if gap_start is None:
+                        gap_start = current_id
+                    current_id = skip_end + 1
+                    continue
+            
+            current_id, batch_end = batch_controller.next_range(current_id, end_id)
+            message_ids = list(range(current_id, batch_end + 1))
+            
+            try:
+                # 使用自适应的批次间延迟
+                if batch_controller.delay > 0:
+                    await asyncio.sleep(batch_controller.delay)
+                
+                messages = await self._fetch_message_batch(source_chat_id, message_ids, batch_controller)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 拉取失败交由发送阶段统一记录和计数；失败区间不能视为空区间
+                yield current_id, batch_end, None, e
+                current_id = batch_end + 1
+                gap_start = None
+                continue
+            
+            yield current_id, batch_end, messages, None
+            
+            content_ids = [msg.id for msg in messages if self._has_content(msg)]
+            if content_ids:
+                if gap_start is not None:
+                    self._record_gap(gap_channel, gap_start, min(content_ids) - 1)
+                last_content_id = max(content_ids)
+                gap_start = last_content_id + 1 if last_content_id < batch_end else None
+            elif gap_start is None:
+                gap_start = current_id
+            current_id = batch_end + 1
+    
+    async def _gap_channel_key(self, source_chat_id: Any) -> str:
+        """空区间索引的频道键：用户名解析为数字频道ID，使 @用户名 和 -100ID 共用同一份记录"""
+        key = GapIndex.channel_key(source_chat_id)
+        if key.lstrip("-").isdigit():
+            return key
+        resolved = self._gap_channel_keys.get(key)
+        if resolved is None:
+            try:
+                chat = await self.client.get_chat(source_chat_id)
+                resolved = self._gap_channel_keys[key] = GapIndex.channel_key(chat.id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f"⚠️ 解析源频道 {source_chat_id} 失败，空区间索引按用户名记录: {e}")
+                return key
+        return resolved
+    
+    def _record_gap(self, gap_channel: str, start: int, end: int):
+        """记录已确认的空区间（小于一个请求窗口的空洞不值得索引）"""
+        if end - start + 1 >= MAX_IDS_PER_REQUEST:
+            self.gap_index.add_range(gap_channel, start, end)
+            logging.debug(f"📝 记录空区间 {gap_channel}: {start}-{end}")
+    
+    async def _prefetch_batches(self, batch_iter, queue: asyncio.Queue) -> None:
+        """预取阶段：从批次来源按顺序拉取消息批次放入有界队列，队列满时阻塞等待（背压）
         
-        # 关键字过滤
-        filter_keywords = config.get("filter_keywords", [])
-        text_to_check = ""
-        if message.caption:
-            text_to_check += message.caption.lower()
-        if message.text:
-            text_to_check += message.text.lower()
-        if filter_keywords and isinstance(filter_keywords, (list, tuple)):
-            if any(isinstance(keyword, str) and keyword.lower() in text_to_check for keyword in filter_keywords):
-                logging.debug(f"消息 {message.id} 被关键字过滤: {filter_keywords}")
-                return True
-
-        # 过滤带按钮的消息（支持策略）
-        filter_buttons_enabled = config.get("filter_buttons")
-        filter_buttons_mode = config.get("filter_buttons_mode", "drop")  # drop | strip | whitelist
-        if filter_buttons_enabled and getattr(message, "reply_markup", None):
-            if filter_buttons_mode == "drop":
-                logging.debug(f"消息 {message.id} 被按钮过滤")
-                return True
-
-        # 文件类型过滤
-        filter_extensions = config.get("file_filter_extensions", [])
-        if message.document and filter_extensions and isinstance(filter_extensions, (list, tuple)):
-            filename = getattr(message.document, 'file_name', '')
-            if filename and '.' in filename:
-                ext = filename.lower().rsplit('.', 1)[1]
-                if ext in filter_extensions:
-                    logging.debug(f"消息 {message.id} 被文件类型过滤: {ext}")
-                    return True
-
-        # 媒体类型过滤
-        if message.photo and config.get("filter_photo"):
-            logging.debug(f"消息 {message.id} 被图片过滤")
-            return True
-        if message.video and config.get("filter_video"):
-            logging.debug(f"消息 {message.id} 被视频过滤")
+        队列元素为 (批次起始ID, 批次结束ID, 消息列表, 异常)，全部批次完成后放入 None 作为结束标记；
+        批次来源抛出异常或预取被取消时放入该异常，由发送阶段重新抛出，不会一直等待下一批。
+        """
+        outcome: Optional[BaseException] = None
+        try:
+            async for batch in batch_iter:
+                await queue.put(batch)
+                logging.debug(f"📥 预取完成批次 {batch[0]}-{batch[1]}，队列深度 {queue.qsize()}/{queue.maxsize}")
+        except asyncio.CancelledError as e:
+            outcome = e
+            raise
+        except Exception as e:
+            logging.error(f"📥 预取阶段失败: {e}")
+            outcome = e
+        finally:
+            if isinstance(outcome, asyncio.CancelledError):
+                # 被取消时发送阶段可能已不再读取队列，不能等待空位
+                try:
+                    queue.put_nowait(asyncio.CancelledError())
+                except asyncio.QueueFull:
+                    pass
+            else:
+                await queue.put(outcome)
+    
+    def _should_filter_message(self, message: Message, config: Dict[str, Any]) -> bool:
+        """检查消息是否应该被过滤（与实时监听共用编译后的过滤谓词）"""
+        reason = get_message_filter(config).match(message)
+        if reason is not None:
+            logging.debug(f"消息 {message.id} 被过滤: {reason}")
             return True
-
         return False
     
     def _process_message_content(self, message: Message, config: Dict[str, Any]) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
@@ -1192,100 +1944,12 @@ class RobustCloningEngine:
         return text.strip(), reply_markup
     
     def _advanced_process_content(self, text: str, config: Dict[str, Any]) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
-        """完整的文本处理逻辑（从主程序复制）"""
-        import re
-        from urllib.parse import urlparse
-        
-        # 文本处理
-        processed_text = text
-        
-        # 定义各种链接的正则表达式
-        http_pattern = r'https?://[^\s/$.?#].[^\s]*'
-        magnet_pattern = r'magnet:\?[^\s]*'
-        ftp_pattern = r'ftp://[^\s]*'
-        telegram_pattern = r't\.me/[^\s]*'
-        
-        # 移除所有类型链接
-        if config.get("remove_all_links", False):
-            remove_mode = config.get("remove_links_mode", "links_only")
-            all_links_pattern = f'({http_pattern}|{magnet_pattern}|{ftp_pattern}|{telegram_pattern})'
-            
-            if remove_mode == "whole_text":
-                if re.search(all_links_pattern, processed_text, flags=re.MULTILINE | re.IGNORECASE):
-                    processed_text = ""
-                    logging.info(f"🌐 所有链接过滤: 文本包含链接，整个文本被移除")
-            else:
-                processed_text = re.sub(all_links_pattern, '', processed_text, flags=re.MULTILINE | re.IGNORECASE)
-                logging.info(f"🌐 所有链接过滤: 移除所有类型链接，保留其他文本")
-        else:
-            # 单独处理各种链接类型
-            if config.get("remove_links", False):
-                remove_mode = config.get("remove_links_mode", "links_only")
-                if remove_mode == "whole_text":
-                    if re.search(http_pattern, processed_text, flags=re.MULTILINE):
-                        processed_text = ""
-                        logging.info(f"🔗 超链接过滤: 文本包含超链接，整个文本被移除")
-                else:
-                    processed_text = re.sub(http_pattern, '', processed_text, flags=re.MULTILINE)
-                    logging.info(f"🔗 超链接过滤: 只移除超链接，保留其他文本")
-            
-            if config.get("remove_magnet_links", False):
-                remove_mode = config.get("remove_links_mode", "links_only")
-                if remove_mode == "whole_text":
-                    if re.search(magnet_pattern, processed_text, flags=re.MULTILINE | re.IGNORECASE):
-                        processed_text = ""
-                        logging.info(f"🧲 磁力链接过滤: 文本包含磁力链接，整个文本被移除")
-                else:
-                    processed_text = re.sub(magnet_pattern, '', processed_text, flags=re.MULTILINE | re.IGNORECASE)
-                    logging.info(f"🧲 磁力链接过滤: 只移除磁力链接，保留其他文本")
-        
-        # 移除用户名
-        if config.get("remove_usernames", False):
-            processed_text = re.sub(r'@\w+', '', processed_text)
-        
-        # 移除井号标签
-        if config.get("remove_hashtags", False):
-            processed_text = re.sub(r'#\w+', '', processed_text)
-        
-        # 替换词汇 - 支持两种配置名称
-        replacements = config.get("replacements", {}) or config.get("replacement_words", {})
-        for old_word, new_word in replacements.items():
-            processed_text = processed_text.replace(old_word, new_word)
-        
-        # 添加尾巴文本
-        tail_text = config.get("tail_text", "")
-        tail_position = config.get("tail_position", "end")
-        
-        if tail_text and self._should_add_tail_text(config):
-            if not processed_text.strip():
-                # 如果原始文本为空，直接使用小尾巴文本
-                processed_text = tail_text
-            else:
-                # 如果原始文本不为空，按位置添加小尾巴
-                if tail_position == "start":
-                    processed_text = f"{tail_text}\n\n{processed_text}"
-                else:  # end
-                    processed_text = f"{processed_text}\n\n{tail_text}"
-        
-        # 添加自定义按钮
-        reply_markup = None
-        if self._should_add_buttons(config):
-            custom_buttons = config.get("buttons", [])
-            if custom_buttons:
-                button_rows = []
-                for button_config in custom_buttons:
-                    text_btn = button_config.get("text", "")
-                    url_btn = button_config.get("url", "")
-                    if text_btn and url_btn:
-                        # 处理URL格式
-                        url_btn = self._normalize_button_url(url_btn)
-                        if url_btn:
-                            button_rows.append([InlineKeyboardButton(text_btn, url=url_btn)])
-                
-                if button_rows:
-                    reply_markup = InlineKeyboardMarkup(button_rows)
-        
-        return processed_text.strip(), reply_markup
+        """完整的文本处理逻辑（使用按配置编译并缓存的文本处理流水线）"""
+        pipeline = get_text_pipeline(config)
+        # 频率控制带计数器，每条消息都要判断（与流水线本身无关）
+        add_tail = bool(pipeline.tail_text) and self._should_add_tail_text(config)
+        add_buttons = self._should_add_buttons(config)
+        return pipeline.process(text, add_tail=add_tail, add_buttons=add_buttons)
     
     def _should_add_tail_text(self, config: Dict[str, Any]) -> bool:
         """检查是否应该添加尾巴文本"""
@@ -1339,22 +2003,7 @@ class RobustCloningEngine:
     
     def _normalize_button_url(self, url: str) -> str:
         """标准化按钮URL"""
-        if not url:
-            return ""
-        
-        # 处理@username格式
-        if url.startswith("@"):
-            return f"t.me/{url[1:]}"
-        
-        # 处理纯用户名
-        if not url.startswith(("http://", "https://", "t.me/")):
-            return f"t.me/{url}"
-        
-        # 验证URL
-        if url.startswith(("http://", "https://", "t.me/")):
-            return url
-        
-        return ""
+        return normalize_button_url(url)
     
     async def _process_media_group(
         self, 
@@ -1366,10 +2015,6 @@ class RobustCloningEngine:
     ) -> bool:
         """处理媒体组，防止重复发送"""
         try:
-            # 🔧 新增：发送前检查全局FloodWait限制
-            if self.flood_wait_manager:
-                await self.flood_wait_manager.wait_if_needed('send_media_group')
-            
             if not group_messages:
                 return False
             
@@ -1454,9 +2099,9 @@ class RobustCloningEngine:
                 return True
             
             # 发送媒体组
-            results = await self.client.send_media_group(
-                chat_id=target_chat_id,
-                media=media_list
+            results = await self._dispatch_send(
+                target_chat_id, 'send_media_group',
+                lambda: self.client.send_media_group(chat_id=target_chat_id, media=media_list)
             )
             
             # 🔧 修复：发送成功后立即标记为已处理
@@ -1473,10 +2118,13 @@ class RobustCloningEngine:
             # 如果有按钮需要添加，直接发送按钮（不添加额外文本）
             if reply_markup and results:
                 try:
-                    await self.client.send_message(
-                        chat_id=target_chat_id,
-                        text="",  # 空文本，只显示按钮
-                        reply_markup=reply_markup
+                    await self._dispatch_send(
+                        target_chat_id, 'send_message',
+                        lambda: self.client.send_message(
+                            chat_id=target_chat_id,
+                            text="",  # 空文本，只显示按钮
+                            reply_markup=reply_markup
+                        )
                     )
                 except Exception as button_error:
                     logging.warning(f"发送媒体组按钮失败: {button_error}")
@@ -1515,11 +2163,17 @@ class RobustCloningEngine:
                 return False
             
             # 🔧 优化：统一的FloodWait处理
-            if "FLOOD_WAIT" in str(e):
+            if "FLOOD_WAIT" in str(e) and self.send_scheduler:
+                # 调度器已暂停该目标并重试，仍失败说明等待时间超过上限
+                self.last_flood_wait_time = time.time()
+                logging.error(f"❌ 媒体组FloodWait等待过长，发送调度器已放弃: {e}")
+            elif "FLOOD_WAIT" in str(e):
                 import re
                 wait_match = re.search(r'wait of (\d+) seconds', str(e))
                 if wait_match:
                     wait_time = int(wait_match.group(1))
+                    # 通知自适应批次控制器收缩批次
+                    self.last_flood_wait_time = time.time()
                     
                     # 🔧 新增：使用统一的FloodWait管理器
                     if self.flood_wait_manager:
@@ -1531,7 +2185,7 @@ class RobustCloningEngine:
                             logging.warning(f"⏳ 媒体组遇到FloodWait，通过统一管理器等待 {wait_time} 秒")
                             
                             # 使用统一管理器的等待机制
-                            await self.flood_wait_manager.wait_if_needed('send_media_group')
+                            await self.flood_wait_manager.wait_if_needed('send_media_group', chat_id=target_chat_id)
                             
                             # 重试一次
                             try:
@@ -1605,6 +2259,11 @@ class RobustCloningEngine:
             else:
                 logging.error(f"❌ 处理媒体组失败: {e}")
             
+            if self._queue_for_retry(group_messages, target_chat_id, config, stats, task_key,
+                                     parse_flood_wait(e), media_group=True):
+                stats["total_processed"] += len(group_messages)
+                return False
+            
             stats["errors"] += len(group_messages)
             stats["total_processed"] += len(group_messages)
             return False
@@ -1623,10 +2282,6 @@ class RobustCloningEngine:
                 logging.warning(f"⚠️ 跳过服务消息 {original_message.id}（无法复制）")
                 return False
             
-            # 🔧 新增：发送前检查全局FloodWait限制
-            if self.flood_wait_manager:
-                await self.flood_wait_manager.wait_if_needed('send_message')
-            
             # 判断消息类型
             is_text_only = (original_message.text and not (
                 original_message.photo or original_message.video or 
@@ -1637,19 +2292,25 @@ class RobustCloningEngine:
             logging.debug(f"准备发送消息 {original_message.id}: is_text_only={is_text_only}")
             
             if is_text_only:
-                result = await self.client.send_message(
-                    chat_id=target_chat_id,
-                    text=processed_text or "（空消息）",
-                    reply_markup=reply_markup
+                result = await self._dispatch_send(
+                    target_chat_id, 'send_message',
+                    lambda: self.client.send_message(
+                        chat_id=target_chat_id,
+                        text=processed_text or "（空消息）",
+                        reply_markup=reply_markup
+                    )
                 )
                 logging.debug(f"文本消息发送结果: {result.id if result else 'None'}")
             else:
-                result = await self.client.copy_message(
-                    chat_id=target_chat_id,
-                    from_chat_id=original_message.chat.id,
-                    message_id=original_message.id,
-                    caption=processed_text,
-                    reply_markup=reply_markup
+                result = await self._dispatch_send(
+                    target_chat_id, 'copy_message',
+                    lambda: self.client.copy_message(
+                        chat_id=target_chat_id,
+                        from_chat_id=original_message.chat.id,
+                        message_id=original_message.id,
+                        caption=processed_text,
+                        reply_markup=reply_markup
+                    )
                 )
                 logging.debug(f"媒体消息复制结果: {result.id if result else 'None'}")
             
@@ -1671,13 +2332,24 @@ class RobustCloningEngine:
                 self._permission_errors.add(target_chat_id)
                 return False
             
+            flood_wait = parse_flood_wait(e)
+            if flood_wait is not None:
+                # 记录FloodWait失败，由调用方决定是否加入重试队列（重试成功时该记录会被忽略）
+                self._flood_wait_failures[(str(target_chat_id), original_message.id)] = flood_wait
+            
             # 🔧 优化：统一的FloodWait处理
-            if "FLOOD_WAIT" in str(e):
+            if "FLOOD_WAIT" in str(e) and self.send_scheduler:
+                # 调度器已暂停该目标并重试，仍失败说明等待时间超过上限
+                self.last_flood_wait_time = time.time()
+                logging.error(f"❌ 消息 {original_message.id} FloodWait等待过长，发送调度器已放弃: {e}")
+            elif "FLOOD_WAIT" in str(e):
                 import re
                 # 提取等待时间
                 wait_match = re.search(r'wait of (\d+) seconds', str(e))
                 if wait_match:
                     wait_time = int(wait_match.group(1))
+                    # 通知自适应批次控制器收缩批次
+                    self.last_flood_wait_time = time.time()
                     
                     # 🔧 新增：使用统一的FloodWait管理器
                     if self.flood_wait_manager:
@@ -1689,7 +2361,7 @@ class RobustCloningEngine:
                             logging.warning(f"⏳ 消息 {original_message.id} 遇到FloodWait，通过统一管理器等待 {wait_time} 秒")
                             
                             # 使用统一管理器的等待机制
-                            await self.flood_wait_manager.wait_if_needed('send_message')
+                            await self.flood_wait_manager.wait_if_needed('send_message', chat_id=target_chat_id)
                             
                             # 重试一次
                             try:
@@ -1762,35 +2434,39 @@ class RobustCloningEngine:
                 logging.error(f"❌ 发送消息 {original_message.id} 失败: {e}")
             return False
     
-    async def _process_messages_batch(self, messages: List[Message], target_chat_id: str, config: dict, stats: dict, task_key: str) -> None:
-        """批量处理消息，提升处理效率"""
+    async def _process_messages_batch(self, messages: List[Message], target_chat_id: str, config: dict, stats: dict, task_key: str,
+                                      message_batch: Optional[MessageBatch] = None) -> None:
+        """批量处理消息，提升处理效率
+        
+        message_batch 为调用方已提取（并可能已过滤）的列式批次，未提供时在这里构建。
+        """
         if not messages:
             return
         
-        # 第一步：批量预处理和验证
+        # 第一步：批量预处理和验证（在列上对整批执行）
+        if message_batch is None:
+            message_batch = MessageBatch(messages)
+        stats["invalid_messages"] += message_batch.invalid
+        stats["total_processed"] += len(message_batch)
+        
+        # 批量已处理检查
+        processed = self.processed_message_ids.get(task_key)
+        processed_flags = processed.contains_many(message_batch.ids) if processed else bytearray(len(message_batch))
+        
+        # 批量过滤检查
+        filter_reasons = message_batch.filter_reasons
+        if filter_reasons is None:
+            filter_reasons = message_batch.apply_filter(get_message_filter(config))
+        
         valid_messages = []
-        for message in messages:
-            # 批量有效性检查
-            if not hasattr(message, 'id') or message.id is None:
-                stats["invalid_messages"] += 1
-                continue
-            if not hasattr(message, 'chat') or message.chat is None:
-                stats["invalid_messages"] += 1
-                continue
-            
-            stats["total_processed"] += 1
-            
-            # 批量已处理检查
-            if self._is_message_processed(task_key, message.id):
+        for message, already_processed, reason in zip(message_batch.messages, processed_flags, filter_reasons):
+            if already_processed:
                 stats["already_processed"] += 1
-                continue
-            
-            # 批量过滤检查
-            if self._should_filter_message(message, config):
+            elif reason is not None:
+                logging.debug(f"消息 {message.id} 被过滤: {reason}")
                 stats["filtered_messages"] += 1
-                continue
-                
-            valid_messages.append(message)
+            else:
+                valid_messages.append(message)
         
         # 第二步：批量内容处理
         processed_messages = []
@@ -1826,42 +2502,173 @@ class RobustCloningEngine:
                 logging.error(f"❌ 预处理消息 {message.id} 时出错: {e}")
                 stats["errors"] += 1
         
-        # 第三步：批量发送（使用并发）
-        if processed_messages:
-            # 创建发送任务
-            send_tasks = []
-            for item in processed_messages:
-                task = self._send_message_batch_item(
-                    item['message'], target_chat_id, 
-                    item['processed_text'], item['reply_markup'],
-                    item['fingerprint'], stats, task_key
-                )
-                send_tasks.append(task)
+        # 第三步：按顺序切分为“未改动的连续消息”和“需要逐条发送的消息”两类片段
+        bulk_mode = self._get_bulk_send_mode(config)
+        segments = []
+        for item in processed_messages:
+            is_bulk = bool(bulk_mode) and self._is_untransformed(item['message'], item['processed_text'], item['reply_markup'])
+            if segments and segments[-1][0] == is_bulk and not (is_bulk and len(segments[-1][1]) >= MAX_IDS_PER_BULK_SEND):
+                segments[-1][1].append(item)
+            else:
+                segments.append((is_bulk, [item]))
+        
+        for is_bulk, items in segments:
+            if is_bulk and len(items) > 1:
+                # 一次请求发送整段未改动的消息
+                if await self._send_bulk_safe([item['message'] for item in items], target_chat_id, bulk_mode):
+                    for item in items:
+                        message = item['message']
+                        self._mark_message_processed(task_key, message.id)
+                        self.deduplicator.add_fingerprint(message.chat.id, target_chat_id, item['fingerprint'])
+                    stats["successfully_cloned"] += len(items)
+                    logging.debug(f"✅ 批量{bulk_mode}成功: {len(items)} 条消息")
+                    continue
+                
+                # FloodWait：整段加入重试队列，不再逐条发送（逐条发送会再次触发FloodWait，
+                # 批量请求实际已送达时还会造成重复）
+                flood_wait = self._flood_wait_failures.pop((str(target_chat_id), items[0]['message'].id), None)
+                if flood_wait is not None:
+                    if self._queue_for_retry([item['message'] for item in items], target_chat_id, config, stats, task_key, flood_wait):
+                        logging.info(f"🔁 批量{bulk_mode}因FloodWait放弃，{len(items)} 条消息已加入重试队列")
+                    else:
+                        stats["errors"] += len(items)
+                        logging.warning(f"❌ 批量{bulk_mode}因FloodWait放弃: {len(items)} 条消息")
+                    continue
+                logging.info(f"↩️ 批量{bulk_mode}未成功，{len(items)} 条消息回退为逐条发送")
+            
+            await self._send_items_concurrently(items, target_chat_id, config, stats, task_key)
+    
+    async def _send_items_concurrently(self, items: List[dict], target_chat_id: str, config: dict, stats: dict, task_key: str) -> None:
+        """逐条发送（使用并发）"""
+        # 创建发送任务
+        send_tasks = []
+        for item in items:
+            task = self._send_message_batch_item(
+                item['message'], target_chat_id, 
+                item['processed_text'], item['reply_markup'],
+                item['fingerprint'], config, stats, task_key
+            )
+            send_tasks.append(task)
+        
+        # 并发执行发送任务（限制并发数）
+        batch_size = min(5, len(send_tasks))  # 最多5个并发
+        for i in range(0, len(send_tasks), batch_size):
+            batch = send_tasks[i:i + batch_size]
+            await asyncio.gather(*batch, return_exceptions=True)
+            
+            # 批次间短暂延迟，避免过于频繁
+            if i + batch_size < len(send_tasks):
+                await asyncio.sleep(0.1)
+    
+    def _get_bulk_send_mode(self, config: Dict[str, Any]) -> Optional[str]:
+        """批量发送模式（频道组配置 bulk_send_mode）：off（默认，逐条发送）、
+        copy（隐藏来源）或 forward（保留转发来源）"""
+        mode = config.get("bulk_send_mode", "off")
+        return mode if mode in ("copy", "forward") else None
+    
+    def _is_untransformed(self, message: Message, processed_text: str, reply_markup: Optional[InlineKeyboardMarkup]) -> bool:
+        """消息处理后是否与原文完全一致（无替换、无小尾巴），且原消息和处理结果都不带按钮，可直接原样转发
+        
+        原消息带按钮时即使处理后按钮被移除也不算未改动：ForwardMessages 会保留原按钮。
+        """
+        if reply_markup is not None or getattr(message, 'reply_markup', None):
+            return False
+        if getattr(message, 'service', None):
+            return False
+        original_text = message.text or message.caption or ""
+        return processed_text == original_text
+    
+    async def _invoke_forward_drop_author(self, from_chat_id: Any, target_chat_id: str, message_ids: List[int]):
+        """ForwardMessages + drop_author：批量复制（不显示转发来源）"""
+        return await self.client.invoke(
+            raw.functions.messages.ForwardMessages(
+                to_peer=await self.client.resolve_peer(target_chat_id),
+                from_peer=await self.client.resolve_peer(from_chat_id),
+                id=message_ids,
+                random_id=[self.client.rnd_id() for _ in message_ids],
+                drop_author=True
+            )
+        )
+    
+    async def _dispatch_send(self, target_chat_id: str, operation: str, send_factory):
+        """发送统一入口：有发送调度器时以历史搬运优先级提交，否则按令牌桶限流后直接发送
+        
+        send_factory 每次调用返回一个新的发送协程（调度器重试时会再次调用）。
+        """
+        if self.send_scheduler:
+            return await self.send_scheduler.submit(
+                target_chat_id, send_factory, priority=PRIORITY_BULK, operation=operation
+            )
+        if self.flood_wait_manager:
+            await self.flood_wait_manager.wait_if_needed(operation, chat_id=target_chat_id)
+        return await send_factory()
+    
+    async def _send_bulk_safe(self, messages: List[Message], target_chat_id: str, mode: str = "copy") -> bool:
+        """一次请求转发多条未改动的消息（同一来源，最多 MAX_IDS_PER_BULK_SEND 条）
+        
+        copy 模式使用 ForwardMessages + drop_author，效果与逐条 copy_message 相同；forward 模式保留转发来源。
+        失败时返回 False；因FloodWait放弃时在 _flood_wait_failures 中按第一条消息记录等待秒数，
+        由调用方加入重试队列，其他错误由调用方回退为逐条发送。
+        """
+        from_chat_id = messages[0].chat.id
+        message_ids = [message.id for message in messages]
+        
+        for attempt in range(2):
+            try:
+                if mode == "forward":
+                    send_factory = lambda: self.client.forward_messages(
+                        chat_id=target_chat_id,
+                        from_chat_id=from_chat_id,
+                        message_ids=message_ids
+                    )
+                else:
+                    send_factory = lambda: self._invoke_forward_drop_author(from_chat_id, target_chat_id, message_ids)
+                
+                await self._dispatch_send(target_chat_id, 'forward_message', send_factory)
+                return True
             
-            # 并发执行发送任务（限制并发数）
-            batch_size = min(5, len(send_tasks))  # 最多5个并发
-            for i in range(0, len(send_tasks), batch_size):
-                batch = send_tasks[i:i + batch_size]
-                await asyncio.gather(*batch, return_exceptions=True)
+            except Exception as e:
+                if "CHAT_WRITE_FORBIDDEN" in str(e):
+                    logging.error(f"❌ 目标频道 {target_chat_id} 权限不足，无法发送消息")
+                    if not hasattr(self, '_permission_errors'):
+                        self._permission_errors = set()
+                    self._permission_errors.add(target_chat_id)
+                    return False
                 
-                # 批次间短暂延迟，避免过于频繁
-                if i + batch_size < len(send_tasks):
-                    await asyncio.sleep(0.1)
+                wait_time = parse_flood_wait(e)
+                if wait_time is not None:
+                    self.last_flood_wait_time = time.time()
+                    if self.flood_wait_manager:
+                        self.flood_wait_manager.set_flood_wait('forward_message', wait_time)
+                    
+                    if attempt == 0 and wait_time <= 60 and not self.send_scheduler:
+                        logging.warning(f"⏳ 批量{mode} {len(message_ids)} 条消息遇到FloodWait，等待 {wait_time} 秒后重试")
+                        await asyncio.sleep(wait_time)
+                        continue
+                    self._flood_wait_failures[(str(target_chat_id), message_ids[0])] = wait_time
+                
+                logging.warning(f"⚠️ 批量{mode} {message_ids[0]}-{message_ids[-1]} 失败: {e}")
+                return False
+        
+        return False
     
     async def _send_message_batch_item(self, message: Message, target_chat_id: str, 
                                      processed_text: str, reply_markup, fingerprint, 
-                                     stats: dict, task_key: str) -> bool:
+                                     config: dict, stats: dict, task_key: str) -> bool:
         """批量发送中的单个消息处理"""
         try:
             success = await self._send_message_safe(
                 message, target_chat_id, processed_text, reply_markup
             )
+            flood_wait = self._flood_wait_failures.pop((str(target_chat_id), message.id), None)
             
             if success:
                 self._mark_message_processed(task_key, message.id)
                 self.deduplicator.add_fingerprint(message.chat.id, target_chat_id, fingerprint)
                 stats["successfully_cloned"] += 1
                 logging.debug(f"✅ 批量发送成功: {message.id}")
+            elif self._queue_for_retry([message], target_chat_id, config, stats, task_key, flood_wait):
+                logging.debug(f"🔁 批量发送因FloodWait放弃，已加入重试队列: {message.id}")
             else:
                 stats["errors"] += 1
                 logging.warning(f"❌ 批量发送失败: {message.id}")
@@ -1872,6 +2679,117 @@ class RobustCloningEngine:
             stats["errors"] += 1
             return False
     
+    def _queue_for_retry(self, messages: List[Message], target_chat_id: str, config: dict, stats: dict,
+                         task_key: str, flood_wait: Optional[int], media_group: bool = False) -> bool:
+        """把因FloodWait放弃发送的消息加入持久化重试队列，加入成功返回 True（不再计为错误）"""
+        if not self.retry_queue or flood_wait is None or not messages:
+            return False
+        self.retry_queue.add(
+            source=messages[0].chat.id,
+            message_ids=[message.id for message in messages],
+            target=target_chat_id,
+            config=config,
+            wait_seconds=flood_wait,
+            reason=f"FLOOD_WAIT {flood_wait}s",
+            task_key=task_key,
+            media_group=media_group
+        )
+        stats["retry_queued"] += len(messages)
+        return True
+    
+    async def replay_retry_queue(self, user_id: str = None, force: bool = False) -> Dict[str, int]:
+        """重放重试队列中已到期的记录（force=True 时忽略等待时间），返回本次重放统计
+        
+        消息会重新拉取并按入队时的配置处理；再次遇到FloodWait的记录会以新的等待时间留在队列中，
+        其余记录（成功、源消息已删除或其他错误）从队列移除。
+        """
+        stats = {
+            "total_processed": 0,
+            "successfully_cloned": 0,
+            "duplicates_skipped": 0,
+            "errors": 0,
+            "already_processed": 0,
+            "invalid_messages": 0,
+            "filtered_messages": 0,
+            "retry_queued": 0,
+            "entries": 0,
+            "source_deleted": 0
+        }
+        if not self.retry_queue:
+            return stats
+        
+        async with self._retry_replay_lock:
+            entries = self.retry_queue.list_entries(user_id, due_only=not force)
+            if not entries:
+                return stats
+            logging.info(f"🔁 开始重放重试队列: {len(entries)} 条记录")
+            
+            touched_task_keys = set()
+            for entry in entries:
+                queued_retry_after = entry.get("retry_after")
+                stats["entries"] += 1
+                source, target = entry["source"], entry["target"]
+                config = self.retry_queue.get_config(entry)
+                task_key = entry.get("task_key") or f"{source}_{target}_retry"
+                if task_key not in self.processed_message_ids:
+                    self._load_processed_ids(task_key)
+                touched_task_keys.add(task_key)
+                
+                try:
+                    fetched = await self.client.get_messages(source, entry["message_ids"])
+                    if not isinstance(fetched, list):
+                        fetched = [fetched]
+                    messages = [message for message in fetched if self._has_content(message)]
+                    
+                    if not messages:
+                        stats["source_deleted"] += len(entry["message_ids"])
+                        logging.info(f"🔁 重试记录的源消息已不存在，移除: {entry['id']}")
+                    elif entry.get("media_group"):
+                        await self._process_media_group(messages, target, config, stats, task_key)
+                    else:
+                        await self._process_messages_batch(messages, target, config, stats, task_key)
+                except Exception as e:
+                    # 拉取阶段遇到FloodWait时保留记录，稍后再试
+                    flood_wait = parse_flood_wait(e)
+                    if flood_wait is not None:
+                        self.retry_queue.reschedule(entry["id"], flood_wait)
+                        logging.warning(f"🔁 重放重试队列时遇到FloodWait {flood_wait} 秒，暂停重放")
+                        break
+                    logging.error(f"❌ 重放重试记录 {entry['id']} 失败: {e}")
+                    stats["errors"] += len(entry["message_ids"])
+                
+                # 没有被重新加入队列（重新入队会刷新 retry_after）的记录处理完毕
+                current = self.retry_queue.entries.get(entry["id"])
+                if current is not None and current.get("retry_after") == queued_retry_after:
+                    self.retry_queue.remove(entry["id"])
+            
+            for task_key in touched_task_keys:
+                self._save_processed_ids(task_key)
+            self.deduplicator.save_fingerprints()
+        
+        logging.info(f"🔁 重试队列重放完成: 成功 {stats['successfully_cloned']}, 重新入队 {stats['retry_queued']}, 错误 {stats['errors']}")
+        return stats
+    
+    def start_retry_drain(self, interval: float = 60.0) -> None:
+        """启动后台任务，定期重放已到期的重试记录（重复调用无副作用）"""
+        if not self.retry_queue:
+            return
+        if self._retry_drain_task and not self._retry_drain_task.done():
+            return
+        self._retry_drain_task = asyncio.create_task(self._retry_drain_loop(interval))
+        logging.info(f"🔁 重试队列后台重放已启动，检查间隔 {interval} 秒")
+    
+    async def _retry_drain_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self.retry_queue.list_entries(due_only=True):
+                    await self.replay_retry_queue()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"❌ 重试队列后台重放异常: {e}")
+    
     async def _get_message_comments(self, chat_id: str, message_id: int) -> List[Message]:
         """获取指定消息的评论 - 简化版本，提高成功率"""
         try:
@@ -12,6 +12,7 @@ from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
 from optimization_manager import get_optimization_stats, cleanup_resources
 from optimized_listener import get_listener_stats
+from send_scheduler import get_send_scheduler
 
 async def show_optimization_status(message, user_id):
     """显示优化状态"""
@@ -56,7 +57,26 @@ async def show_optimization_status(message, user_id):
         
         # 监听器状态
         text += "👂 **监听器状态:**\n"
-        text += f"• 媒体组缓存: {listener_stats.get('media_group_cache_size', 0)} 个\n\n"
+        text += f"• 媒体组缓存: {listener_stats.get('media_group_cache_size', 0)} 个\n"
+        media_group_stats = listener_stats.get('media_groups', {})
+        channel_stats = media_group_stats.get('channels', {})
+        text += f"• 迟到消息: {media_group_stats.get('late_items', 0)} 条\n"
+        if channel_stats:
+            windows = [channel['quiet_window'] for channel in channel_stats.values()]
+            text += f"• 安静期: {min(windows):.2f}s ~ {max(windows):.2f}s（{len(windows)} 个频道）\n"
+        text += "\n"
+        
+        # 发送调度器状态
+        scheduler_status = get_send_scheduler().get_status()
+        queued = scheduler_status.get('queued', {})
+        parked = {chat: remaining for chat, remaining in scheduler_status.get('parked_chats', {}).items() if remaining > 0}
+        text += "📤 **发送调度器:**\n"
+        text += f"• 排队: 实时 {queued.get('realtime', 0)} / 界面 {queued.get('ui', 0)} / 历史搬运 {queued.get('bulk', 0)}\n"
+        text += f"• FloodWait: {scheduler_status.get('flood_waits', 0)} 次\n"
+        text += f"• 暂停中的聊天: {len(parked)} 个"
+        if parked:
+            text += f"（最长剩余 {max(parked.values()):.0f} 秒）"
+        text += "\n\n"
         
         # 性能建议
         text += "💡 **性能建议:**\n"
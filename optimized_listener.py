@@ -13,122 +13,66 @@ from pyrogram import Client, filters
 from pyrogram.types import Message, InputMediaPhoto, InputMediaVideo, InlineKeyboardMarkup, InlineKeyboardButton
 
 from optimization_manager import get_cache_manager, get_connection_pool, get_memory_manager
+from send_scheduler import get_send_scheduler, PRIORITY_REALTIME
+from message_filter import get_message_filter
+from media_group_aggregator import MediaGroupAggregator
 
 class OptimizedListener:
     """优化后的监听器"""
     
-    def __init__(self):
+    def __init__(self, eager_fetch: bool = False):
         self.cache_manager = get_cache_manager()
         self.connection_pool = get_connection_pool()
         self.memory_manager = get_memory_manager()
         
-        # 媒体组缓存和定时器管理
-        self.media_group_cache = {}
-        self.media_group_timers = {}  # 存储每个媒体组的定时器
-        self.media_group_locks = {}   # 防止并发处理
+        # 媒体组聚合：同一媒体组只收集一次，齐全后发送到收到时匹配的所有频道组
+        # eager_fetch：收到第一条消息时直接获取整个相册
+        self.media_group_aggregator = MediaGroupAggregator(
+            self._process_complete_media_group,
+            fetch_group=self._fetch_media_group if eager_fetch else None
+        )
+        self.media_group_routes = {}  # (频道ID, media_group_id) -> (client, [(pair, cfg, uid)])
         
         logging.info("优化监听器初始化完成")
     
-    async def _handle_media_group(self, client: Client, message: Message, pair: Dict, cfg: Dict, uid: str):
-        """处理媒体组消息 - 优化版本"""
+    def _handle_media_group(self, client: Client, message: Message, routes: List):
+        """处理媒体组消息：交给聚合器收集，安静期结束或满10条后统一处理"""
         key = (message.chat.id, message.media_group_id)
-        
-        # 获取或创建锁
-        if key not in self.media_group_locks:
-            self.media_group_locks[key] = asyncio.Lock()
-        
-        async with self.media_group_locks[key]:
-            # 初始化缓存
-            if key not in self.media_group_cache:
-                self.media_group_cache[key] = []
-            
-            # 添加消息到缓存
-            self.media_group_cache[key].append(message)
-            
-            # 只有第一个消息设置定时器
-            if len(self.media_group_cache[key]) == 1:
-                # 取消之前的定时器（如果存在）
-                if key in self.media_group_timers:
-                    self.media_group_timers[key].cancel()
-                
-                # 创建新的定时器
-                timer = asyncio.create_task(self._process_media_group_after_delay(client, key, pair, cfg, uid))
-                self.media_group_timers[key] = timer
-            
-            # 智能检测：如果消息ID不连续，可能媒体组已完整
-            elif self._is_media_group_complete(self.media_group_cache[key]):
-                # 取消定时器，立即处理
-                if key in self.media_group_timers:
-                    self.media_group_timers[key].cancel()
-                    del self.media_group_timers[key]
-                
-                await self._process_complete_media_group(client, key, pair, cfg, uid)
-    
-    def _is_media_group_complete(self, messages: List[Message]) -> bool:
-        """检测媒体组是否完整（基于消息ID连续性）"""
-        if len(messages) < 2:
-            return False
-        
-        # 按ID排序
-        sorted_messages = sorted(messages, key=lambda m: m.id)
-        
-        # 检查ID是否连续
-        for i in range(1, len(sorted_messages)):
-            if sorted_messages[i].id - sorted_messages[i-1].id > 1:
-                # ID不连续，可能还有消息未到达
-                return False
-        
-        # 如果已有3个或更多消息且ID连续，认为可能完整
-        return len(messages) >= 3
+        if self.media_group_aggregator.add(message):
+            # 开始收集新的媒体组时记录路由（整组获取和处理回调都在之后的任务中执行）；
+            # 已随整组发出的迟到消息不会开始新的媒体组，也就不会留下无人清理的路由
+            self.media_group_routes[key] = (client, routes)
     
-    async def _process_media_group_after_delay(self, client: Client, key: tuple, pair: Dict, cfg: Dict, uid: str):
-        """延迟处理媒体组"""
-        try:
-            # 等待2.5秒收集更多消息
-            await asyncio.sleep(2.5)
-            
-            # 处理媒体组
-            await self._process_complete_media_group(client, key, pair, cfg, uid)
-            
-        except asyncio.CancelledError:
-            # 定时器被取消，说明媒体组已被其他方式处理
-            pass
-        except Exception as e:
-            logging.error(f"延迟处理媒体组失败: {e}")
-        finally:
-            # 清理定时器记录
-            if key in self.media_group_timers:
-                del self.media_group_timers[key]
+    async def _fetch_media_group(self, message: Message) -> List[Message]:
+        """用收到该媒体组时的连接一次获取整个相册"""
+        client, _ = self.media_group_routes[(message.chat.id, message.media_group_id)]
+        return await client.get_media_group(message.chat.id, message.id)
     
-    async def _process_complete_media_group(self, client: Client, key: tuple, pair: Dict, cfg: Dict, uid: str):
-        """处理完整的媒体组"""
-        if key not in self.media_group_cache:
-            return
-        
-        # 获取并清理缓存
-        group_messages = sorted(self.media_group_cache.pop(key), key=lambda m: m.id)
-        
-        # 清理锁
-        if key in self.media_group_locks:
-            del self.media_group_locks[key]
-        
-        # 过滤检查
-        if any(self._should_filter_message(m, cfg) for m in group_messages):
-            logging.info(f"媒体组 {key[1]} 被过滤，跳过")
-            return
-        
-        # 去重检查
-        if not await self._check_media_group_dedupe(group_messages[0], pair):
-            return
-        
-        # 构建媒体列表
-        media_list, caption, reply_markup = await self._build_media_group(group_messages, cfg)
-        
-        if media_list:
-            logging.info(f"✅ 处理完整媒体组: {len(group_messages)} 条消息 (ID: {key[1]})")
-            await self._send_media_group_with_retry(client, pair['target'], media_list, reply_markup, uid)
-        else:
-            logging.warning(f"⚠️ 媒体组无有效媒体: {len(group_messages)} 条消息 (ID: {key[1]})")
+    async def _process_complete_media_group(self, group_messages: List[Message]):
+        """处理完整的媒体组（聚合器回调，消息已按ID排序）"""
+        key = (group_messages[0].chat.id, group_messages[0].media_group_id)
+        client, routes = self.media_group_routes.pop(key, (None, []))
+        for pair, cfg, uid in routes:
+            try:
+                # 过滤检查
+                if any(self._should_filter_message(m, cfg) for m in group_messages):
+                    logging.info(f"媒体组 {key[1]} 被过滤，跳过")
+                    continue
+                
+                # 去重检查
+                if not await self._check_media_group_dedupe(group_messages[0], pair):
+                    continue
+                
+                # 构建媒体列表
+                media_list, caption, reply_markup = await self._build_media_group(group_messages, cfg)
+                
+                if media_list:
+                    logging.info(f"✅ 处理完整媒体组: {len(group_messages)} 条消息 (ID: {key[1]})")
+                    await self._send_media_group_with_retry(client, pair['target'], media_list, reply_markup, uid)
+                else:
+                    logging.warning(f"⚠️ 媒体组无有效媒体: {len(group_messages)} 条消息 (ID: {key[1]})")
+            except Exception as e:
+                logging.error(f"处理用户 {uid} 的媒体组 {key[1]} 失败: {e}")
     
     async def process_message(self, client: Client, message: Message, user_configs: Dict, matched_pairs: List):
         """处理监听到的消息"""
@@ -149,6 +93,7 @@ class OptimizedListener:
     
     async def _handle_message(self, client: Client, message: Message, user_configs: Dict, matched_pairs: List):
         """处理单条消息"""
+        media_group_routes = []
         for uid, pair in matched_pairs:
             try:
                 # 获取用户配置
@@ -160,14 +105,17 @@ class OptimizedListener:
                 if not pair.get("enabled", True):
                     continue
                 
-                # 处理媒体组消息
+                # 媒体组消息在所有频道组确定后统一交给聚合器
                 if message.media_group_id:
-                    await self._handle_media_group(client, message, pair, cfg, uid)
+                    media_group_routes.append((pair, cfg, uid))
                 else:
                     await self._handle_single_message(client, message, pair, cfg, uid)
                     
             except Exception as e:
                 logging.error(f"处理用户 {uid} 的频道组失败: {e}")
+        
+        if media_group_routes:
+            self._handle_media_group(client, message, media_group_routes)
     
     async def _handle_single_message(self, client: Client, message: Message, pair: Dict, cfg: Dict, uid: str):
         """处理单条消息"""
@@ -210,76 +158,12 @@ class OptimizedListener:
             return None
     
     def _should_filter_message(self, message: Message, cfg: Dict) -> bool:
-        """检查消息是否应该被过滤"""
+        """检查消息是否应该被过滤（与搬运引擎共用编译后的过滤谓词）"""
         try:
-            # 新增：评论区搬运控制
-            enable_comment_forwarding = cfg.get("enable_comment_forwarding", False)
-            
-            # 如果关闭评论区搬运，只搬运频道主发布的内容
-            if not enable_comment_forwarding:
-                # 检查消息是否来自频道主
-                # 频道主发布的消息通常没有 from_user 字段，或者 from_user 是频道本身
-                if hasattr(message, 'from_user') and message.from_user:
-                    # 如果消息有发送者信息，说明可能是评论或回复
-                    logging.debug(f"消息 {message.id} 被评论区过滤: 非频道主发布 (from_user: {message.from_user.id})")
-                    return True
-                else:
-                    # 没有 from_user 字段，通常是频道主发布的内容
-                    logging.debug(f"消息 {message.id} 通过评论区过滤: 频道主发布")
-            
-            # 新增：只搬运频道主信息
-            if cfg.get("channel_owner_only", False):
-                # 检查消息是否来自频道主
-                if hasattr(message, 'from_user') and message.from_user:
-                    # 如果消息有发送者信息，说明不是频道主发布的
-                    logging.debug(f"消息 {message.id} 被频道主过滤: 非频道主发布")
-                    return True
-            
-            # 新增：只搬运媒体内容
-            if cfg.get("media_only_mode", False):
-                # 检查消息是否包含媒体内容
-                has_media = any([
-                    message.photo,
-                    message.video,
-                    message.video_note,
-                    message.animation,
-                    message.document,
-                    message.audio,
-                    message.voice,
-                    message.sticker
-                ])
-                
-                if not has_media:
-                    logging.debug(f"消息 {message.id} 被媒体过滤: 不包含媒体内容")
-                    return True
-            
-            # 关键词过滤
-            filter_keywords = cfg.get("filter_keywords", [])
-            if filter_keywords:
-                text_content = (message.caption or message.text or "").lower()
-                if any(keyword.lower() in text_content for keyword in filter_keywords):
-                    return True
-            
-            # 文件类型过滤
-            filter_extensions = cfg.get("file_filter_extensions", [])
-            if filter_extensions and message.document:
-                filename = getattr(message.document, 'file_name', '')
-                if filename and '.' in filename:
-                    ext = filename.lower().rsplit('.', 1)[1]
-                    if ext in filter_extensions:
-                        return True
-            
-            # 媒体类型过滤
-            if message.photo and cfg.get("filter_photo"):
+            reason = get_message_filter(cfg).match(message)
+            if reason is not None:
+                logging.debug(f"消息 {message.id} 被过滤: {reason}")
                 return True
-            if message.video and cfg.get("filter_video"):
-                return True
-            
-            # 按钮过滤
-            filter_buttons = cfg.get("filter_buttons", False)
-            if filter_buttons and getattr(message, "reply_markup", None):
-                return True
-            
             return False
             
         except Exception as e:
@@ -510,68 +394,57 @@ class OptimizedListener:
             return None
     
     async def _send_media_group_with_retry(self, client: Client, target: str, media_list: List, reply_markup, uid: str):
-        """发送媒体组（带重试）"""
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                result = await client.send_media_group(chat_id=target, media=media_list)
-                
-                # 发送按钮（如果需要）
-                if reply_markup:
-                    await client.send_message(
-                        chat_id=target, 
-                        text="📋", 
-                        reply_markup=reply_markup
-                    )
-                
-                logging.info(f"用户 {uid} 成功发送媒体组到 {target}")
-                return
-                
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    logging.error(f"发送媒体组最终失败: {e}")
-                    raise
-                else:
-                    retry_delay = 2 ** attempt
-                    logging.warning(f"发送媒体组重试 {attempt + 1}/{max_retries}: {e}")
-                    await asyncio.sleep(retry_delay)
+        """发送媒体组（提交到发送调度器，FloodWait和网络错误的重试由调度器处理）"""
+        scheduler = get_send_scheduler()
+        try:
+            await scheduler.submit(
+                target,
+                lambda: client.send_media_group(chat_id=target, media=media_list),
+                priority=PRIORITY_REALTIME,
+                operation='send_media_group'
+            )
+            
+            # 发送按钮（如果需要）
+            if reply_markup:
+                await scheduler.submit(
+                    target,
+                    lambda: client.send_message(chat_id=target, text="📋", reply_markup=reply_markup),
+                    priority=PRIORITY_REALTIME
+                )
+            
+            logging.info(f"用户 {uid} 成功发送媒体组到 {target}")
+        except Exception as e:
+            logging.error(f"发送媒体组最终失败: {e}")
+            raise
     
     async def _send_message_with_retry(self, client: Client, message: Message, target: str, text: str, reply_markup, uid: str):
-        """发送消息（带重试）"""
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                is_text_only = (message.text and not (
-                    message.photo or message.video or message.document or 
-                    message.animation or message.audio or message.voice or message.sticker
-                ))
-                
-                if is_text_only:
-                    await client.send_message(
-                        chat_id=target,
-                        text=text,
-                        reply_markup=reply_markup
-                    )
-                else:
-                    await client.copy_message(
-                        chat_id=target,
-                        from_chat_id=message.chat.id,
-                        message_id=message.id,
-                        caption=text,
-                        reply_markup=reply_markup
-                    )
-                
-                logging.info(f"用户 {uid} 成功发送消息到 {target}")
-                return
-                
-            except Exception as e:
-                if attempt == max_retries - 1:
-                    logging.error(f"发送消息最终失败: {e}")
-                    raise
-                else:
-                    retry_delay = 2 ** attempt
-                    logging.warning(f"发送消息重试 {attempt + 1}/{max_retries}: {e}")
-                    await asyncio.sleep(retry_delay)
+        """发送消息（提交到发送调度器，FloodWait和网络错误的重试由调度器处理）"""
+        is_text_only = (message.text and not (
+            message.photo or message.video or message.document or 
+            message.animation or message.audio or message.voice or message.sticker
+        ))
+        
+        if is_text_only:
+            send_factory = lambda: client.send_message(
+                chat_id=target,
+                text=text,
+                reply_markup=reply_markup
+            )
+        else:
+            send_factory = lambda: client.copy_message(
+                chat_id=target,
+                from_chat_id=message.chat.id,
+                message_id=message.id,
+                caption=text,
+                reply_markup=reply_markup
+            )
+        
+        try:
+            await get_send_scheduler().submit(target, send_factory, priority=PRIORITY_REALTIME)
+            logging.info(f"用户 {uid} 成功发送消息到 {target}")
+        except Exception as e:
+            logging.error(f"发送消息最终失败: {e}")
+            raise
     
     def get_stats(self) -> Dict[str, Any]:
         """获取监听器统计信息"""
@@ -579,7 +452,8 @@ class OptimizedListener:
             'cache': self.cache_manager.get_stats(),
             'connections': self.connection_pool.get_stats(),
             'memory': self.memory_manager.get_stats(),
-            'media_group_cache_size': len(self.media_group_cache)
+            'media_group_cache_size': len(self.media_group_aggregator.pending),
+            'media_groups': self.media_group_aggregator.get_stats()
         }
 
 # 全局优化监听器实例
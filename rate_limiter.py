@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+令牌桶限流器
+按 全局 -> 操作类型 -> 目标聊天 三级限流，不同目标聊天之间互不阻塞
+"""
+
+import asyncio
+import time
+import logging
+from typing import Dict, Tuple, Optional, Any
+
+# Telegram 参考限制：全局约 30 条/秒，群组约 20 条/分钟，私聊约 1 条/秒；
+# 广播频道没有每分钟 20 条的限制，单独使用更宽的配额
+DEFAULT_GLOBAL_LIMIT = (30.0, 30.0)          # (每秒补充令牌数, 桶容量)
+DEFAULT_GROUP_CHAT_LIMIT = (20.0 / 60, 20.0)
+DEFAULT_CHANNEL_CHAT_LIMIT = (2.0, 20.0)
+DEFAULT_PRIVATE_CHAT_LIMIT = (1.0, 3.0)
+DEFAULT_OPERATION_LIMITS = {
+    # 一个媒体组最多包含10条消息，按更低的速率单独限制
+    'send_media_group': (3.0, 3.0),
+}
+
+# 聊天类型（pyrogram ChatType 的取值）-> 限制类别
+CHAT_KINDS = {
+    "channel": "channel",
+    "group": "group",
+    "supergroup": "group",
+    "private": "private",
+    "bot": "private",
+}
+
+class TokenBucket:
+    """令牌桶 - 先预占令牌再睡眠，预占在同一事件循环步骤内完成，不存在并发竞争"""
+    
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+    
+    def reserve(self, cost: float = 1.0) -> float:
+        """预占令牌，返回需要等待的秒数（令牌可以透支，透支部分按补充速率计算等待时间）"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= cost
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+    
+    def time_until_available(self, cost: float = 1.0) -> float:
+        """不预占令牌，返回令牌足够还需等待的秒数"""
+        self._refill(time.monotonic())
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+    
+    async def acquire(self, cost: float = 1.0) -> float:
+        """获取令牌，必要时等待，返回实际等待秒数"""
+        wait = self.reserve(cost)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+    
+    def is_idle(self) -> bool:
+        """桶已满（长时间未使用），可以被回收"""
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+class HierarchicalRateLimiter:
+    """分级令牌桶限流器
+    
+    获取顺序为 目标聊天 -> 操作类型 -> 全局：在等待某个聊天的配额时不会占用全局令牌，
+    因此一个被限速的目标不会拖慢其他目标。
+    
+    聊天的限制按类型选择：通过 note_chat_type 登记过类型的聊天（例如发送成功后从返回的
+    消息得知）使用对应的配额；未登记时正数ID按私聊、其余按群组的严格配额处理。
+    """
+    
+    def __init__(self, global_limit: Tuple[float, float] = DEFAULT_GLOBAL_LIMIT,
+                 group_chat_limit: Tuple[float, float] = DEFAULT_GROUP_CHAT_LIMIT,
+                 private_chat_limit: Tuple[float, float] = DEFAULT_PRIVATE_CHAT_LIMIT,
+                 operation_limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 max_chat_buckets: int = 5000,
+                 channel_chat_limit: Tuple[float, float] = DEFAULT_CHANNEL_CHAT_LIMIT):
+        self.global_bucket = TokenBucket(*global_limit)
+        self.group_chat_limit = group_chat_limit
+        self.channel_chat_limit = channel_chat_limit
+        self.private_chat_limit = private_chat_limit
+        self.chat_kinds: Dict[str, str] = {}  # 已知类型的聊天 -> channel / group / private
+        self.operation_limits = dict(DEFAULT_OPERATION_LIMITS if operation_limits is None else operation_limits)
+        self.operation_buckets: Dict[str, TokenBucket] = {}
+        self.chat_buckets: Dict[str, TokenBucket] = {}
+        self.max_chat_buckets = max_chat_buckets
+        self.stats = {"acquired": 0, "throttled": 0, "total_wait": 0.0}
+    
+    def _chat_limit(self, chat_id: Any) -> Tuple[float, float]:
+        """按已知的聊天类型选择限制；类型未知时正数ID为私聊，其余（负数ID、@用户名）按群组处理"""
+        kind = self.chat_kinds.get(str(chat_id))
+        if kind == "channel":
+            return self.channel_chat_limit
+        if kind == "group":
+            return self.group_chat_limit
+        if kind == "private":
+            return self.private_chat_limit
+        try:
+            if int(chat_id) > 0:
+                return self.private_chat_limit
+        except (TypeError, ValueError):
+            pass
+        return self.group_chat_limit
+    
+    def _get_chat_bucket(self, chat_id: Any) -> TokenBucket:
+        key = str(chat_id)
+        bucket = self.chat_buckets.get(key)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.max_chat_buckets:
+                self._evict_idle_chat_buckets()
+            bucket = TokenBucket(*self._chat_limit(chat_id))
+            self.chat_buckets[key] = bucket
+        return bucket
+    
+    def note_chat_type(self, chat_id: Any, chat_type: Any):
+        """登记聊天类型（ChatType 或其取值字符串），类型变化时按新的限制重建该聊天的令牌桶"""
+        kind = CHAT_KINDS.get(str(getattr(chat_type, "value", chat_type)).lower())
+        key = str(chat_id)
+        if kind is None or self.chat_kinds.get(key) == kind:
+            return
+        self.chat_kinds[key] = kind
+        old_bucket = self.chat_buckets.pop(key, None)
+        if old_bucket is not None:
+            # 保留已消耗的令牌（透支部分仍需等待），只更换速率和容量
+            old_bucket._refill(time.monotonic())
+            bucket = self._get_chat_bucket(chat_id)
+            bucket.tokens = min(bucket.capacity, old_bucket.tokens)
+        logging.debug(f"限流器: 聊天 {key} 的类型为 {kind}")
+    
+    def _get_operation_bucket(self, operation_type: str) -> Optional[TokenBucket]:
+        limit = self.operation_limits.get(operation_type)
+        if not limit:
+            return None
+        bucket = self.operation_buckets.get(operation_type)
+        if bucket is None:
+            bucket = TokenBucket(*limit)
+            self.operation_buckets[operation_type] = bucket
+        return bucket
+    
+    def _evict_idle_chat_buckets(self):
+        """回收已回满的聊天令牌桶（回满的桶与新建的桶等价）"""
+        idle_keys = [key for key, bucket in self.chat_buckets.items() if bucket.is_idle()]
+        for key in idle_keys:
+            del self.chat_buckets[key]
+        logging.debug(f"限流器回收了 {len(idle_keys)} 个空闲聊天令牌桶")
+    
+    async def acquire(self, operation_type: str, chat_id: Any = None, cost: float = 1.0) -> float:
+        """按 目标聊天 -> 操作类型 -> 全局 的顺序获取令牌，返回总等待秒数"""
+        waited = 0.0
+        if chat_id is not None:
+            waited += await self._get_chat_bucket(chat_id).acquire(cost)
+        operation_bucket = self._get_operation_bucket(operation_type)
+        if operation_bucket:
+            waited += await operation_bucket.acquire(cost)
+        waited += await self.global_bucket.acquire(cost)
+        
+        self.stats["acquired"] += 1
+        if waited > 0:
+            self.stats["throttled"] += 1
+            self.stats["total_wait"] += waited
+        return waited
+    
+    def chat_wait_time(self, chat_id: Any, cost: float = 1.0) -> float:
+        """目标聊天的配额还需等待多久（不预占），供调度器决定是否暂停该聊天"""
+        bucket = self.chat_buckets.get(str(chat_id))
+        return bucket.time_until_available(cost) if bucket else 0.0
+    
+    def set_operation_limit(self, operation_type: str, rate: float, capacity: float):
+        """设置（或覆盖）某个操作类型的限制"""
+        self.operation_limits[operation_type] = (rate, capacity)
+        self.operation_buckets.pop(operation_type, None)
+    
+    def set_global_limit(self, rate: float, capacity: float):
+        """设置全局限制"""
+        self.global_bucket = TokenBucket(rate, capacity)
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取限流器状态"""
+        return {
+            "global_tokens": round(self.global_bucket.tokens, 2),
+            "operation_buckets": len(self.operation_buckets),
+            "chat_buckets": len(self.chat_buckets),
+            "channel_chats": sum(1 for kind in self.chat_kinds.values() if kind == "channel"),
+            **self.stats
+        }
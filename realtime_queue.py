@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+实时监听的按目标频道有序发送队列
+每个目标频道一个先进先出队列和一个专用工作协程，按入队顺序（即源频道消息顺序）逐条发送；
+消息处理器只负责入队，不等待发送。某个目标变慢（FloodWait、网络错误）只影响它自己的队列
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+# 等待占位任务填充的最长时间（秒），超时后跳过，避免一个媒体组卡住整个目标队列
+RESERVATION_TIMEOUT = 60
+# 队首任务等待超过该秒数时记录警告
+LAG_WARNING_SECONDS = 30
+# 工作协程空闲多久后退出（有新任务时重新创建）
+IDLE_WORKER_SECONDS = 300
+
+class RealtimeJob:
+    """队列中的一个发送任务
+    
+    run 为返回发送协程的函数；占位任务（reserve）在入队时还没有 run，
+    需要稍后调用 fill 填充（填充 None 表示不发送）。
+    """
+    
+    __slots__ = ("label", "enqueued_at", "run", "ready")
+    
+    def __init__(self, label: str, run: Optional[Callable[[], Awaitable[Any]]] = None,
+                 ready: Optional[asyncio.Future] = None):
+        self.label = label
+        self.enqueued_at = time.monotonic()
+        self.run = run
+        self.ready = ready
+    
+    def fill(self, run: Optional[Callable[[], Awaitable[Any]]]):
+        """填充占位任务（None 表示放弃发送）"""
+        self.run = run
+        if self.ready is not None and not self.ready.done():
+            self.ready.set_result(None)
+
+class TargetQueue:
+    """一个目标频道的队列和统计
+    
+    jobs 按入队顺序排列，队首即最早未发送的任务（用于计算当前延迟）；wakeup 在入队时唤醒工作协程。
+    """
+    
+    __slots__ = ("jobs", "wakeup", "worker", "sent", "failed", "skipped", "last_lag", "max_lag", "current")
+    
+    def __init__(self):
+        self.jobs: Deque[RealtimeJob] = deque()
+        self.wakeup = asyncio.Event()
+        self.worker: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.current: Optional[RealtimeJob] = None
+
+class OrderedTargetQueues:
+    """按目标频道分队列的有序发送"""
+    
+    def __init__(self, idle_seconds: float = IDLE_WORKER_SECONDS,
+                 reservation_timeout: float = RESERVATION_TIMEOUT):
+        self.idle_seconds = idle_seconds
+        self.reservation_timeout = reservation_timeout
+        self.targets: Dict[str, TargetQueue] = {}
+    
+    def _target(self, target: Any) -> TargetQueue:
+        key = str(target)
+        target_queue = self.targets.get(key)
+        if target_queue is None:
+            target_queue = self.targets[key] = TargetQueue()
+        if target_queue.worker is None or target_queue.worker.done():
+            target_queue.worker = asyncio.get_running_loop().create_task(self._worker(key, target_queue))
+        return target_queue
+    
+    def enqueue(self, target: Any, run: Callable[[], Awaitable[Any]], label: str = "") -> RealtimeJob:
+        """加入发送任务（必须在事件循环中调用），不等待发送完成"""
+        job = RealtimeJob(label, run)
+        self._put(target, job)
+        return job
+    
+    def reserve(self, target: Any, label: str = "") -> RealtimeJob:
+        """预留位置（例如媒体组收到第一条消息时），内容稍后用 job.fill 填充
+        
+        工作协程按顺序执行到占位任务时会等待填充，保证它与前后消息的先后顺序。
+        """
+        job = RealtimeJob(label, ready=asyncio.get_running_loop().create_future())
+        self._put(target, job)
+        return job
+    
+    def _put(self, target: Any, job: RealtimeJob):
+        target_queue = self._target(target)
+        target_queue.jobs.append(job)
+        target_queue.wakeup.set()
+    
+    async def _worker(self, key: str, target_queue: TargetQueue):
+        jobs = target_queue.jobs
+        while True:
+            if not jobs:
+                target_queue.wakeup.clear()
+                try:
+                    await asyncio.wait_for(target_queue.wakeup.wait(), timeout=self.idle_seconds)
+                except asyncio.TimeoutError:
+                    if not jobs:
+                        # 空闲退出；下一次入队时重新创建
+                        target_queue.worker = None
+                        return
+                continue
+            
+            job = jobs.popleft()
+            target_queue.current = job
+            try:
+                if job.ready is not None:
+                    try:
+                        await asyncio.wait_for(asyncio.shield(job.ready), timeout=self.reservation_timeout)
+                    except asyncio.TimeoutError:
+                        logging.warning(f"📤 目标 {key} 的占位任务 {job.label} 等待超时，跳过")
+                if job.run is None:
+                    target_queue.skipped += 1
+                    continue
+                
+                lag = time.monotonic() - job.enqueued_at
+                target_queue.last_lag = lag
+                target_queue.max_lag = max(target_queue.max_lag, lag)
+                if lag > LAG_WARNING_SECONDS:
+                    logging.warning(f"📤 目标 {key} 发送延迟 {lag:.0f} 秒，队列中还有 {len(jobs)} 条")
+                await job.run()
+                target_queue.sent += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                target_queue.failed += 1
+                logging.error(f"📤 实时发送失败: 目标 {key}, {job.label}, 错误: {e}")
+            finally:
+                target_queue.current = None
+    
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各目标的队列深度、当前延迟（最早未发送任务的等待时间）和发送统计"""
+        now = time.monotonic()
+        stats = {}
+        for key, target_queue in self.targets.items():
+            oldest = target_queue.current
+            if oldest is None and target_queue.jobs:
+                oldest = target_queue.jobs[0]
+            stats[key] = {
+                "depth": len(target_queue.jobs) + (1 if target_queue.current is not None else 0),
+                "lag": round(now - oldest.enqueued_at, 1) if oldest is not None else 0.0,
+                "last_lag": round(target_queue.last_lag, 2),
+                "max_lag": round(target_queue.max_lag, 2),
+                "sent": target_queue.sent,
+                "failed": target_queue.failed,
+                "skipped": target_queue.skipped,
+            }
+        return stats
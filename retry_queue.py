@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持久化重试队列
+记录因长时间FloodWait发送失败的消息 (源频道, 消息ID, 目标频道, 配置哈希)，
+等待时间结束后由搬运引擎重放，避免长任务丢消息
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from journal import AppendJournal
+
+class RetryQueue:
+    """持久化重试队列（快照 + 追加日志）
+    
+    同一组 (源频道, 消息ID列表, 目标频道) 只保留一条记录，重复入队时更新重试时间和次数。
+    配置按哈希去重保存一份快照，重放时使用失败当时的配置。
+    
+    修改以增量记录缓冲在内存中，在事件循环中 flush_interval 秒后批量追加到日志（一次 fsync），
+    日志过长时压缩为快照：FloodWait 集中爆发时连续入队不会每次重写整个文件。
+    快照文件即 file_path（与早期整文件写入的格式相同，可直接加载）。
+    """
+    
+    def __init__(self, file_path: str = "retry_queue.json", max_entries: int = 20000,
+                 flush_interval: float = 1.0, compact_threshold: int = 2000):
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.configs: Dict[str, Dict[str, Any]] = {}
+        self.journal = AppendJournal(file_path, compact_threshold=compact_threshold)
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.load()
+    
+    @staticmethod
+    def config_hash(config: Dict[str, Any]) -> str:
+        """配置哈希（键排序后的JSON），用于去重保存配置快照"""
+        data = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+    
+    @staticmethod
+    def _entry_id(source: Any, message_ids: List[int], target: Any) -> str:
+        return f"{source}|{target}|{','.join(str(i) for i in message_ids)}"
+    
+    def add(self, source: Any, message_ids: List[int], target: Any, config: Dict[str, Any],
+            wait_seconds: int, reason: str = "", task_key: str = None, media_group: bool = False,
+            user_id: str = None) -> str:
+        """加入（或更新）一条重试记录，返回记录ID"""
+        entry_id = self._entry_id(source, message_ids, target)
+        config_hash = self.config_hash(config)
+        if config_hash not in self.configs:
+            self.configs[config_hash] = config
+            self._record({"op": "config", "hash": config_hash, "config": config})
+        
+        now = time.time()
+        entry = self.entries.get(entry_id)
+        if entry is None:
+            if len(self.entries) >= self.max_entries:
+                logging.error(f"❌ 重试队列已满 ({self.max_entries})，丢弃 {entry_id}")
+                return entry_id
+            entry = {
+                "id": entry_id,
+                "source": source,
+                "message_ids": list(message_ids),
+                "target": target,
+                "config_hash": config_hash,
+                "task_key": task_key,
+                "media_group": media_group,
+                "user_id": user_id or config.get("owner_user_id"),
+                "attempts": 0,
+                "created_at": now,
+            }
+            self.entries[entry_id] = entry
+        entry["attempts"] += 1
+        entry["config_hash"] = config_hash
+        entry["retry_after"] = now + max(0, wait_seconds)
+        entry["reason"] = reason[:200]
+        self._record({"op": "put", "entry": entry})
+        logging.warning(f"🔁 已加入重试队列: {entry_id}，{wait_seconds} 秒后重试（第 {entry['attempts']} 次）")
+        return entry_id
+    
+    def reschedule(self, entry_id: str, wait_seconds: float):
+        """推迟一条记录的重试时间（例如重放时再次遇到FloodWait）"""
+        entry = self.entries.get(entry_id)
+        if entry is not None:
+            entry["retry_after"] = time.time() + max(0, wait_seconds)
+            self._record({"op": "put", "entry": entry})
+    
+    def get_config(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        return self.configs.get(entry.get("config_hash"), {})
+    
+    def list_entries(self, user_id: str = None, due_only: bool = False) -> List[Dict[str, Any]]:
+        """按重试时间排序列出记录，可按用户和是否到期筛选"""
+        now = time.time()
+        result = [
+            entry for entry in self.entries.values()
+            if (user_id is None or str(entry.get("user_id")) == str(user_id))
+            and (not due_only or entry.get("retry_after", 0) <= now)
+        ]
+        result.sort(key=lambda entry: entry.get("retry_after", 0))
+        return result
+    
+    def remove(self, entry_id: str):
+        if self.entries.pop(entry_id, None) is not None:
+            self._record({"op": "del", "id": entry_id})
+            self._prune_configs()
+    
+    def clear(self, user_id: str = None) -> int:
+        """清空重试队列（指定用户时只清空该用户的记录），返回清除数量"""
+        entry_ids = [entry["id"] for entry in self.list_entries(user_id)]
+        for entry_id in entry_ids:
+            del self.entries[entry_id]
+            self._record({"op": "del", "id": entry_id})
+        if entry_ids:
+            self._prune_configs()
+        return len(entry_ids)
+    
+    def summary(self, user_id: str = None) -> Dict[str, Any]:
+        """队列概况：记录数、消息数、已到期数、最近一次重试时间"""
+        entries = self.list_entries(user_id)
+        now = time.time()
+        return {
+            "entries": len(entries),
+            "messages": sum(len(entry["message_ids"]) for entry in entries),
+            "due": sum(1 for entry in entries if entry.get("retry_after", 0) <= now),
+            "next_retry_in": max(0, int(entries[0]["retry_after"] - now)) if entries else None,
+        }
+    
+    def _prune_configs(self):
+        """移除不再被引用的配置快照"""
+        used = {entry["config_hash"] for entry in self.entries.values()}
+        for config_hash in list(self.configs):
+            if config_hash not in used:
+                del self.configs[config_hash]
+    
+    def _record(self, record: Dict[str, Any]):
+        """缓冲一条增量记录，并安排批量写入"""
+        self.journal.append(record)
+        if self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中（启动阶段、脚本）：立即写入
+            self.save()
+            return
+        self._flush_handle = loop.call_later(self.flush_interval, self._scheduled_save)
+    
+    def _scheduled_save(self):
+        self._flush_handle = None
+        self.save()
+    
+    def _snapshot(self) -> Dict[str, Any]:
+        # 快照在后台线程写入，复制一份避免与之后的修改冲突
+        return {
+            "entries": {entry_id: dict(entry) for entry_id, entry in self.entries.items()},
+            "configs": dict(self.configs),
+        }
+    
+    def save(self):
+        """把缓冲的记录追加到日志（fsync），日志过长时压缩为快照（先写临时文件再替换）"""
+        try:
+            self.journal.flush()
+            if self.journal.needs_compaction():
+                self.journal.compact(self._snapshot)
+        except Exception as e:
+            logging.error(f"保存重试队列失败: {e}")
+    
+    def load(self):
+        """加载快照并重放之后的增量记录"""
+        try:
+            data = self.journal.load_snapshot() or {}
+            self.entries = data.get("entries", {})
+            self.configs = data.get("configs", {})
+            for record in self.journal.replay():
+                op = record.get("op")
+                if op == "put":
+                    self.entries[record["entry"]["id"]] = record["entry"]
+                elif op == "del":
+                    self.entries.pop(record["id"], None)
+                elif op == "config":
+                    self.configs[record["hash"]] = record["config"]
+            self._prune_configs()
+            if self.entries:
+                logging.info(f"已加载重试队列: {len(self.entries)} 条记录")
+        except Exception as e:
+            logging.error(f"加载重试队列失败: {e}")
+            self.entries = {}
+            self.configs = {}
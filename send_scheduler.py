@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+中央发送调度器
+所有发送路径（实时监听、界面编辑、历史搬运）统一提交到这里，按优先级调度；
+某个目标聊天遇到FloodWait时只暂停该聊天的队列，其他聊天继续发送
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from rate_limiter import HierarchicalRateLimiter
+
+# 优先级：数值越小越先发送
+PRIORITY_REALTIME = 0  # 实时监听
+PRIORITY_UI = 1        # 机器人界面编辑/回复
+PRIORITY_BULK = 2      # 历史消息搬运
+
+PRIORITY_NAMES = {PRIORITY_REALTIME: "realtime", PRIORITY_UI: "ui", PRIORITY_BULK: "bulk"}
+
+# 网络类临时错误的重试退避（秒）
+TRANSIENT_RETRY_DELAYS = (1, 2, 4)
+
+# 没有目标聊天的请求（例如编辑缺少 chat 的消息）各自单独排队，不占用任何聊天的配额
+UNKEYED_CHAT_PREFIX = "unkeyed:"
+
+def parse_flood_wait(error: Exception) -> Optional[int]:
+    """从异常中解析FloodWait等待秒数，不是FloodWait时返回 None"""
+    value = getattr(error, "value", None)
+    if "FLOOD_WAIT" in str(error) or type(error).__name__ == "FloodWait":
+        if isinstance(value, int):
+            return value
+        match = re.search(r'wait of (\d+) seconds', str(error))
+        if match:
+            return int(match.group(1))
+    return None
+
+class SendJob:
+    """一次发送请求"""
+    
+    __slots__ = ("priority", "seq", "chat_key", "rate_key", "operation", "factory", "future",
+                 "max_flood_wait", "attempts", "submitted_at")
+    
+    def __init__(self, priority: int, seq: int, chat_key: str, operation: str,
+                 factory: Callable[[], Awaitable[Any]], future: asyncio.Future,
+                 max_flood_wait: Optional[int], rate_key: Optional[str] = None):
+        self.priority = priority
+        self.seq = seq
+        self.chat_key = chat_key
+        self.rate_key = rate_key  # 限流器中的聊天键，None 表示不受聊天配额限制
+        self.operation = operation
+        self.factory = factory
+        self.future = future
+        self.max_flood_wait = max_flood_wait
+        self.attempts = 0
+        self.submitted_at = time.time()
+    
+    def __lt__(self, other: "SendJob") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class SendScheduler:
+    """按目标聊天分队列的优先级发送调度器
+    
+    - 每个目标聊天同一时刻只有一个请求在发送，同优先级按提交顺序发送
+    - 就绪的聊天按其队首请求的优先级竞争工作协程
+    - 聊天配额不足或遇到FloodWait时，仅暂停（park）该聊天，到期后自动恢复
+    - 超过 max_flood_wait 的FloodWait或重试次数用尽时，把原始异常抛回给提交方
+    """
+    
+    def __init__(self, rate_limiter: Optional[HierarchicalRateLimiter] = None,
+                 on_flood_wait: Optional[Callable[[str, int], Any]] = None,
+                 max_workers: int = 8, max_flood_wait: int = 300, max_attempts: int = 5):
+        self.rate_limiter = rate_limiter or HierarchicalRateLimiter()
+        self.on_flood_wait = on_flood_wait
+        self.max_workers = max_workers
+        self.max_flood_wait = max_flood_wait
+        self.max_attempts = max_attempts
+        
+        self.chat_queues: Dict[str, List[SendJob]] = {}
+        self.ready: List[tuple] = []          # (优先级, 序号, 聊天) 的堆，可能包含过期条目
+        self.parked_until: Dict[str, float] = {}
+        self.busy_chats = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._seq = itertools.count()
+        self.stats = {
+            "submitted": 0, "completed": 0, "failed": 0,
+            "flood_waits": 0, "retries": 0, "parked": 0
+        }
+    
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """绑定发送所在的事件循环（客户端所在的主循环），其他线程提交的发送会转交到该循环"""
+        self.loop = loop
+    
+    def _ensure_started(self):
+        """在当前事件循环中启动工作协程"""
+        if self.workers:
+            return
+        self.loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self.workers = [self.loop.create_task(self._worker(i)) for i in range(self.max_workers)]
+        logging.info(f"📮 发送调度器已启动: {self.max_workers} 个工作协程")
+    
+    async def submit(self, chat_id: Any, factory: Callable[[], Awaitable[Any]],
+                     priority: int = PRIORITY_BULK, operation: str = "send_message",
+                     max_flood_wait: Optional[int] = None) -> Any:
+        """提交一次发送并等待结果
+        
+        factory 每次调用返回一个新的发送协程（重试时会再次调用）。
+        可在其他线程的事件循环中调用，发送始终在调度器所在的事件循环中执行。
+        """
+        running_loop = asyncio.get_running_loop()
+        if self.loop is not None and not self.loop.is_closed() and running_loop is not self.loop:
+            future = asyncio.run_coroutine_threadsafe(
+                self.submit(chat_id, factory, priority, operation, max_flood_wait), self.loop
+            )
+            return await asyncio.wrap_future(future)
+        
+        self._ensure_started()
+        seq = next(self._seq)
+        rate_key = None if chat_id is None else str(chat_id)
+        chat_key = rate_key if rate_key is not None else f"{UNKEYED_CHAT_PREFIX}{seq}"
+        job = SendJob(priority, seq, chat_key, operation, factory,
+                      running_loop.create_future(),
+                      self.max_flood_wait if max_flood_wait is None else max_flood_wait,
+                      rate_key)
+        heapq.heappush(self.chat_queues.setdefault(chat_key, []), job)
+        self.stats["submitted"] += 1
+        self._mark_ready(chat_key)
+        return await job.future
+    
+    def _mark_ready(self, chat_key: str):
+        """聊天有待发请求且未被暂停、未在发送时，放入就绪堆"""
+        queue = self.chat_queues.get(chat_key)
+        if not queue or chat_key in self.busy_chats or chat_key in self.parked_until:
+            return
+        head = queue[0]
+        heapq.heappush(self.ready, (head.priority, head.seq, chat_key))
+        self._wakeup.set()
+    
+    def _park(self, chat_key: str, seconds: float):
+        """暂停某个聊天的队列，到期后重新就绪"""
+        until = time.time() + seconds
+        if self.parked_until.get(chat_key, 0) >= until:
+            return
+        self.parked_until[chat_key] = until
+        self.stats["parked"] += 1
+        self.loop.call_later(seconds, self._unpark, chat_key, until)
+    
+    def _unpark(self, chat_key: str, until: float):
+        if self.parked_until.get(chat_key) == until:
+            del self.parked_until[chat_key]
+            self._mark_ready(chat_key)
+    
+    def _take_next_job(self) -> Optional[SendJob]:
+        """从就绪堆中取出优先级最高的可发送请求"""
+        while self.ready:
+            _, _, chat_key = heapq.heappop(self.ready)
+            if chat_key in self.busy_chats or chat_key in self.parked_until:
+                continue
+            queue = self.chat_queues.get(chat_key)
+            if not queue:
+                continue
+            
+            # 聊天配额不足时暂停该聊天，不占用工作协程
+            chat_wait = self.rate_limiter.chat_wait_time(chat_key)
+            if chat_wait > 0:
+                self._park(chat_key, chat_wait)
+                continue
+            
+            job = heapq.heappop(queue)
+            if not queue:
+                del self.chat_queues[chat_key]
+            if job.future.done():
+                # 提交方已取消
+                self._mark_ready(chat_key)
+                continue
+            self.busy_chats.add(chat_key)
+            return job
+        return None
+    
+    async def _worker(self, index: int):
+        while True:
+            job = self._take_next_job()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            try:
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"📮 发送调度器工作协程 {index} 异常: {e}")
+            finally:
+                self.busy_chats.discard(job.chat_key)
+                self._mark_ready(job.chat_key)
+    
+    async def _run_job(self, job: SendJob):
+        job.attempts += 1
+        try:
+            await self.rate_limiter.acquire(job.operation, job.rate_key)
+            result = await job.factory()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            retry_delay = self._retry_delay(job, e)
+            if retry_delay is None:
+                self.stats["failed"] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            
+            # 放回队首并暂停该聊天，其他聊天继续发送
+            self.stats["retries"] += 1
+            heapq.heappush(self.chat_queues.setdefault(job.chat_key, []), job)
+            self._park(job.chat_key, retry_delay)
+            return
+        
+        self.stats["completed"] += 1
+        if job.rate_key is not None:
+            self._note_chat_type(job.rate_key, result)
+        if not job.future.done():
+            job.future.set_result(result)
+    
+    def _note_chat_type(self, chat_key: str, result: Any):
+        """从发送结果（消息或消息列表）中得知目标聊天的类型，交给限流器选择配额"""
+        if isinstance(result, list):
+            result = result[0] if result else None
+        chat_type = getattr(getattr(result, "chat", None), "type", None)
+        if chat_type is not None:
+            self.rate_limiter.note_chat_type(chat_key, chat_type)
+    
+    def _retry_delay(self, job: SendJob, error: Exception) -> Optional[float]:
+        """返回重试前需要暂停的秒数，不应重试时返回 None"""
+        if job.attempts >= self.max_attempts:
+            return None
+        
+        wait = parse_flood_wait(error)
+        if wait is not None:
+            self.stats["flood_waits"] += 1
+            if self.on_flood_wait:
+                try:
+                    self.on_flood_wait(job.operation, wait)
+                except Exception as callback_error:
+                    logging.debug(f"FloodWait回调失败: {callback_error}")
+            if wait > job.max_flood_wait:
+                logging.warning(f"⏳ 聊天 {job.chat_key} 的 {job.operation} FloodWait {wait} 秒超过上限 {job.max_flood_wait} 秒，放弃")
+                return None
+            logging.warning(f"⏳ 聊天 {job.chat_key} 遇到FloodWait，暂停该聊天 {wait} 秒（其他聊天继续）")
+            return wait + 1
+        
+        if isinstance(error, (asyncio.TimeoutError, ConnectionError, OSError)):
+            delay = TRANSIENT_RETRY_DELAYS[min(job.attempts, len(TRANSIENT_RETRY_DELAYS)) - 1]
+            logging.warning(f"📮 聊天 {job.chat_key} 发送出现网络错误，{delay} 秒后重试: {error}")
+            return delay
+        
+        return None
+    
+    def get_status(self) -> Dict[str, Any]:
+        """获取调度器状态：各优先级排队数、各聊天的排队数、被暂停的聊天（剩余秒数）等"""
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for queue in self.chat_queues.values():
+            for job in queue:
+                queued[PRIORITY_NAMES.get(job.priority, str(job.priority))] += 1
+        now = time.time()
+        return {
+            "queued": queued,
+            "chat_depths": {chat: len(queue) for chat, queue in self.chat_queues.items() if queue},
+            "active_chats": len(self.busy_chats),
+            "parked_chats": {chat: round(until - now, 1) for chat, until in self.parked_until.items()},
+            **self.stats
+        }
+
+# 全局发送调度器实例
+_send_scheduler: Optional[SendScheduler] = None
+
+def init_send_scheduler(**kwargs) -> SendScheduler:
+    """创建全局发送调度器（主程序启动时调用一次）"""
+    global _send_scheduler
+    _send_scheduler = SendScheduler(**kwargs)
+    return _send_scheduler
+
+def get_send_scheduler() -> SendScheduler:
+    """获取全局发送调度器，未初始化时使用默认配置创建"""
+    global _send_scheduler
+    if _send_scheduler is None:
+        _send_scheduler = SendScheduler()
+    return _send_scheduler
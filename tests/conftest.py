@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""测试公共设置：把仓库根目录加入导入路径，并提供导入 csmain 所需的环境变量"""
+
+import asyncio
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "test")
+os.environ.setdefault("BOT_TOKEN", "1:test")
+
+@pytest.fixture
+def csmain(tmp_path, monkeypatch):
+    """导入主程序模块（在临时目录中导入，避免写入仓库目录）
+    
+    模块级的 pyrogram Client 在创建时需要当前线程有事件循环，而之前的 asyncio.run 会清除它。
+    """
+    pytest.importorskip("pyrogram")
+    monkeypatch.chdir(tmp_path)
+    if "csmain" not in sys.modules:
+        asyncio.set_event_loop(asyncio.new_event_loop())
+    module = importlib.import_module("csmain")
+    monkeypatch.setattr(module, "robust_cloning_engine", None)
+    return module
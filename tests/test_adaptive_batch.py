@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""自适应批次控制器"""
+
+import time
+
+import pytest
+
+pytest.importorskip("pyrogram")
+
+from new_cloning_engine import MAX_IDS_PER_REQUEST, AdaptiveBatchController
+
+def make_controller():
+    return AdaptiveBatchController((20, 50), (0.1, 0.3))
+
+def test_sparse_ranges_grow_to_request_limit():
+    controller = make_controller()
+    assert controller.batch_size == 20
+    sizes = []
+    for _ in range(6):
+        controller.record(latency=0.2, requested=controller.batch_size, valid=controller.batch_size // 20)
+        sizes.append(controller.batch_size)
+    # 稀疏区间按倍数增长，直到单次请求上限
+    assert sizes[:3] == [40, 80, 160]
+    assert controller.batch_size == MAX_IDS_PER_REQUEST
+    assert controller.delay == pytest.approx(0.1)
+    assert controller.next_range(1, 10000) == (1, MAX_IDS_PER_REQUEST)
+    assert controller.next_range(9950, 10000) == (9950, 10000)
+
+def test_dense_ranges_stay_within_performance_limit():
+    controller = make_controller()
+    for _ in range(20):
+        controller.record(latency=0.2, requested=controller.batch_size, valid=controller.batch_size)
+        assert controller.batch_size <= controller.dense_max_size == 50
+    assert controller.batch_size == 50
+    
+    # 稀疏区间放大之后重新变密集，回落到性能模式上限
+    sparse = make_controller()
+    for _ in range(5):
+        sparse.record(latency=0.2, requested=sparse.batch_size, valid=0)
+    assert sparse.batch_size == MAX_IDS_PER_REQUEST
+    for _ in range(10):
+        sparse.record(latency=0.2, requested=sparse.batch_size, valid=sparse.batch_size)
+    assert sparse.batch_size == 50
+
+def test_slow_requests_shrink_batches():
+    controller = make_controller()
+    for _ in range(5):
+        controller.record(latency=0.2, requested=controller.batch_size, valid=controller.batch_size)
+    grown = controller.batch_size
+    controller.record(latency=10.0, requested=grown, valid=grown)
+    assert controller.batch_size == int(grown * 0.75)
+    assert controller.delay > 0.1
+
+def test_flood_wait_shrinks_and_cools_down():
+    controller = make_controller()
+    for _ in range(5):
+        controller.record(latency=0.2, requested=controller.batch_size, valid=0)
+    assert controller.batch_size == MAX_IDS_PER_REQUEST
+    
+    # 发送阶段遇到的FloodWait通过 last_flood_wait 传入
+    controller.record(latency=0.2, requested=200, valid=0, last_flood_wait=time.time())
+    assert controller.batch_size == MAX_IDS_PER_REQUEST // 2
+    assert controller.delay >= 0.5
+    assert controller.stats["flood_waits"] == 1
+    
+    # 冷却期内不再增大
+    for _ in range(5):
+        controller.record(latency=0.2, requested=controller.batch_size, valid=0)
+    assert controller.batch_size == MAX_IDS_PER_REQUEST // 2
+    
+    # 再次FloodWait继续减半，但不低于下限
+    for _ in range(10):
+        controller.note_flood_wait()
+    assert controller.batch_size == controller.min_size == 20
+    assert controller.delay <= controller.flood_max_delay
+    
+    # 冷却期结束后恢复增长
+    controller.last_flood_wait = time.time() - controller.flood_cooldown - 1
+    controller.record(latency=0.2, requested=controller.batch_size, valid=0)
+    assert controller.batch_size == 40
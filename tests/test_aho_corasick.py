@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Aho-Corasick 多模式匹配"""
+
+import random
+
+from aho_corasick import AhoCorasick
+
+def naive_replace(text, mapping):
+    """逐位置取最长匹配的参考实现"""
+    parts, position = [], 0
+    while position < len(text):
+        matches = [pattern for pattern in mapping if text.startswith(pattern, position)]
+        if matches:
+            pattern = max(matches, key=len)
+            parts.append(mapping[pattern])
+            position += len(pattern)
+        else:
+            parts.append(text[position])
+            position += 1
+    return "".join(parts)
+
+def test_search_and_find_all():
+    matcher = AhoCorasick(["he", "she", "his", "hers", "", "he"])
+    assert len(matcher) == 4  # 空模式和重复模式被忽略
+    assert matcher.search("ushers") == "she"
+    assert matcher.search("nothing") is None
+    assert matcher.find_all("ushers") == ["she", "he", "hers"]
+    assert sorted((start, matcher.patterns[index]) for start, index in matcher.iter_matches("ahishers")) == [
+        (1, "his"), (3, "she"), (4, "he"), (4, "hers")
+    ]
+
+def test_replace_prefers_leftmost_then_longest():
+    mapping = {"ab": "1", "abc": "2", "bcd": "3", "d": "4"}
+    matcher = AhoCorasick(mapping)
+    replacements = list(mapping.values())
+    # 同一起点取最长（abc），与其重叠的 bcd 被跳过，后续的 d 仍会被替换
+    assert matcher.replace("abcd", replacements) == "24"
+    # 最左优先：xbcd 中 bcd 先于 d 开始
+    assert matcher.replace("xbcd ab", replacements) == "x3 1"
+    assert matcher.replace("no match", replacements) == "no match"
+
+def test_replace_does_not_rescan_output():
+    mapping = {"猫": "狗", "狗": "猫", "a": "aa"}
+    matcher = AhoCorasick(mapping)
+    assert matcher.replace("猫和狗 a", list(mapping.values())) == "狗和猫 aa"
+
+def test_matches_naive_reference():
+    rng = random.Random(42)
+    for _ in range(300):
+        patterns = list(dict.fromkeys(
+            "".join(rng.choice("abc") for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 6))
+        ))
+        mapping = {pattern: f"<{i}>" for i, pattern in enumerate(patterns)}
+        text = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 30)))
+        matcher = AhoCorasick(patterns)
+        assert matcher.replace(text, list(mapping.values())) == naive_replace(text, mapping)
+        assert set(matcher.find_all(text)) == {pattern for pattern in patterns if pattern in text}
+        assert (matcher.search(text) is None) == (not any(pattern in text for pattern in patterns))
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""可扩展布隆过滤器"""
+
+import pytest
+
+from bloom_filter import BloomFilter, ScalableBloomFilter
+
+def test_no_false_negatives_across_growth():
+    bloom = ScalableBloomFilter(initial_capacity=100, error_rate=0.01)
+    items = [f"-1001_-1002:{i}" for i in range(3000)]
+    for item in items:
+        bloom.add(item)
+    # 100 + 400 + 1600 < 3000，已扩展到第4个过滤器
+    assert len(bloom.filters) == 4
+    assert [f.capacity for f in bloom.filters] == [100, 400, 1600, 6400]
+    assert all(item in bloom for item in items)
+    assert len(bloom) <= len(items)
+
+def test_add_reports_possible_duplicates():
+    bloom = ScalableBloomFilter(initial_capacity=10)
+    assert bloom.add("a") is True
+    assert bloom.add("a") is False
+    assert len(bloom) == 1
+
+def test_false_positive_rate_near_error_rate():
+    error_rate = 0.01
+    bloom = ScalableBloomFilter(initial_capacity=1000, error_rate=error_rate)
+    for i in range(5000):
+        bloom.add(f"member:{i}")
+    probes = 20000
+    false_positives = sum(f"absent:{i}" in bloom for i in range(probes))
+    # 各级误判率之和不超过 error_rate，留出统计波动的余量
+    assert false_positives / probes <= error_rate * 1.5
+
+def test_round_trip():
+    bloom = ScalableBloomFilter(initial_capacity=50, error_rate=0.001)
+    items = [f"item:{i}" for i in range(300)]
+    for item in items:
+        bloom.add(item)
+    restored = ScalableBloomFilter.from_dict(bloom.to_dict())
+    assert len(restored.filters) == len(bloom.filters)
+    assert [f.bits for f in restored.filters] == [f.bits for f in bloom.filters]
+    assert len(restored) == len(bloom)
+    assert all(item in restored for item in items)
+    # 恢复后继续写入当前（未满的）过滤器
+    restored.add("item:new")
+    assert "item:new" in restored and len(restored.filters) == len(bloom.filters)
+
+def test_from_dict_rejects_mismatched_bits():
+    data = BloomFilter(100, 0.01).to_dict()
+    data["capacity"] = 1000  # 参数与位数组长度不一致
+    with pytest.raises(ValueError):
+        BloomFilter.from_dict(data)
+    scalable = ScalableBloomFilter(initial_capacity=100)
+    scalable.add("x")
+    payload = scalable.to_dict()
+    payload["filters"][0]["error_rate"] = 0.000001
+    with pytest.raises(ValueError):
+        ScalableBloomFilter.from_dict(payload)
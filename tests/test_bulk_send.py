@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""未改动的连续消息合并为一次批量转发"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pyrogram")
+
+from message_filter import MEDIA_ATTRIBUTES
+from new_cloning_engine import MAX_IDS_PER_BULK_SEND, RobustCloningEngine
+from retry_queue import RetryQueue
+
+SOURCE = -1001
+TARGET = "-1002"
+
+class FloodWait(Exception):
+    def __init__(self, value):
+        super().__init__(f"Telegram says: [420 FLOOD_WAIT_X] - A wait of {value} seconds is required")
+        self.value = value
+
+class FakeClient:
+    """记录 ForwardMessages 请求；errors 中的异常依次在请求时抛出"""
+    
+    def __init__(self, errors=()):
+        self.bulk_calls = []
+        self.errors = list(errors)
+    
+    async def resolve_peer(self, chat_id):
+        return chat_id
+    
+    def rnd_id(self):
+        return 0
+    
+    async def invoke(self, request):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.bulk_calls.append(list(request.id))
+
+def make_message(message_id, text=None, reply_markup=None):
+    message = SimpleNamespace(id=message_id, chat=SimpleNamespace(id=SOURCE), text=text or f"消息 {message_id}",
+                              caption=None, from_user=None, reply_markup=reply_markup, service=None,
+                              media_group_id=None, forward_from=None, reply_to_message=None)
+    for attr in MEDIA_ATTRIBUTES:
+        setattr(message, attr, None)
+    return message
+
+def make_stats():
+    return dict.fromkeys(("total_processed", "successfully_cloned", "duplicates_skipped", "errors",
+                          "already_processed", "invalid_messages", "filtered_messages", "retry_queued"), 0)
+
+@pytest.fixture
+def make_engine(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    
+    def factory(client):
+        engine = RobustCloningEngine(client=client, retry_queue=RetryQueue(str(tmp_path / "retry_queue.json")))
+        engine.single_sends = []
+        
+        async def send_one(message, target_chat_id, processed_text, reply_markup):
+            engine.single_sends.append(message.id)
+            return True
+        engine._send_message_safe = send_one
+        return engine
+    return factory
+
+def run_batch(engine, messages, config):
+    stats = make_stats()
+    asyncio.run(engine._process_messages_batch(messages, TARGET, config, stats, f"{SOURCE}_{TARGET}"))
+    return stats
+
+def test_bulk_send_is_off_by_default(make_engine):
+    engine = make_engine(FakeClient())
+    stats = run_batch(engine, [make_message(i) for i in range(1, 6)], {})
+    assert engine.client.bulk_calls == []
+    assert engine.single_sends == [1, 2, 3, 4, 5]
+    assert stats["successfully_cloned"] == 5
+
+def test_modified_messages_split_segments(make_engine):
+    engine = make_engine(FakeClient())
+    config = {"bulk_send_mode": "copy", "replacement_words": {"替换": "已替换"}}
+    messages = [make_message(1), make_message(2), make_message(3, "需要替换"), make_message(4),
+                make_message(5), make_message(6, "消息 6  ")]
+    stats = run_batch(engine, messages, config)
+    # 1-2、4-5 各一次批量请求；被替换的 3 和空白被修改的 6 逐条发送
+    assert engine.client.bulk_calls == [[1, 2], [4, 5]]
+    assert sorted(engine.single_sends) == [3, 6]
+    assert stats["successfully_cloned"] == 6
+    assert list(engine.processed_message_ids[f"{SOURCE}_{TARGET}"]) == [1, 2, 3, 4, 5, 6]
+
+def test_bulk_segments_are_capped(make_engine):
+    engine = make_engine(FakeClient())
+    count = MAX_IDS_PER_BULK_SEND * 2 + 5
+    stats = run_batch(engine, [make_message(i) for i in range(1, count + 1)], {"bulk_send_mode": "copy"})
+    assert [len(ids) for ids in engine.client.bulk_calls] == [MAX_IDS_PER_BULK_SEND, MAX_IDS_PER_BULK_SEND, 5]
+    assert engine.client.bulk_calls[1][0] == MAX_IDS_PER_BULK_SEND + 1
+    assert stats["successfully_cloned"] == count
+
+def test_stripped_buttons_are_not_forwarded(make_engine):
+    engine = make_engine(FakeClient())
+    keyboard = SimpleNamespace(inline_keyboard=[[SimpleNamespace(text="广告", url="https://example.com")]])
+    config = {"bulk_send_mode": "copy", "filter_buttons": True, "filter_buttons_mode": "strip"}
+    messages = [make_message(1), make_message(2), make_message(3, reply_markup=keyboard), make_message(4)]
+    run_batch(engine, messages, config)
+    # 带按钮的消息逐条发送（发送时不带按钮），不能通过 ForwardMessages 保留原按钮
+    assert engine.client.bulk_calls == [[1, 2]]
+    assert engine.single_sends == [3, 4]
+
+def test_flood_wait_queues_segment_for_retry(make_engine):
+    engine = make_engine(FakeClient([FloodWait(600)]))
+    stats = run_batch(engine, [make_message(i) for i in range(1, 4)], {"bulk_send_mode": "copy"})
+    assert engine.single_sends == []
+    assert stats["retry_queued"] == 3
+    assert stats["errors"] == 0
+    entries = list(engine.retry_queue.entries.values())
+    assert [entry["message_ids"] for entry in entries] == [[1, 2, 3]]
+    assert f"{SOURCE}_{TARGET}" not in engine.processed_message_ids
+
+def test_other_errors_fall_back_to_single_sends(make_engine):
+    engine = make_engine(FakeClient([RuntimeError("MESSAGE_ID_INVALID")]))
+    stats = run_batch(engine, [make_message(i) for i in range(1, 4)], {"bulk_send_mode": "copy"})
+    assert engine.single_sends == [1, 2, 3]
+    assert stats["successfully_cloned"] == 3
+    assert stats["retry_queued"] == 0
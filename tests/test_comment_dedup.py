@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""评论去重：严格模式下按 SimHash 分段索引查找同一用户的近似重复评论"""
+
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pyrogram")
+
+from new_cloning_engine import MessageDeduplicator, simhash64
+
+SOURCE, TARGET = -1001, -2001
+KEY = f"{SOURCE}_{TARGET}"
+COMMENT = "这个视频拍得真好，感谢博主的分享，期待下一期更新"
+NEAR = "这个视频拍得真好，谢谢博主的分享，期待下一期更新"
+FAR = "今天天气不错，我们一起去公园散步吧"
+
+def make_comment(message_id, user_id, text):
+    return SimpleNamespace(
+        id=message_id, chat=SimpleNamespace(id=SOURCE), from_user=SimpleNamespace(id=user_id),
+        text=text, caption=None, forward_from=None, reply_to_message=None,
+        photo=None, video=None, document=None, animation=None, audio=None, voice=None, sticker=None
+    )
+
+def distance(a, b):
+    return bin(simhash64(a) ^ simhash64(b)).count("1")
+
+@pytest.fixture
+def dedup(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dedup = MessageDeduplicator()
+    dedup.config = {"comment_dedup_mode": "strict"}
+    dedup.add_fingerprint(SOURCE, TARGET, dedup.create_fingerprint(make_comment(1, 42, COMMENT)))
+    return dedup
+
+def test_near_duplicate_from_same_user_is_caught(dedup):
+    assert 0 < distance(COMMENT, NEAR) <= dedup.simhash_max_distance
+    assert dedup.is_duplicate(SOURCE, TARGET, dedup.create_fingerprint(make_comment(2, 42, NEAR))) is True
+
+def test_distant_comment_is_not_caught(dedup):
+    assert distance(COMMENT, FAR) > dedup.simhash_max_distance
+    assert dedup.is_duplicate(SOURCE, TARGET, dedup.create_fingerprint(make_comment(2, 42, FAR))) is False
+
+def test_near_duplicate_from_other_user_is_not_caught(dedup):
+    assert dedup.is_duplicate(SOURCE, TARGET, dedup.create_fingerprint(make_comment(2, 43, NEAR))) is False
+
+def test_normal_mode_ignores_near_duplicates(dedup):
+    dedup.config = {"comment_dedup_mode": "normal"}
+    assert dedup.is_duplicate(SOURCE, TARGET, dedup.create_fingerprint(make_comment(2, 42, NEAR))) is False
+
+def test_band_index_threshold(dedup):
+    value = simhash64(COMMENT)
+    # 翻转的位分布在不同分段中：距离7时仍至少有一段完全相同
+    within = value ^ sum(1 << (band * 8) for band in range(7))
+    beyond = value ^ sum(1 << (band * 8) for band in range(8))
+    assert dedup._find_similar_comment(KEY, 42, value) is True
+    assert dedup._find_similar_comment(KEY, 42, within) is True
+    assert dedup._find_similar_comment(KEY, 42, beyond) is False
+    assert dedup._find_similar_comment(KEY, 43, value) is False
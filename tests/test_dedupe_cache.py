@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""实时监听去重缓存"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import dedupe_cache
+from dedupe_cache import RealtimeDedupeCache
+
+PAIR = (-1001, -2001)
+OTHER_PAIR = (-1001, -2002)
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(dedupe_cache, "time", SimpleNamespace(time=lambda: fake.now))
+    return fake
+
+def test_hits_are_per_pair(clock):
+    cache = RealtimeDedupeCache()
+    assert cache.check_and_add(PAIR, ("text", "abc")) is False
+    assert cache.check_and_add(PAIR, ("text", "abc")) is True
+    assert cache.check_and_add(OTHER_PAIR, ("text", "abc")) is False
+    assert cache.get_stats() == {"hits": 1, "misses": 2, "expired": 0, "evicted": 0, "pairs": 2, "cached": 2}
+
+def test_entries_expire_after_ttl(clock):
+    cache = RealtimeDedupeCache(ttl_seconds=60)
+    cache.check_and_add(PAIR, ("a",))
+    clock.now += 30
+    cache.check_and_add(PAIR, ("b",))
+    clock.now += 31
+    # a 已过期，b 仍在保留时间内
+    assert cache.check_and_add(PAIR, ("a",)) is False
+    assert cache.check_and_add(PAIR, ("b",)) is True
+    assert cache.stats["expired"] == 1
+    clock.now += 61
+    cache.check_and_add(OTHER_PAIR, ("c",))
+    cache.check_and_add(PAIR, ("d",))
+    assert list(cache.pairs[PAIR]) == [("d",)]
+
+def test_hit_refreshes_ttl(clock):
+    cache = RealtimeDedupeCache(ttl_seconds=60)
+    cache.check_and_add(PAIR, ("a",))
+    clock.now += 50
+    assert cache.check_and_add(PAIR, ("a",)) is True
+    clock.now += 50
+    assert cache.check_and_add(PAIR, ("a",)) is True
+    assert cache.stats["expired"] == 0
+
+def test_lru_eviction_keeps_recently_seen(clock):
+    cache = RealtimeDedupeCache(max_per_pair=3)
+    for key in ("a", "b", "c"):
+        clock.now += 1
+        cache.check_and_add(PAIR, (key,))
+    clock.now += 1
+    assert cache.check_and_add(PAIR, ("a",)) is True  # a 移到最近使用的一端
+    clock.now += 1
+    cache.check_and_add(PAIR, ("d",))
+    assert list(cache.pairs[PAIR]) == [("c",), ("a",), ("d",)]
+    assert cache.stats["evicted"] == 1
+    assert cache.check_and_add(OTHER_PAIR, ("b",)) is False
+    assert len(cache) == 4
+
+def test_persistence_survives_reload(clock, tmp_path):
+    path = str(tmp_path / "realtime_dedupe.json")
+    cache = RealtimeDedupeCache(ttl_seconds=100, persist_path=path)
+    cache.check_and_add(PAIR, ("old",))
+    clock.now += 60
+    cache.check_and_add(PAIR, ("new",))
+    cache.check_and_add(OTHER_PAIR, ("photo", 42))
+    cache.save()
+    
+    clock.now += 50
+    reloaded = RealtimeDedupeCache(ttl_seconds=100, persist_path=path)
+    # 重启后仍按原时间计算过期：old 已过期，其余保留
+    assert dict(reloaded.pairs[PAIR]) == {("new",): 1060.0}
+    assert reloaded.check_and_add(OTHER_PAIR, ("photo", 42)) is True
+    assert reloaded.check_and_add(PAIR, ("old",)) is False
+
+def test_compaction_keeps_live_entries(clock, tmp_path):
+    path = str(tmp_path / "realtime_dedupe.json")
+    cache = RealtimeDedupeCache(ttl_seconds=100, persist_path=path)
+    cache.journal.compact_threshold = 3
+    for key in ("a", "b", "c", "d"):
+        cache.check_and_add(PAIR, (key,))
+    cache.save()
+    cache.journal.wait_for_compaction()
+    cache.check_and_add(PAIR, ("e",))
+    cache.save()
+    
+    reloaded = RealtimeDedupeCache(ttl_seconds=100, persist_path=path)
+    assert list(reloaded.pairs[PAIR]) == [("a",), ("b",), ("c",), ("d",), ("e",)]
+    assert reloaded.journal.journal_records == 1
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""MessageDeduplicator 热点缓存：按加入顺序淘汰和缓存统计"""
+
+import time
+
+import pytest
+
+pytest.importorskip("pyrogram")
+
+from new_cloning_engine import FINGERPRINT_VERSION, MEDIA_TYPE_CODES, MessageDeduplicator, MessageFingerprint
+
+SOURCE, TARGET = -1001, -2001
+KEY = f"{SOURCE}_{TARGET}"
+
+def make_fingerprint(content_hash, timestamp=None, comment_user_id=None):
+    return MessageFingerprint(
+        message_id=content_hash, chat_id=SOURCE, content_hash=content_hash, media_type=MEDIA_TYPE_CODES["text"],
+        file_key=None, timestamp=time.time() if timestamp is None else timestamp,
+        is_comment=comment_user_id is not None, comment_user_id=comment_user_id, version=FINGERPRINT_VERSION
+    )
+
+@pytest.fixture
+def dedup(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return MessageDeduplicator(max_cache_size=3)
+
+def cached(dedup):
+    return [fp.content_hash for fp in dedup.fingerprints[KEY]]
+
+def test_readding_moves_fingerprint_to_newest_end(dedup):
+    for content_hash in (1, 2, 3):
+        dedup.add_fingerprint(SOURCE, TARGET, make_fingerprint(content_hash))
+    dedup.add_fingerprint(SOURCE, TARGET, make_fingerprint(1))
+    assert cached(dedup) == [2, 3, 1]
+    
+    dedup.add_fingerprint(SOURCE, TARGET, make_fingerprint(4))
+    assert cached(dedup) == [3, 1, 4]
+    assert dedup.cache_stats["evictions"] == 1
+    assert dedup.cache_stats["expired"] == 0
+
+def test_expired_fingerprints_are_counted_separately(dedup):
+    now = time.time()
+    dedup.add_fingerprint(SOURCE, TARGET, make_fingerprint(1, now - 100))
+    dedup.add_fingerprint(SOURCE, TARGET, make_fingerprint(2, now - 50))
+    dedup.add_fingerprint(SOURCE, TARGET, make_fingerprint(3, now))
+    dedup._evict(KEY, now + dedup.max_age_seconds - 75)
+    assert cached(dedup) == [2, 3]
+    assert dedup.cache_stats["expired"] == 1
+    
+    dedup.add_fingerprint(SOURCE, TARGET, make_fingerprint(4))
+    dedup.add_fingerprint(SOURCE, TARGET, make_fingerprint(5))
+    assert cached(dedup) == [3, 4, 5]
+    assert dedup.cache_stats["evictions"] == 1
+    assert dedup.cache_stats["expired"] == 1
+
+def test_evicted_comments_leave_the_comment_index(dedup):
+    dedup.add_fingerprint(SOURCE, TARGET, make_fingerprint(1, comment_user_id=42))
+    assert dedup.is_duplicate(SOURCE, TARGET, make_fingerprint(1, comment_user_id=42)) is True
+    for content_hash in (2, 3, 4):
+        dedup.add_fingerprint(SOURCE, TARGET, make_fingerprint(content_hash))
+    assert dedup.is_duplicate(SOURCE, TARGET, make_fingerprint(1, comment_user_id=42)) is False
+
+def test_cache_stats_report_hits_and_misses(dedup):
+    dedup.add_fingerprint(SOURCE, TARGET, make_fingerprint(1))
+    assert dedup.is_duplicate(SOURCE, TARGET, make_fingerprint(1)) is True
+    assert dedup.is_duplicate(SOURCE, TARGET, make_fingerprint(2)) is False
+    assert dedup.is_duplicate(-1002, TARGET, make_fingerprint(1)) is False
+    stats = dedup.get_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 2, 0.333)
+    assert (stats["cached"], stats["pairs"]) == (1, 2)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""指纹格式迁移：旧版本的JSON指纹文件和SQLite记录"""
+
+import json
+import os
+import sqlite3
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pyrogram")
+
+from fingerprint_store import SQLiteFingerprintStore
+from new_cloning_engine import MessageDeduplicator
+
+SOURCE, TARGET = -1001, -2001
+KEY = f"{SOURCE}_{TARGET}"
+
+def make_message(message_id, text):
+    return SimpleNamespace(
+        id=message_id, chat=SimpleNamespace(id=SOURCE), from_user=None,
+        text=text, caption=None, forward_from=None, reply_to_message=None,
+        photo=None, video=None, document=None, animation=None, audio=None, voice=None, sticker=None
+    )
+
+def v1_record(message_id):
+    """第1版记录：MD5前缀哈希（包含消息ID），没有版本字段"""
+    return {"message_id": message_id, "chat_id": SOURCE, "content_hash": "9e107d9d372bb682",
+            "media_type": "text", "file_id": None, "timestamp": time.time(),
+            "is_comment": False, "comment_user_id": None}
+
+def v2_record(dedup, message):
+    """第2版记录：与第3版哈希内容相同，以十六进制字符串、媒体类型名保存"""
+    fp = dedup.create_fingerprint(message)
+    return {"message_id": fp.message_id, "chat_id": fp.chat_id,
+            "content_hash": fp.content_hash.to_bytes(8, "big", signed=True).hex(),
+            "media_type": "text", "file_id": None, "timestamp": fp.timestamp,
+            "is_comment": False, "comment_user_id": None, "simhash": None, "version": 2}
+
+def test_json_file_is_converted_to_binary_journal(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    record = v2_record(MessageDeduplicator(), make_message(1, "第2版的消息"))
+    with open("message_fingerprints.json", "w", encoding="utf-8") as f:
+        json.dump({KEY: [v1_record(2), record]}, f)
+    
+    dedup = MessageDeduplicator()
+    assert len(dedup.fingerprints[KEY]) == 1
+    assert os.path.exists("message_fingerprints.bin")
+    assert not os.path.exists("message_fingerprints.json")
+    # 转换后的指纹仍能识别另一条消息中的相同内容
+    assert dedup.is_duplicate(SOURCE, TARGET, dedup.create_fingerprint(make_message(10, "第2版的消息"))) is True
+    assert dedup.is_duplicate(SOURCE, TARGET, dedup.create_fingerprint(make_message(11, "其他消息"))) is False
+    
+    # 从二进制快照重新加载，第1版记录已丢弃
+    reloaded = MessageDeduplicator()
+    assert len(reloaded.fingerprints[KEY]) == 1
+
+def test_sqlite_store_upgrades_v2_and_drops_v1(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    record = v2_record(MessageDeduplicator(), make_message(1, "第2版的消息"))
+    db_path = str(tmp_path / "fingerprints.db")
+    # 早期的数据库没有版本列
+    conn = sqlite3.connect(db_path)
+    conn.execute("""
+        CREATE TABLE fingerprints (
+            pair_key TEXT NOT NULL, content_hash TEXT NOT NULL, media_type TEXT NOT NULL,
+            file_id TEXT NOT NULL DEFAULT '', is_comment INTEGER NOT NULL DEFAULT 0,
+            comment_user_id INTEGER NOT NULL DEFAULT 0, message_id INTEGER, chat_id INTEGER,
+            timestamp REAL NOT NULL
+        )
+    """)
+    conn.execute("INSERT INTO fingerprints (pair_key, content_hash, media_type, message_id, chat_id, timestamp) "
+                 "VALUES (?, '9e107d9d372bb682', 'text', 2, ?, ?)", (KEY, SOURCE, time.time()))
+    conn.commit()
+    conn.close()
+    
+    store = SQLiteFingerprintStore(db_path)
+    store.conn.execute(
+        "INSERT INTO fingerprints (pair_key, content_hash, media_type, message_id, chat_id, timestamp, version) "
+        "VALUES (?, ?, ?, ?, ?, ?, 2)",
+        (KEY, record["content_hash"], record["media_type"], 1, SOURCE, record["timestamp"])
+    )
+    store.conn.commit()
+    assert store.count() == 2
+    
+    dedup = MessageDeduplicator(store=store)
+    # upgrade 把第2版记录原地转换为第3版，drop_outdated 删除第1版记录
+    assert store.conn.execute("SELECT version, message_id FROM fingerprints").fetchall() == [(3, 1)]
+    assert dedup.is_duplicate(SOURCE, TARGET, dedup.create_fingerprint(make_message(10, "第2版的消息"))) is True
+    assert dedup.is_duplicate(SOURCE, TARGET, dedup.create_fingerprint(make_message(11, "其他消息"))) is False
+    store.close()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""SQLite 指纹存储和搬运引擎初始化"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from fingerprint_store import SQLiteFingerprintStore
+
+def make_fingerprint(content_hash, media_type=1, file_key=None, is_comment=False, comment_user_id=None,
+                     timestamp=None):
+    return SimpleNamespace(content_hash=content_hash, media_type=media_type, file_key=file_key,
+                           is_comment=is_comment, comment_user_id=comment_user_id, message_id=1, chat_id=-100,
+                           timestamp=time.time() if timestamp is None else timestamp, version=3)
+
+def test_uncommitted_fingerprints_are_visible_before_writer_commits(tmp_path):
+    store = SQLiteFingerprintStore(str(tmp_path / "fp.db"))
+    try:
+        store.add("a_b", make_fingerprint(1, file_key="f1"))
+        store.add("a_b", make_fingerprint(2, is_comment=True, comment_user_id=7))
+        assert store.pending_writes == 2
+        assert store.contains("a_b", make_fingerprint(1, file_key="f1"))
+        assert store.contains_comment("a_b", make_fingerprint(2, is_comment=True, comment_user_id=7))
+        assert not store.contains("a_b", make_fingerprint(1, file_key="f2"))
+        assert store.count() == 0
+        
+        assert store.flush() == 2
+        store.wait()
+        assert store.pending_writes == 0
+        assert store.count() == 2
+        assert not store._uncommitted
+        assert store.contains("a_b", make_fingerprint(1, file_key="f1"))
+        assert not store.contains("x_y", make_fingerprint(1, file_key="f1"))
+    finally:
+        store.close()
+
+def test_flush_runs_on_writer_thread(tmp_path, monkeypatch):
+    store = SQLiteFingerprintStore(str(tmp_path / "fp.db"))
+    threads = []
+    original = store._write
+    
+    def recording_write(rows, prune):
+        import threading
+        threads.append(threading.current_thread().name)
+        original(rows, prune)
+    monkeypatch.setattr(store, "_write", recording_write)
+    try:
+        store.add("a_b", make_fingerprint(1))
+        store.flush()
+        store.wait()
+        assert threads and threads[0].startswith("fingerprint-writer")
+    finally:
+        store.close()
+
+def test_prune_by_age_and_per_pair_limit(tmp_path):
+    store = SQLiteFingerprintStore(str(tmp_path / "fp.db"), max_age_days=1, max_per_pair=2)
+    try:
+        now = time.time()
+        store.add("a_b", make_fingerprint(1, timestamp=now - 3 * 86400))
+        for content_hash in (2, 3, 4):
+            store.add("a_b", make_fingerprint(content_hash, timestamp=now + content_hash))
+        # 第一次 flush 同时执行保留策略
+        store.flush()
+        store.wait()
+        assert store.count("a_b") == 2
+        assert store.contains("a_b", make_fingerprint(4))
+        assert not store.contains("a_b", make_fingerprint(2))
+        
+        store.add("a_b", make_fingerprint(5, timestamp=now + 5))
+        store.flush()
+        store.wait()
+        assert store.prune() == 1
+        assert store.count("a_b") == 2
+    finally:
+        store.close()
+
+def test_close_commits_pending_writes(tmp_path):
+    path = str(tmp_path / "fp.db")
+    store = SQLiteFingerprintStore(path)
+    store.add("a_b", make_fingerprint(1))
+    store.close()
+    reopened = SQLiteFingerprintStore(path)
+    try:
+        assert reopened.count() == 1
+    finally:
+        reopened.close()
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_get_robust_cloning_engine_builds_engine(csmain, tmp_path, monkeypatch, backend):
+    monkeypatch.setattr(csmain, "FINGERPRINT_BACKEND", backend)
+    monkeypatch.setattr(csmain, "FINGERPRINT_DB_PATH", str(tmp_path / "fingerprints.db"))
+    
+    async def build():
+        engine = csmain.get_robust_cloning_engine(client=object())
+        assert isinstance(engine, csmain.RobustCloningEngine)
+        assert csmain.get_robust_cloning_engine(client=object()) is engine
+        engine._retry_drain_task.cancel()
+        return engine
+    
+    engine = asyncio.run(build())
+    store = engine.deduplicator.store
+    if backend == "sqlite":
+        assert store is not None and store.db_path.endswith("fingerprints.db")
+        store.close()
+    else:
+        assert store is None
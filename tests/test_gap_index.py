@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""空区间索引和批次来源"""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pyrogram")
+
+from new_cloning_engine import AdaptiveBatchController, GapIndex, RobustCloningEngine
+
+class FakeClient:
+    """按ID返回消息：content 中的ID存在，其余为已删除（empty）"""
+    
+    def __init__(self, content, chat_id=-100123):
+        self.content = set(content)
+        self.chat_id = chat_id
+        self.requested = []
+    
+    async def get_messages(self, chat_id, message_ids):
+        self.requested.extend(message_ids)
+        return [SimpleNamespace(id=i, empty=i not in self.content) for i in message_ids]
+    
+    async def get_chat(self, chat_id):
+        return SimpleNamespace(id=self.chat_id)
+
+@pytest.fixture
+def engine_factory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    
+    def build(client):
+        engine = RobustCloningEngine(client=client)
+        engine.gap_index = GapIndex(str(tmp_path / "gap_index.json"))
+        return engine
+    return build
+
+async def collect(engine, source, start_id, end_id, gap_skip, gap_channel=None):
+    """返回 (产出的批次范围, 产出的有效消息ID)"""
+    controller = AdaptiveBatchController((50, 200), (0, 0))
+    batches, content_ids = [], []
+    async for batch_start, batch_end, messages, error in engine._iter_message_batches(
+            source, start_id, end_id, controller, gap_skip=gap_skip, gap_channel=gap_channel):
+        assert error is None
+        batches.append((batch_start, batch_end))
+        content_ids.extend(m.id for m in messages if not m.empty)
+    return batches, content_ids
+
+def test_sparse_deletions_are_never_skipped(engine_factory):
+    # 大段删除中零星保留的消息（间距大于原探测窗口）都必须被拉取到
+    content = [1, 2, 3, 1500, 2900, 4400, 6000]
+    client = FakeClient(content)
+    engine = engine_factory(client)
+    batches, content_ids = asyncio.run(collect(engine, "-100123", 1, 6000, gap_skip=True, gap_channel="-100123"))
+    assert content_ids == content
+    # 批次连续覆盖整个范围
+    assert batches[0][0] == 1 and batches[-1][1] == 6000
+    assert all(nxt[0] == prev[1] + 1 for prev, nxt in zip(batches, batches[1:]))
+    assert set(client.requested) == set(range(1, 6001))
+    # 记录的空区间都是实际拉取过且为空的ID
+    for start, end in engine.gap_index.ranges["-100123"]:
+        assert not any(start <= i <= end for i in content)
+
+def test_rerun_skips_only_recorded_gaps(engine_factory):
+    content = [1, 1500, 3000]
+    engine = engine_factory(FakeClient(content))
+    _, content_ids = asyncio.run(collect(engine, "-100123", 1, 3000, gap_skip=True, gap_channel="-100123"))
+    engine.gap_index.save()
+    
+    client = FakeClient(content)
+    rerun = engine_factory(client)
+    _, content_ids = asyncio.run(collect(rerun, "-100123", 1, 3000, gap_skip=True, gap_channel="-100123"))
+    assert content_ids == content
+    assert len(client.requested) < 3000
+
+def test_gaps_are_recorded_with_skipping_disabled(engine_factory):
+    # 关闭跳过时仍然拉取全部ID，但确认为空的区间照常记录，之后的运行可以直接跳过
+    client = FakeClient([1, 2000])
+    engine = engine_factory(client)
+    _, content_ids = asyncio.run(collect(engine, "-100123", 1, 2000, gap_skip=False, gap_channel="-100123"))
+    assert content_ids == [1, 2000]
+    assert set(client.requested) == set(range(1, 2001))
+    assert engine.gap_index.ranges == {"-100123": [[2, 1999]]}
+    
+    rerun_client = FakeClient([1, 2000])
+    engine.client = rerun_client
+    _, content_ids = asyncio.run(collect(engine, "-100123", 1, 2000, gap_skip=True, gap_channel="-100123"))
+    assert content_ids == [1, 2000]
+    # 只有第一批（从 1 开始）会拉取到空区间的开头
+    assert len(rerun_client.requested) < 200
+
+def test_gap_channel_key_resolves_usernames(engine_factory):
+    engine = engine_factory(FakeClient([], chat_id=-100777))
+    assert asyncio.run(engine._gap_channel_key("@SomeChannel")) == "-100777"
+    assert asyncio.run(engine._gap_channel_key(-100555)) == "-100555"
+
+def test_channel_key_normalization():
+    assert GapIndex.channel_key(-100123) == GapIndex.channel_key(" -100123") == "-100123"
+    assert GapIndex.channel_key("@Foo") == GapIndex.channel_key("foo") == "foo"
+
+def test_add_range_merges_and_skip_to(tmp_path):
+    index = GapIndex(str(tmp_path / "gaps.json"))
+    index.add_range(-100123, 10, 20)
+    index.add_range("-100123", 21, 30)
+    index.add_range("-100123", 50, 60)
+    assert index.ranges["-100123"] == [[10, 30], [50, 60]]
+    assert index.skip_to("-100123", 15) == 31
+    assert index.skip_to("-100123", 40) == 40
+
+def test_save_is_atomic_and_versioned(tmp_path):
+    path = tmp_path / "gaps.json"
+    index = GapIndex(str(path))
+    index.add_range("@Foo", 1, 500)
+    index.save()
+    data = json.loads(path.read_text(encoding="utf-8"))
+    assert data["channels"] == {"foo": [[1, 500]]}
+    assert not list(tmp_path.glob("*.tmp"))
+    assert GapIndex(str(path)).skip_to("foo", 1) == 501
+
+def test_legacy_index_is_discarded(tmp_path):
+    path = tmp_path / "gaps.json"
+    path.write_text(json.dumps({"-100123": [[1, 5000]]}), encoding="utf-8")
+    index = GapIndex(str(path))
+    assert index.ranges == {}
+    assert index.skip_to("-100123", 1) == 1
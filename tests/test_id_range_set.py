@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""按区间存储的消息ID集合"""
+
+import random
+
+import pytest
+
+pytest.importorskip("pyrogram")
+
+from new_cloning_engine import IdRangeSet
+
+def assert_matches(id_set, expected):
+    assert len(id_set) == len(expected)
+    assert list(id_set) == sorted(expected)
+    # 区间有序、不相交且不相邻
+    for (start, end), (next_start, _) in zip(id_set.to_ranges(), id_set.to_ranges()[1:]):
+        assert start <= end < next_start - 1
+
+def test_sequential_appends_collapse_into_one_range():
+    id_set = IdRangeSet()
+    for message_id in range(1, 10001):
+        id_set.add(message_id)
+    assert id_set.to_ranges() == [[1, 10000]]
+    assert len(id_set) == 10000
+    assert 5000 in id_set and 0 not in id_set and 10001 not in id_set
+
+def test_out_of_order_inserts_merge_neighbours():
+    id_set = IdRangeSet([1, 2, 3, 7, 8, 9])
+    assert id_set.to_ranges() == [[1, 3], [7, 9]]
+    id_set.add(5)
+    assert id_set.to_ranges() == [[1, 3], [5, 5], [7, 9]]
+    id_set.add(4)
+    id_set.add(6)
+    assert id_set.to_ranges() == [[1, 9]]
+    id_set.add(4)
+    assert len(id_set) == 9
+
+def test_random_operations_match_builtin_set():
+    rng = random.Random(1234)
+    id_set, expected = IdRangeSet(), set()
+    for _ in range(3000):
+        message_id = rng.randint(0, 500)
+        id_set.add(message_id)
+        expected.add(message_id)
+    assert_matches(id_set, expected)
+    probes = [rng.randint(-10, 510) for _ in range(1000)]
+    assert all((probe in id_set) == (probe in expected) for probe in probes)
+    assert list(id_set.contains_many(probes)) == [int(probe in expected) for probe in probes]
+
+def test_contains_many_keeps_input_order():
+    id_set = IdRangeSet.from_ranges([[10, 20], [30, 40]])
+    assert list(id_set.contains_many([35, 5, 20, 25, 41, 10, 30])) == [1, 0, 1, 0, 0, 1, 1]
+    assert list(IdRangeSet().contains_many([1, 2])) == [0, 0]
+
+def test_from_ranges_merges_overlaps_and_round_trips():
+    id_set = IdRangeSet.from_ranges([[5, 10], [1, 3], [4, 6], [20, 25], [22, 23]])
+    assert id_set.to_ranges() == [[1, 10], [20, 25]]
+    assert len(id_set) == 16
+    assert_matches(IdRangeSet.from_ranges(id_set.to_ranges()), set(id_set))
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""快照 + 追加写日志"""
+
+import json
+import os
+
+from journal import AppendJournal
+
+def load(journal):
+    """按快照 + 重放还原状态（记录为 {"k": 键, "v": 值}，v 为 None 表示删除）"""
+    state = dict(journal.load_snapshot() or {})
+    for record in journal.replay():
+        if record["v"] is None:
+            state.pop(record["k"], None)
+        else:
+            state[record["k"]] = record["v"]
+    return state
+
+def test_flush_and_replay_in_order(tmp_path):
+    journal = AppendJournal(str(tmp_path / "state.json"))
+    journal.append({"k": "a", "v": 1})
+    journal.append({"k": "b", "v": 2})
+    assert not os.path.exists(journal.journal_path)  # 未 flush 前只在内存中
+    assert journal.flush() == 2
+    journal.append({"k": "a", "v": None})
+    journal.flush()
+    assert journal.flush() == 0
+    
+    reopened = AppendJournal(journal.snapshot_path)
+    assert load(reopened) == {"b": 2}
+    assert reopened.journal_records == 3
+
+def test_torn_last_line_is_truncated(tmp_path):
+    journal = AppendJournal(str(tmp_path / "state.json"))
+    journal.append({"k": "a", "v": 1})
+    journal.flush()
+    with open(journal.journal_path, "a", encoding="utf-8") as f:
+        f.write('{"k": "b", "v"')  # 模拟写到一半时崩溃
+    
+    reopened = AppendJournal(journal.snapshot_path)
+    assert load(reopened) == {"a": 1}
+    # 截断后追加的新记录不会与残缺行拼在一起
+    reopened.append({"k": "c", "v": 3})
+    reopened.flush()
+    with open(journal.journal_path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert [json.loads(line) for line in lines] == [{"k": "a", "v": 1}, {"k": "c", "v": 3}]
+    assert load(AppendJournal(journal.snapshot_path)) == {"a": 1, "c": 3}
+
+def test_compaction_writes_snapshot_and_rotates_journal(tmp_path):
+    journal = AppendJournal(str(tmp_path / "state.json"), compact_threshold=3)
+    state = {}
+    for i in range(3):
+        state[f"k{i}"] = i
+        journal.append({"k": f"k{i}", "v": i})
+    journal.flush()
+    assert journal.needs_compaction()
+    
+    journal.compact(lambda: dict(state))
+    journal.wait_for_compaction()
+    assert journal.journal_records == 0
+    assert not journal.needs_compaction()
+    assert not os.path.exists(journal.journal_path)
+    assert not os.path.exists(journal.compacting_path)
+    with open(journal.snapshot_path, encoding="utf-8") as f:
+        assert json.load(f) == state
+    
+    # 压缩之后的记录仍叠加在快照之上
+    journal.append({"k": "k0", "v": None})
+    journal.append({"k": "k3", "v": 3})
+    journal.flush()
+    assert load(AppendJournal(journal.snapshot_path)) == {"k1": 1, "k2": 2, "k3": 3}
+
+def test_interrupted_compaction_replays_old_journal(tmp_path):
+    journal = AppendJournal(str(tmp_path / "state.json"))
+    journal.append({"k": "a", "v": 1})
+    journal.flush()
+    # 模拟压缩时旧日志已改名但快照还没写入就崩溃
+    os.replace(journal.journal_path, journal.compacting_path)
+    journal.append({"k": "b", "v": 2})
+    journal.flush()
+    
+    reopened = AppendJournal(journal.snapshot_path)
+    assert load(reopened) == {"a": 1, "b": 2}
+    reopened.compact(lambda: {"a": 1, "b": 2}, background=False)
+    assert not os.path.exists(reopened.compacting_path)
+    assert load(AppendJournal(journal.snapshot_path)) == {"a": 1, "b": 2}
+
+def test_binary_snapshot(tmp_path):
+    journal = AppendJournal(str(tmp_path / "state.bin"), binary=True)
+    assert journal.load_snapshot() is None
+    journal.compact(lambda: b"\x00\x01\x02", background=False)
+    assert AppendJournal(journal.snapshot_path, binary=True).load_snapshot() == b"\x00\x01\x02"
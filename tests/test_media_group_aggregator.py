@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""媒体组聚合器"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from media_group_aggregator import ChannelArrivalStats, MediaGroupAggregator
+
+CHAT_ID = -1001
+
+def make_message(message_id, media_group_id="album", chat_id=CHAT_ID):
+    return SimpleNamespace(id=message_id, chat=SimpleNamespace(id=chat_id), media_group_id=media_group_id)
+
+def make_aggregator(**kwargs):
+    flushed = []
+    
+    async def on_flush(messages):
+        flushed.append([m.id for m in messages])
+    
+    options = {"quiet_seconds": 0.05, "min_quiet_seconds": 0.01, "max_quiet_seconds": 2.0}
+    options.update(kwargs)
+    return MediaGroupAggregator(on_flush, **options), flushed
+
+def test_flush_after_quiet_window():
+    async def run():
+        aggregator, flushed = make_aggregator()
+        assert aggregator.add(make_message(12)) is True
+        assert aggregator.add(make_message(10)) is False
+        assert aggregator.add(make_message(11)) is False
+        assert aggregator.add(make_message(20, media_group_id="other")) is True
+        await asyncio.sleep(0)
+        assert flushed == []
+        assert aggregator.get_stats()["pending_groups"] == 2
+        
+        await asyncio.sleep(0.2)
+        assert sorted(flushed) == [[10, 11, 12], [20]]
+        assert aggregator.stats["flushed_quiet"] == 2
+        assert aggregator.get_stats()["pending_groups"] == 0
+    
+    asyncio.run(run())
+
+def test_full_album_flushes_without_waiting():
+    async def run():
+        aggregator, flushed = make_aggregator(quiet_seconds=5.0)
+        for message_id in range(10, 0, -1):
+            aggregator.add(make_message(message_id))
+        await asyncio.sleep(0)
+        assert flushed == [list(range(1, 11))]
+        assert aggregator.stats["flushed_full"] == 1
+        assert aggregator.pending == {}
+    
+    asyncio.run(run())
+
+def test_late_item_widens_channel_quiet_window():
+    async def run():
+        aggregator, flushed = make_aggregator()
+        aggregator.add(make_message(1))
+        aggregator.add(make_message(2))
+        # 相册内消息几乎同时到达，安静期缩到下限
+        assert aggregator.quiet_window(CHAT_ID) == 0.01
+        await asyncio.sleep(0.3)
+        assert flushed == [[1, 2]]
+        
+        # 迟到的消息另起一组，并使该频道的安静期变长
+        assert aggregator.add(make_message(3)) is True
+        widened = aggregator.quiet_window(CHAT_ID)
+        assert widened > 0.25
+        assert aggregator.quiet_window(-1002) == 0.05  # 其他频道不受影响
+        await asyncio.sleep(widened + 0.2)
+        assert flushed == [[1, 2], [3]]
+        
+        stats = aggregator.get_channel_stats()[CHAT_ID]
+        assert stats["late_items"] == 1
+        assert stats["albums"] == 2
+        assert stats["items"] == 3
+        assert stats["gap_samples"] == 2
+        assert stats["quiet_window"] == round(widened, 3)
+        assert aggregator.stats["late_items"] == 1
+    
+    asyncio.run(run())
+
+def test_fetch_group_flushes_whole_album_once():
+    async def fetch_group(message):
+        await asyncio.sleep(0.01)
+        return [make_message(message_id) for message_id in (1, 2, 3)]
+    
+    async def run():
+        aggregator, flushed = make_aggregator(quiet_seconds=1.0, fetch_group=fetch_group)
+        aggregator.add(make_message(2))
+        await asyncio.sleep(0.1)
+        assert flushed == [[1, 2, 3]]
+        # 已随整组发出的消息再到达时直接丢弃
+        assert aggregator.add(make_message(1)) is False
+        assert aggregator.add(make_message(3)) is False
+        assert aggregator.stats["already_sent"] == 2
+        assert aggregator.stats["flushed_fetched"] == 1
+        assert aggregator.pending == {}
+    
+    asyncio.run(run())
+
+def test_arrival_stats_quiet_window():
+    channel = ChannelArrivalStats()
+    assert channel.quiet_window(1.0, 0.3, 5.0) == 1.0
+    channel.observe_gap(0.2)
+    assert channel.gap_mean == 0.2 and channel.gap_dev == 0.1
+    assert channel.quiet_window(1.0, 0.3, 5.0) == pytest.approx(0.6)
+    channel.observe_gap(10.0)
+    assert channel.quiet_window(1.0, 0.3, 5.0) == 5.0
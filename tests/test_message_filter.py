@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""编译后的消息过滤谓词与列式消息批次"""
+
+import itertools
+import random
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pyrogram")
+
+from message_filter import (MEDIA_ATTRIBUTES, MEDIA_KIND_NONE, MEDIA_KIND_PHOTO, MessageBatch,
+                            MessageFilter, get_message_filter, invalidate_message_filters)
+
+CHAT = SimpleNamespace(id=-1001)
+FILE_NAMES = ["report.PDF", "movie.mkv", "archive.tar.gz", "noextension", None]
+TEXTS = [None, "", "普通消息", "限时推广，快来", "AD: click here", "hello world"]
+
+def make_message(message_id, rng):
+    message = SimpleNamespace(id=message_id, chat=CHAT, text=None, caption=None, from_user=None,
+                              reply_markup=None, media_group_id=None)
+    for attr in MEDIA_ATTRIBUTES:
+        setattr(message, attr, None)
+    media = rng.choice((None, "photo", "video", "document", "audio"))
+    if media == "document":
+        message.document = SimpleNamespace(file_name=rng.choice(FILE_NAMES))
+    elif media:
+        setattr(message, media, SimpleNamespace(file_id=f"f{message_id}"))
+    if media:
+        message.caption = rng.choice(TEXTS)
+        if rng.random() < 0.4:
+            message.media_group_id = f"g{message_id // 4}"
+    else:
+        message.text = rng.choice(TEXTS)
+    if rng.random() < 0.3:
+        message.from_user = SimpleNamespace(id=7)
+    if rng.random() < 0.3:
+        message.reply_markup = SimpleNamespace(inline_keyboard=[])
+    return message
+
+CONFIGS = [
+    {},
+    {"enable_comment_forwarding": True},
+    {"enable_comment_forwarding": True, "channel_owner_only": True},
+    {"enable_comment_forwarding": True, "filter_photo": True, "filter_video": True},
+    {"enable_comment_forwarding": True, "filter_buttons": True},
+    {"enable_comment_forwarding": True, "filter_buttons": True, "filter_buttons_mode": "strip"},
+    {"enable_comment_forwarding": True, "media_only_mode": True},
+    {"enable_comment_forwarding": True, "file_filter_extensions": [".pdf", "GZ"]},
+    {"enable_comment_forwarding": True, "filter_keywords": ["推广", "ad:"]},
+    {"filter_photo": True, "filter_buttons": True, "media_only_mode": True,
+     "file_filter_extensions": ["mkv"], "filter_keywords": ["HELLO"]},
+]
+
+@pytest.mark.parametrize("config", CONFIGS)
+def test_match_batch_equals_match(config):
+    rng = random.Random(len(str(config)))
+    messages = [make_message(message_id, rng) for message_id in range(1, 201)]
+    message_filter = MessageFilter(config)
+    batch = MessageBatch(messages)
+    assert batch.apply_filter(message_filter) == [message_filter.match(message) for message in messages]
+    assert batch.filter_reasons == [message_filter.match(message) for message in messages]
+
+def test_filter_reasons_follow_check_order():
+    message_filter = MessageFilter({"filter_photo": True, "filter_keywords": ["推广"]})
+    rng = random.Random(0)
+    message = make_message(1, rng)
+    message.photo, message.document, message.video, message.audio = SimpleNamespace(), None, None, None
+    message.from_user, message.caption = SimpleNamespace(id=7), "推广"
+    assert message_filter.match(message) == "评论区过滤: 非频道主发布"
+    message.from_user = None
+    assert message_filter.match(message) == "图片过滤"
+    message.photo = None
+    assert message_filter.match(message) == "关键字过滤"
+    assert not MessageFilter({"enable_comment_forwarding": True})(message)
+
+def test_invalid_messages_are_skipped():
+    rng = random.Random(1)
+    batch = MessageBatch([None, SimpleNamespace(id=None, chat=CHAT), make_message(5, rng),
+                          SimpleNamespace(id=6, chat=None)])
+    assert batch.invalid == 3
+    assert list(batch.ids) == [5]
+
+def test_take_and_split_media_groups():
+    rng = random.Random(2)
+    messages = [make_message(message_id, rng) for message_id in range(1, 41)]
+    batch = MessageBatch(messages)
+    batch.apply_filter(MessageFilter({}))
+    
+    media_groups, standalone = batch.split_media_groups()
+    grouped = list(itertools.chain.from_iterable(media_groups.values()))
+    assert sorted(grouped + standalone) == list(range(len(batch)))
+    for media_group_id, indexes in media_groups.items():
+        assert indexes == sorted(indexes)
+        assert all(messages[i].media_group_id == media_group_id for i in indexes)
+    assert all(messages[i].media_group_id is None for i in standalone)
+    
+    indexes = [7, 3, 20]
+    subset = batch.take(indexes)
+    assert subset.messages == [messages[i] for i in indexes]
+    assert list(subset.ids) == [messages[i].id for i in indexes]
+    assert subset.filter_reasons == [batch.filter_reasons[i] for i in indexes]
+    # 子批次的列与重新构建的批次一致
+    rebuilt = MessageBatch(subset.messages)
+    for column in ("media_kinds", "has_from_user", "has_buttons", "text_lengths", "media_group_ids", "doc_extensions"):
+        assert list(getattr(subset, column)) == list(getattr(rebuilt, column))
+
+def test_columns_extracted_once():
+    rng = random.Random(3)
+    message = make_message(1, rng)
+    for attr in MEDIA_ATTRIBUTES:
+        setattr(message, attr, None)
+    message.document = SimpleNamespace(file_name="Backup.Tar.GZ")
+    message.caption, message.text = "说明", None
+    batch = MessageBatch([message])
+    assert batch.doc_extensions == ["gz"]
+    assert list(batch.text_lengths) == [2]
+    assert batch.media_kinds[0] not in (MEDIA_KIND_NONE, MEDIA_KIND_PHOTO)
+
+def test_compiled_filter_cache():
+    invalidate_message_filters()
+    config = {"filter_photo": True}
+    assert get_message_filter(config) is get_message_filter(config)
+    assert get_message_filter(dict(config)) is not get_message_filter(config)
+    first = get_message_filter(config)
+    invalidate_message_filters()
+    assert get_message_filter(config) is not first
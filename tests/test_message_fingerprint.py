@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""紧凑消息指纹的二进制序列化"""
+
+import itertools
+
+import pytest
+
+pytest.importorskip("pyrogram")
+
+from new_cloning_engine import FINGERPRINT_VERSION, MEDIA_TYPE_CODES, MessageFingerprint
+
+def make_fingerprint(is_comment, file_key, comment_user_id, simhash, chat_id=-1001234567890):
+    return MessageFingerprint(
+        message_id=42, chat_id=chat_id, content_hash=-(1 << 63), media_type=MEDIA_TYPE_CODES["photo"],
+        file_key=file_key, timestamp=1700000000.25, is_comment=is_comment,
+        comment_user_id=comment_user_id, simhash=simhash, version=FINGERPRINT_VERSION
+    )
+
+@pytest.mark.parametrize("is_comment,file_key,comment_user_id,simhash", list(itertools.product(
+    (False, True), (None, 0, -7), (None, 0, 777000), (None, 0, (1 << 64) - 1)
+)))
+def test_pack_round_trip(is_comment, file_key, comment_user_id, simhash):
+    fp = make_fingerprint(is_comment, file_key, comment_user_id, simhash)
+    record = fp.pack()
+    assert len(record) == MessageFingerprint.RECORD.size
+    restored = MessageFingerprint.unpack(record)
+    for field in ("message_id", "chat_id", "content_hash", "media_type", "file_key", "timestamp",
+                  "is_comment", "comment_user_id", "simhash", "version"):
+        assert getattr(restored, field) == getattr(fp, field), field
+
+@pytest.mark.parametrize("chat_id", (-1001234567890, -42, 777000))
+def test_chat_ids_keep_their_sign(chat_id):
+    fp = make_fingerprint(False, None, None, None, chat_id=chat_id)
+    assert MessageFingerprint.unpack(fp.pack()).chat_id == chat_id
+
+def test_unpack_at_offset_and_iter_unpack():
+    fps = [make_fingerprint(i % 2 == 0, i or None, None, i * 3 or None) for i in range(4)]
+    data = b"head" + b"".join(fp.pack() for fp in fps)
+    assert MessageFingerprint.unpack(data, 4 + MessageFingerprint.RECORD.size).file_key == 1
+    restored = [MessageFingerprint.from_fields(fields)
+                for fields in MessageFingerprint.RECORD.iter_unpack(data[4:])]
+    assert [(fp.file_key, fp.simhash, fp.is_comment) for fp in restored] == \
+        [(fp.file_key, fp.simhash, fp.is_comment) for fp in fps]
+
+def test_fingerprint_has_no_instance_dict():
+    assert not hasattr(make_fingerprint(False, None, None, None), "__dict__")
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""优化监听器的媒体组路由"""
+
+import asyncio
+import importlib
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("pyrogram")
+pytest.importorskip("psutil")
+
+def make_listener(**kwargs):
+    # optimization_manager 在导入时创建后台任务，需要在事件循环中导入
+    return importlib.import_module("optimized_listener").OptimizedListener(**kwargs)
+
+def album(*ids, chat_id=-100123, media_group_id="g1"):
+    chat = SimpleNamespace(id=chat_id)
+    return [SimpleNamespace(id=i, chat=chat, media_group_id=media_group_id) for i in ids]
+
+class FakeClient:
+    def __init__(self, messages):
+        self.messages = messages
+        self.calls = 0
+    
+    async def get_media_group(self, chat_id, message_id):
+        self.calls += 1
+        return list(self.messages)
+
+def test_late_items_of_fetched_album_leave_no_routes():
+    async def run():
+        listener = make_listener(eager_fetch=True)
+        messages = album(1, 2, 3)
+        client = FakeClient(messages)
+        listener._handle_media_group(client, messages[0], [])
+        assert (-100123, "g1") in listener.media_group_routes
+        await asyncio.sleep(0.05)
+        assert client.calls == 1
+        assert listener.media_group_routes == {}
+        
+        # 整组已发出后才到达的消息被聚合器丢弃，不能留下路由
+        listener._handle_media_group(client, messages[1], [])
+        listener._handle_media_group(client, messages[2], [])
+        assert listener.media_group_routes == {}
+        assert listener.media_group_aggregator.stats["already_sent"] == 2
+    asyncio.run(run())
+
+def test_routes_recorded_once_per_group():
+    async def run():
+        listener = make_listener()
+        listener.media_group_aggregator.quiet_seconds = 0.01
+        messages = album(1, 2)
+        first_routes, later_routes = [("first",)], [("later",)]
+        listener._handle_media_group("client", messages[0], first_routes)
+        listener._handle_media_group("other", messages[1], later_routes)
+        assert listener.media_group_routes[(-100123, "g1")] == ("client", first_routes)
+    asyncio.run(run())
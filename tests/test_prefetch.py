@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""预取流水线：预取阶段失败时发送阶段不能一直等待"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("pyrogram")
+
+from new_cloning_engine import RobustCloningEngine
+
+class FetchBroken(Exception):
+    pass
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    engine = RobustCloningEngine(client=None)
+    
+    async def failing_batches(*args, **kwargs):
+        yield 1, 10, [], None
+        raise FetchBroken("get_messages exploded")
+    monkeypatch.setattr(engine, "_iter_message_batches", failing_batches)
+    return engine
+
+def test_producer_error_is_reraised_in_consumer(engine):
+    async def run():
+        return await asyncio.wait_for(
+            engine.clone_messages_robust("-1001", "-1002", 1, 100, {"prefetch_batches": 2}), timeout=5)
+    with pytest.raises(FetchBroken):
+        asyncio.run(run())
+
+def test_producer_cancellation_unblocks_consumer(engine):
+    async def run():
+        queue = asyncio.Queue(maxsize=100)
+        
+        async def endless():
+            while True:
+                await asyncio.sleep(0.01)
+                yield 1, 1, [], None
+        producer = asyncio.create_task(engine._prefetch_batches(endless(), queue))
+        await asyncio.sleep(0.05)
+        producer.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await producer
+        items = [queue.get_nowait() for _ in range(queue.qsize())]
+        return items
+    items = asyncio.run(run())
+    assert isinstance(items[-1], asyncio.CancelledError)
+    assert all(isinstance(item, tuple) for item in items[:-1])
+
+def test_prefetch_ends_with_sentinel(engine):
+    async def run():
+        queue = asyncio.Queue(maxsize=4)
+        
+        async def batches():
+            yield 1, 10, [], None
+            yield 11, 20, [], None
+        await engine._prefetch_batches(batches(), queue)
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+    assert asyncio.run(run()) == [(1, 10, [], None), (11, 20, [], None), None]
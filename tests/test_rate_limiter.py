@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""分级令牌桶限流器"""
+
+import asyncio
+
+import pytest
+
+import rate_limiter
+from rate_limiter import HierarchicalRateLimiter, TokenBucket
+
+class FakeClock:
+    """可控时钟：asyncio.sleep 直接推进时间并记录睡眠时长"""
+    
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+    
+    def monotonic(self):
+        return self.now
+    
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", fake.monotonic)
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", fake.sleep)
+    return fake
+
+def test_token_bucket_burst_then_refill(clock):
+    bucket = TokenBucket(rate=2.0, capacity=3.0)
+    assert [bucket.reserve() for _ in range(3)] == [0.0, 0.0, 0.0]
+    # 透支的令牌按补充速率计算等待时间，连续预占的等待时间依次累加
+    assert bucket.reserve() == pytest.approx(0.5)
+    assert bucket.reserve() == pytest.approx(1.0)
+    assert bucket.time_until_available() == pytest.approx(1.5)
+    
+    clock.now += 1.5
+    assert bucket.time_until_available() == pytest.approx(0.0)
+    assert not bucket.is_idle()
+    clock.now += 10
+    assert bucket.is_idle()
+    assert bucket.tokens == pytest.approx(3.0)
+
+def test_token_bucket_acquire_sleeps_for_deficit(clock):
+    bucket = TokenBucket(rate=1.0, capacity=1.0)
+    
+    async def run():
+        return [await bucket.acquire() for _ in range(3)]
+    
+    assert asyncio.run(run()) == pytest.approx([0.0, 1.0, 1.0])
+    assert clock.sleeps == pytest.approx([1.0, 1.0])
+
+def test_throttled_chat_does_not_block_other_chats(clock):
+    limiter = HierarchicalRateLimiter(global_limit=(100.0, 100.0), group_chat_limit=(1.0, 1.0),
+                                      private_chat_limit=(5.0, 5.0))
+    
+    async def run():
+        waits = [await limiter.acquire("send_message", -1001) for _ in range(3)]
+        waits.append(await limiter.acquire("send_message", -1002))
+        return waits
+    
+    # 第一个群组的配额用完后需要等待，另一个群组不受影响
+    assert asyncio.run(run()) == pytest.approx([0.0, 1.0, 1.0, 0.0])
+    assert limiter.stats["acquired"] == 4
+    assert limiter.stats["throttled"] == 2
+    assert limiter.stats["total_wait"] == pytest.approx(2.0)
+
+def test_chat_limit_by_chat_type(clock):
+    limiter = HierarchicalRateLimiter(group_chat_limit=(1.0, 2.0), private_chat_limit=(5.0, 7.0))
+    assert limiter._get_chat_bucket(12345).capacity == 7.0
+    assert limiter._get_chat_bucket(-1001).capacity == 2.0
+    assert limiter._get_chat_bucket("@channel").capacity == 2.0
+    assert limiter._get_chat_bucket("-1001") is limiter._get_chat_bucket(-1001)
+
+def test_operation_and_global_limits_apply(clock):
+    limiter = HierarchicalRateLimiter(global_limit=(1.0, 2.0), group_chat_limit=(100.0, 100.0),
+                                      operation_limits={"send_media_group": (0.5, 1.0)})
+    
+    async def run():
+        return [
+            await limiter.acquire("send_media_group", -1001),
+            await limiter.acquire("send_media_group", -1002),
+            await limiter.acquire("send_message", -1003),
+        ]
+    
+    # 第二次媒体组受操作类型限制等待 2 秒；期间全局桶已回满
+    assert asyncio.run(run()) == pytest.approx([0.0, 2.0, 0.0])
+    
+    limiter.set_operation_limit("send_media_group", 10.0, 10.0)
+    assert "send_media_group" not in limiter.operation_buckets
+    assert limiter._get_operation_bucket("send_message") is None
+
+def test_chat_wait_time_does_not_reserve(clock):
+    limiter = HierarchicalRateLimiter(group_chat_limit=(1.0, 1.0))
+    assert limiter.chat_wait_time(-1001) == 0.0
+    asyncio.run(limiter.acquire("send_message", -1001))
+    assert limiter.chat_wait_time(-1001) == pytest.approx(1.0)
+    assert limiter.chat_wait_time(-1001) == pytest.approx(1.0)
+
+def test_idle_chat_buckets_are_evicted(clock):
+    limiter = HierarchicalRateLimiter(group_chat_limit=(1.0, 1.0), max_chat_buckets=3)
+    for chat_id in (-1, -2, -3):
+        limiter._get_chat_bucket(chat_id).reserve()
+    # 桶都在透支中，不会被回收
+    limiter._get_chat_bucket(-4)
+    assert len(limiter.chat_buckets) == 4
+    
+    clock.now += 60
+    limiter._get_chat_bucket(-5)
+    assert list(limiter.chat_buckets) == ["-5"]
+
+def test_channels_use_their_own_limit(clock):
+    limiter = HierarchicalRateLimiter(global_limit=(100.0, 100.0), group_chat_limit=(20.0 / 60, 2.0),
+                                      channel_chat_limit=(2.0, 2.0))
+    limiter.note_chat_type(-1001, "channel")
+    limiter.note_chat_type(-1002, "supergroup")
+    
+    async def run():
+        channel = [await limiter.acquire("send_message", -1001) for _ in range(3)]
+        group = [await limiter.acquire("send_message", -1002) for _ in range(3)]
+        return channel, group
+    
+    channel, group = asyncio.run(run())
+    assert channel == pytest.approx([0.0, 0.0, 0.5])
+    assert group == pytest.approx([0.0, 0.0, 3.0])
+    assert limiter.get_status()["channel_chats"] == 1
+
+def test_learning_chat_type_keeps_consumed_tokens(clock):
+    limiter = HierarchicalRateLimiter(group_chat_limit=(20.0 / 60, 3.0), channel_chat_limit=(2.0, 10.0))
+    bucket = limiter._get_chat_bucket(-1001)
+    for _ in range(4):
+        bucket.reserve()
+    limiter.note_chat_type(-1001, "channel")
+    bucket = limiter._get_chat_bucket(-1001)
+    assert bucket.rate == 2.0 and bucket.capacity == 10.0
+    # 透支的 1 个令牌按频道速率补回
+    assert bucket.time_until_available() == pytest.approx(1.0)
+    # 类型没有变化或无法识别时不重建
+    limiter.note_chat_type(-1001, "channel")
+    limiter.note_chat_type(-1001, "unknown")
+    assert limiter._get_chat_bucket(-1001) is bucket
+
+def test_missing_chat_skips_chat_bucket(clock):
+    limiter = HierarchicalRateLimiter()
+    asyncio.run(limiter.acquire("edit_message", None))
+    assert limiter.chat_buckets == {}
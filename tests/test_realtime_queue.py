@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""实时监听的按目标频道有序发送队列"""
+
+import asyncio
+
+from realtime_queue import RESERVATION_TIMEOUT, OrderedTargetQueues
+
+def recorder(sent, label, delay=0.0):
+    async def run():
+        if delay:
+            await asyncio.sleep(delay)
+        sent.append(label)
+    return run
+
+async def drain(queues, timeout=2.0):
+    """等待所有目标队列发送完毕"""
+    async def idle():
+        while any(q.jobs or q.current is not None for q in queues.targets.values()):
+            await asyncio.sleep(0.005)
+    await asyncio.wait_for(idle(), timeout)
+
+def test_fifo_per_target_and_targets_independent():
+    async def run():
+        queues = OrderedTargetQueues()
+        sent = []
+        for i in range(5):
+            queues.enqueue("-1001", recorder(sent, f"a{i}", delay=0.02 if i == 0 else 0), f"a{i}")
+        queues.enqueue("-1002", recorder(sent, "b0"), "b0")
+        await asyncio.sleep(0.01)
+        # a0 还在发送时，另一个目标已经发送完成
+        assert sent == ["b0"]
+        await drain(queues)
+        return sent
+    
+    sent = asyncio.run(run())
+    assert [label for label in sent if label.startswith("a")] == ["a0", "a1", "a2", "a3", "a4"]
+
+def test_reservation_keeps_its_place():
+    async def run():
+        queues = OrderedTargetQueues()
+        sent = []
+        album = queues.reserve("-1001", "album")
+        queues.enqueue("-1001", recorder(sent, "after"), "after")
+        skipped = queues.reserve("-1001", "skipped")
+        queues.enqueue("-1001", recorder(sent, "last"), "last")
+        await asyncio.sleep(0.05)
+        assert sent == []
+        assert queues.get_stats()["-1001"]["depth"] == 4
+        
+        skipped.fill(None)
+        album.fill(recorder(sent, "album"))
+        await drain(queues)
+        return sent, queues.get_stats()["-1001"]
+    
+    sent, stats = asyncio.run(run())
+    assert sent == ["album", "after", "last"]
+    assert stats["sent"] == 3 and stats["skipped"] == 1 and stats["depth"] == 0
+
+def test_unfilled_reservation_times_out():
+    assert RESERVATION_TIMEOUT == 60
+    
+    async def run():
+        queues = OrderedTargetQueues(reservation_timeout=0.05)
+        sent = []
+        queues.reserve("-1001", "album")
+        queues.enqueue("-1001", recorder(sent, "after"), "after")
+        await asyncio.sleep(0.02)
+        assert sent == []
+        await drain(queues)
+        return sent, queues.get_stats()["-1001"]
+    
+    sent, stats = asyncio.run(run())
+    assert sent == ["after"]
+    assert stats["skipped"] == 1
+
+def test_failures_are_counted_and_do_not_stop_queue():
+    async def run():
+        queues = OrderedTargetQueues()
+        sent = []
+        
+        async def broken():
+            raise RuntimeError("CHAT_WRITE_FORBIDDEN")
+        queues.enqueue("-1001", broken, "broken")
+        queues.enqueue("-1001", recorder(sent, "ok"), "ok")
+        await drain(queues)
+        return sent, queues.get_stats()["-1001"]
+    
+    sent, stats = asyncio.run(run())
+    assert sent == ["ok"]
+    assert stats["failed"] == 1 and stats["sent"] == 1
+
+def test_lag_reports_oldest_waiting_job():
+    async def run():
+        queues = OrderedTargetQueues()
+        sent = []
+        queues.enqueue("-1001", recorder(sent, "slow", delay=0.3), "slow")
+        queues.enqueue("-1001", recorder(sent, "next"), "next")
+        await asyncio.sleep(0.2)
+        stats = queues.get_stats()["-1001"]
+        assert stats["depth"] == 2
+        assert stats["lag"] >= 0.1
+        await drain(queues)
+        return queues.get_stats()["-1001"]
+    
+    stats = asyncio.run(run())
+    assert stats["lag"] == 0.0
+    assert stats["max_lag"] >= 0.2
+
+def test_idle_worker_exits_and_restarts():
+    async def run():
+        queues = OrderedTargetQueues(idle_seconds=0.05)
+        sent = []
+        queues.enqueue("-1001", recorder(sent, "first"), "first")
+        await asyncio.sleep(0.15)
+        assert queues.targets["-1001"].worker is None
+        queues.enqueue("-1001", recorder(sent, "second"), "second")
+        await drain(queues)
+        return sent
+    
+    assert asyncio.run(run()) == ["first", "second"]
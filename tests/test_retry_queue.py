@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""持久化重试队列"""
+
+import asyncio
+import json
+
+from retry_queue import RetryQueue
+
+CONFIG = {"owner_user_id": "42", "remove_links": True}
+
+def test_add_remove_survive_reload(tmp_path):
+    path = str(tmp_path / "retry_queue.json")
+    queue = RetryQueue(path)
+    first = queue.add(-1001, [1, 2], -1002, CONFIG, wait_seconds=60)
+    second = queue.add(-1001, [3], -1002, {"owner_user_id": "7"}, wait_seconds=0)
+    queue.add(-1001, [1, 2], -1002, CONFIG, wait_seconds=120)  # 重复入队只更新
+    queue.remove(second)
+    
+    reloaded = RetryQueue(path)
+    assert list(reloaded.entries) == [first]
+    entry = reloaded.entries[first]
+    assert entry["attempts"] == 2
+    assert entry["user_id"] == "42"
+    assert reloaded.get_config(entry) == CONFIG
+    assert list(reloaded.configs) == [RetryQueue.config_hash(CONFIG)]
+
+def test_adds_are_batched_in_event_loop(tmp_path):
+    path = tmp_path / "retry_queue.json"
+    journal_path = tmp_path / "retry_queue.json.journal"
+    
+    async def burst():
+        queue = RetryQueue(str(path), flush_interval=0.05)
+        for message_id in range(200):
+            queue.add(-1001, [message_id], -1002, CONFIG, wait_seconds=30)
+        # 入队时不写文件，安静期后一次写入
+        assert not journal_path.exists()
+        await asyncio.sleep(0.1)
+        assert journal_path.exists()
+        return queue
+    asyncio.run(burst())
+    lines = journal_path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 201  # 1 条配置 + 200 条记录
+    assert len(RetryQueue(str(path)).entries) == 200
+
+def test_compaction_writes_snapshot(tmp_path):
+    path = tmp_path / "retry_queue.json"
+    queue = RetryQueue(str(path), compact_threshold=10)
+    ids = [queue.add(-1001, [i], -1002, CONFIG, wait_seconds=0) for i in range(12)]
+    queue.clear("42")
+    queue.add(-1001, [99], -1002, CONFIG, wait_seconds=0)
+    queue.journal.wait_for_compaction()
+    snapshot = json.loads(path.read_text(encoding="utf-8"))
+    assert set(snapshot) == {"entries", "configs"}
+    reloaded = RetryQueue(str(path))
+    assert [entry["message_ids"] for entry in reloaded.list_entries()] == [[99]]
+    assert not any(entry_id in reloaded.entries for entry_id in ids)
+
+def test_legacy_whole_file_format_loads(tmp_path):
+    path = tmp_path / "retry_queue.json"
+    config_hash = RetryQueue.config_hash(CONFIG)
+    entry = {"id": "a", "source": -1001, "message_ids": [5], "target": -1002, "config_hash": config_hash,
+             "user_id": "42", "attempts": 1, "retry_after": 0}
+    path.write_text(json.dumps({"entries": {"a": entry}, "configs": {config_hash: CONFIG}}), encoding="utf-8")
+    queue = RetryQueue(str(path))
+    assert queue.summary("42")["due"] == 1
+    queue.reschedule("a", 600)
+    assert RetryQueue(str(path)).summary("42")["due"] == 0
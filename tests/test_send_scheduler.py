@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""中央发送调度器"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from rate_limiter import HierarchicalRateLimiter
+from send_scheduler import PRIORITY_BULK, PRIORITY_REALTIME, SendScheduler, parse_flood_wait
+
+class FloodWait(Exception):
+    """模拟 pyrogram 的 FloodWait（按类名和 value 识别）"""
+    
+    def __init__(self, value):
+        super().__init__(f"Telegram says: [420 FLOOD_WAIT_X] - A wait of {value} seconds is required")
+        self.value = value
+
+def make_scheduler(**kwargs):
+    limiter = HierarchicalRateLimiter(global_limit=(1000.0, 1000.0), group_chat_limit=(1000.0, 1000.0))
+    return SendScheduler(rate_limiter=limiter, max_workers=2, **kwargs)
+
+def test_parse_flood_wait():
+    assert parse_flood_wait(FloodWait(17)) == 17
+    assert parse_flood_wait(Exception("FLOOD_WAIT: A wait of 5 seconds is required")) == 5
+    assert parse_flood_wait(ValueError("bad request")) is None
+
+def test_flood_wait_parks_only_that_chat():
+    flood_waits = []
+    scheduler = make_scheduler(on_flood_wait=lambda operation, wait: flood_waits.append((operation, wait)))
+    sent = []
+    
+    def sender(chat, label, fail_times=0):
+        state = {"calls": 0}
+        
+        async def send():
+            state["calls"] += 1
+            if state["calls"] <= fail_times:
+                raise FloodWait(0)
+            sent.append((chat, label))
+            return label
+        return send
+    
+    async def run():
+        parked = asyncio.ensure_future(scheduler.submit(-1001, sender(-1001, "a1", fail_times=1)))
+        await asyncio.sleep(0.05)
+        # -1001 被暂停，期间其他聊天照常发送，且 -1001 的后续请求不会越过被暂停的请求
+        status = scheduler.get_status()
+        assert list(status["parked_chats"]) == ["-1001"]
+        assert 0 < status["parked_chats"]["-1001"] <= 1
+        assert status["chat_depths"] == {"-1001": 1}
+        queued_behind = asyncio.ensure_future(scheduler.submit(-1001, sender(-1001, "a2")))
+        assert await scheduler.submit(-1002, sender(-1002, "b1")) == "b1"
+        assert sent == [(-1002, "b1")]
+        assert scheduler.get_status()["chat_depths"] == {"-1001": 2}
+        
+        assert await asyncio.wait_for(parked, 3) == "a1"
+        assert await asyncio.wait_for(queued_behind, 3) == "a2"
+    
+    asyncio.run(run())
+    assert sent == [(-1002, "b1"), (-1001, "a1"), (-1001, "a2")]
+    assert flood_waits == [("send_message", 0)]
+    status = scheduler.get_status()
+    assert status["parked_chats"] == {}
+    assert status["chat_depths"] == {}
+    assert status["flood_waits"] == 1
+    assert status["retries"] == 1
+    assert status["completed"] == 3
+
+def test_flood_wait_over_limit_is_raised():
+    scheduler = make_scheduler()
+    
+    async def send():
+        raise FloodWait(600)
+    
+    async def run():
+        with pytest.raises(FloodWait):
+            await scheduler.submit(-1001, send, max_flood_wait=60)
+    
+    asyncio.run(run())
+    assert scheduler.stats["failed"] == 1
+    assert scheduler.parked_until == {}
+
+def test_priority_order_within_chat():
+    scheduler = make_scheduler()
+    order = []
+    
+    def sender(label):
+        async def send():
+            order.append(label)
+            await asyncio.sleep(0)
+        return send
+    
+    async def run():
+        first = asyncio.ensure_future(scheduler.submit(-1001, sender("bulk1"), priority=PRIORITY_BULK))
+        await asyncio.sleep(0)  # bulk1 开始发送后再提交其余请求
+        await asyncio.gather(
+            scheduler.submit(-1001, sender("bulk2"), priority=PRIORITY_BULK),
+            scheduler.submit(-1001, sender("realtime"), priority=PRIORITY_REALTIME),
+            first,
+        )
+    
+    asyncio.run(run())
+    assert order == ["bulk1", "realtime", "bulk2"]
+
+def test_unpark_ignores_stale_timer():
+    scheduler = make_scheduler()
+    
+    async def run():
+        scheduler._ensure_started()
+        scheduler._park("-1001", 30)
+        until = scheduler.parked_until["-1001"]
+        # 更早的定时器到期时不能提前解除更长的暂停
+        scheduler._unpark("-1001", until - 20)
+        assert scheduler.parked_until == {"-1001": until}
+        scheduler._unpark("-1001", until)
+        assert scheduler.parked_until == {}
+    
+    asyncio.run(run())
+
+def test_chat_type_learned_from_send_result():
+    scheduler = make_scheduler()
+    
+    async def send():
+        return SimpleNamespace(chat=SimpleNamespace(id=-1001, type=SimpleNamespace(value="channel")))
+    
+    async def send_album():
+        return [SimpleNamespace(chat=SimpleNamespace(id=-1002, type="supergroup"))]
+    
+    async def run():
+        await scheduler.submit(-1001, send)
+        await scheduler.submit("-1002", send_album)
+    
+    asyncio.run(run())
+    assert scheduler.rate_limiter.chat_kinds == {"-1001": "channel", "-1002": "group"}
+
+def test_jobs_without_chat_are_not_serialized():
+    scheduler = make_scheduler()
+    running = []
+    
+    def sender(label):
+        async def send():
+            running.append(label)
+            await asyncio.sleep(0.05)
+            return label
+        return send
+    
+    async def run():
+        first = asyncio.ensure_future(scheduler.submit(None, sender("a"), operation="edit_message"))
+        second = asyncio.ensure_future(scheduler.submit(None, sender("b"), operation="edit_message"))
+        await asyncio.sleep(0.01)
+        # 两个请求同时在发送，且没有创建 "None" 聊天的令牌桶
+        assert running == ["a", "b"]
+        assert scheduler.get_status()["active_chats"] == 2
+        return await asyncio.gather(first, second)
+    
+    assert asyncio.run(run()) == ["a", "b"]
+    assert scheduler.rate_limiter.chat_buckets == {}
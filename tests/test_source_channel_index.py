@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""实时监听的源频道索引"""
+
+import pytest
+
+def linear_scan(user_configs, chat_id):
+    """索引之前的查找方式：遍历所有用户的频道组"""
+    matched = []
+    for uid, cfg in user_configs.items():
+        if not cfg.get("realtime_listen"):
+            continue
+        for pair in cfg.get("channel_pairs", []):
+            if not pair.get("enabled", True) or not pair.get("monitor_enabled", False):
+                continue
+            source_channel = str(pair.get("source"))
+            chat_id_str = str(chat_id)
+            if source_channel == chat_id_str or source_channel.lstrip('@') == chat_id_str.lstrip('@'):
+                matched.append((int(uid), id(pair)))
+    return matched
+
+def pair(source, target, **options):
+    return {"source": source, "target": target, "enabled": True, "monitor_enabled": True, **options}
+
+@pytest.fixture
+def index(csmain, monkeypatch):
+    configs = {
+        "1": {"realtime_listen": True, "channel_pairs": [
+            pair("-1001", "-2001"), pair("@news", "-2002"),
+            pair("-1002", "-2003", enabled=False), pair("-1003", "-2004", monitor_enabled=False),
+        ]},
+        "2": {"realtime_listen": True, "channel_pairs": [
+            pair("-1001", "-2005", custom_filters={"filter_keywords": ["广告"]}), pair("news", "-2006"),
+        ]},
+        "3": {"realtime_listen": False, "channel_pairs": [pair("-1001", "-2007")]},
+    }
+    monkeypatch.setattr(csmain, "user_configs", configs)
+    monkeypatch.setattr(csmain, "source_channel_index", {})
+    monkeypatch.setattr(csmain, "_source_index_entries", {})
+    monkeypatch.setattr(csmain, "_source_index_dirty", True)
+    return csmain
+
+def resolve(csmain, chat_id):
+    return [(uid, id(route_pair)) for uid, route_pair, _ in csmain.resolve_user_for_source_channel(chat_id)]
+
+@pytest.mark.parametrize("chat_id", [-1001, "-1001", "@news", "news", -1002, -1003, -1009])
+def test_lookup_matches_linear_scan(index, chat_id):
+    assert sorted(resolve(index, chat_id)) == sorted(linear_scan(index.user_configs, chat_id))
+
+def test_lookup_by_id_and_username_returns_each_pair_once(index):
+    routes = index.resolve_user_for_source_channel(-1001, "News")
+    assert sorted((uid, route_pair["target"]) for uid, route_pair, _ in routes) == \
+        [(1, "-2001"), (1, "-2002"), (2, "-2005"), (2, "-2006")]
+    # 频道组专用过滤设置作为有效配置
+    configs = {route_pair["target"]: cfg for _, route_pair, cfg in routes}
+    assert configs["-2005"] == {"filter_keywords": ["广告"]}
+    assert configs["-2001"] is index.user_configs["1"]
+
+def test_save_configs_refreshes_added_and_removed_pairs(index):
+    assert resolve(index, -1009) == []
+    index.user_configs["1"]["channel_pairs"].append(pair("-1009", "-2008"))
+    index.user_configs["2"]["channel_pairs"].pop(0)
+    index.user_configs["4"] = {"realtime_listen": True, "channel_pairs": [pair("-1009", "-2009")]}
+    # 修改配置后未保存时索引保持不变
+    assert len(resolve(index, -1001)) == 2
+    index.save_configs()
+    for chat_id in (-1001, -1009):
+        assert sorted(resolve(index, chat_id)) == sorted(linear_scan(index.user_configs, chat_id))
+    assert len(resolve(index, -1009)) == 2
+    
+    del index.user_configs["4"]
+    index.user_configs["3"]["realtime_listen"] = True
+    index.save_configs()
+    assert [uid for uid, _ in resolve(index, -1009)] == [1]
+    assert sorted(uid for uid, _ in resolve(index, -1001)) == [1, 3]
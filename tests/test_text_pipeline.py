@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""文本处理流水线"""
+
+import pytest
+
+pytest.importorskip("pyrogram")
+
+from text_pipeline import get_text_pipeline, invalidate_compiled_caches
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    invalidate_compiled_caches()
+    yield
+    invalidate_compiled_caches()
+
+def test_replace_first_removes_links_introduced_by_replacements():
+    config = {"remove_links": True, "remove_hashtags": True,
+              "replacement_words": {"官网": "https://example.com", "#广告": "推广"}}
+    pipeline = get_text_pipeline(config)
+    text = "访问官网 #广告"
+    # 实时监听（process_message_content）：先替换再移除
+    assert pipeline.clean(text, replace_first=True).split() == ["访问", "推广"]
+    # 搬运引擎：先移除再替换
+    assert pipeline.clean(text).split() == ["访问https://example.com"]
+
+def test_whole_text_mode_sees_replaced_links():
+    config = {"remove_links": True, "remove_links_mode": "whole_text",
+              "replacement_words": {"官网": "https://example.com"}}
+    pipeline = get_text_pipeline(config)
+    assert pipeline.clean("访问官网", replace_first=True) == ""
+    assert pipeline.clean("访问官网") == "访问https://example.com"
+
+def test_removal_and_replacement():
+    config = {"remove_usernames": True, "remove_hashtags": True, "remove_all_links": True,
+              "replacements": {"猫": "狗"}}
+    pipeline = get_text_pipeline(config)
+    assert pipeline.clean("猫 @user #tag t.me/x magnet:?xt=1 猫").split() == ["狗", "狗"]
+
+def test_process_adds_tail_and_buttons():
+    config = {"tail_text": "尾巴", "tail_position": "bottom",
+              "buttons": [{"text": "频道", "url": "@channel"}]}
+    text, markup = get_text_pipeline(config).process("正文")
+    assert text == "正文\n\n尾巴"
+    assert markup.inline_keyboard[0][0].url == "t.me/channel"
+    assert get_text_pipeline(config).process("")[0] == "尾巴"
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+编译后的文本处理流水线
+每份配置只编译一次：链接/用户名/标签的移除合并为一个正则，替换词和过滤关键字
+编译为 Aho-Corasick 自动机，小尾巴和自定义按钮预先构建，处理每条消息只需调用一次 process
+"""
+
+import hashlib
+import json
+import logging
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from aho_corasick import AhoCorasick
+
+# 各种链接的正则表达式
+HTTP_LINK_PATTERN = r'https?://[^\s/$.?#].[^\s]*'
+MAGNET_LINK_PATTERN = r'magnet:\?[^\s]*'
+FTP_LINK_PATTERN = r'ftp://[^\s]*'
+TELEGRAM_LINK_PATTERN = r't\.me/[^\s]*'
+ALL_LINKS_PATTERN = f'{HTTP_LINK_PATTERN}|{MAGNET_LINK_PATTERN}|{FTP_LINK_PATTERN}|{TELEGRAM_LINK_PATTERN}'
+USERNAME_PATTERN = r'@\w+'
+HASHTAG_PATTERN = r'#\w+'
+
+# 参与编译的配置项，其中任何一项变化都会生成新的流水线
+PIPELINE_CONFIG_KEYS = (
+    "remove_all_links", "remove_links", "remove_magnet_links", "remove_links_mode",
+    "remove_usernames", "remove_hashtags", "replacements", "replacement_words",
+    "tail_text", "tail_position", "buttons", "filter_buttons", "filter_buttons_mode",
+    "button_domain_whitelist",
+)
+
+def normalize_button_url(url: str) -> str:
+    """标准化按钮URL（@用户名和纯用户名转换为 t.me 链接）"""
+    if not url:
+        return ""
+    if url.startswith("@"):
+        return f"t.me/{url[1:]}"
+    if not url.startswith(("http://", "https://", "t.me/")):
+        return f"t.me/{url}"
+    return url
+
+def _button_domain(url: str) -> str:
+    domain = url.split('//', 1)[-1].split('/', 1)[0].lower()
+    return domain[4:] if domain.startswith('www.') else domain
+
+class TextPipeline:
+    """一份配置编译后的文本处理流水线（只读，可在多条消息和多个协程间共享）"""
+    
+    def __init__(self, config: Dict[str, Any]):
+        # 链接：whole_text 模式下只要包含链接就移除整段文本，否则只移除链接本身
+        link_patterns = []
+        if config.get("remove_all_links", False):
+            link_patterns.append(f'(?i:{ALL_LINKS_PATTERN})')
+        else:
+            if config.get("remove_links", False):
+                link_patterns.append(HTTP_LINK_PATTERN)
+            if config.get("remove_magnet_links", False):
+                link_patterns.append(f'(?i:{MAGNET_LINK_PATTERN})')
+        
+        removal_patterns = []
+        self.whole_text_pattern: Optional[re.Pattern] = None
+        if link_patterns:
+            if config.get("remove_links_mode", "links_only") == "whole_text":
+                self.whole_text_pattern = re.compile('|'.join(link_patterns))
+            else:
+                removal_patterns.extend(link_patterns)
+        if config.get("remove_usernames", False):
+            removal_patterns.append(USERNAME_PATTERN)
+        if config.get("remove_hashtags", False):
+            removal_patterns.append(HASHTAG_PATTERN)
+        # 所有移除规则合并为一个正则，一次扫描完成
+        self.removal_pattern = re.compile('|'.join(removal_patterns)) if removal_patterns else None
+        
+        # 替换词：一个自动机一次扫描同时替换（替换结果不会被再次替换）
+        replacements = config.get("replacements", {}) or config.get("replacement_words", {}) or {}
+        self.replacer = get_replacement_matcher(replacements)
+        
+        self.tail_text = config.get("tail_text", "") or ""
+        self.tail_position = config.get("tail_position", "end")
+        # 界面设置的位置为 top/bottom/none，旧配置为 start/end
+        self.tail_at_start = self.tail_position in ("start", "top")
+        
+        buttons = config.get("buttons", []) or []
+        self.reply_markup = self._build_markup(buttons)
+        # 按按钮过滤策略（strip 不附加 / whitelist 只保留白名单域名）筛选后的按钮
+        self.filtered_reply_markup = self.reply_markup
+        if config.get("filter_buttons"):
+            mode = config.get("filter_buttons_mode", "drop")
+            if mode == "strip":
+                self.filtered_reply_markup = None
+            elif mode == "whitelist":
+                whitelist = set(config.get("button_domain_whitelist", []) or [])
+                self.filtered_reply_markup = self._build_markup([
+                    button for button in buttons
+                    if isinstance(button, dict) and _button_domain(button.get("url", "")) in whitelist
+                ])
+    
+    @staticmethod
+    def _build_markup(buttons: List[Dict[str, Any]]) -> Optional[InlineKeyboardMarkup]:
+        button_rows = []
+        for button_config in buttons:
+            if not isinstance(button_config, dict):
+                continue
+            text_btn = button_config.get("text", "")
+            url_btn = normalize_button_url(button_config.get("url", ""))
+            if text_btn and url_btn:
+                button_rows.append([InlineKeyboardButton(text_btn, url=url_btn)])
+        return InlineKeyboardMarkup(button_rows) if button_rows else None
+    
+    def _replace(self, text: str) -> str:
+        if self.replacer is None:
+            return text
+        matcher, values = self.replacer
+        return matcher.replace(text, values)
+    
+    def clean(self, text: str, replace_first: bool = False) -> str:
+        """移除链接/用户名/标签并替换词汇（不含小尾巴和按钮）
+        
+        默认先移除再替换（搬运引擎的顺序）；replace_first=True 时先替换再移除（实时监听
+        process_message_content 的顺序）。替换词引入或去掉链接、#标签、@用户名时两种顺序结果不同。
+        """
+        if not text:
+            return ""
+        if replace_first:
+            text = self._replace(text)
+        if self.whole_text_pattern is not None and self.whole_text_pattern.search(text):
+            logging.debug("🌐 链接过滤: 文本包含链接，整个文本被移除")
+            return ""
+        if self.removal_pattern is not None:
+            text = self.removal_pattern.sub('', text)
+        if not replace_first:
+            text = self._replace(text)
+        return text
+    
+    def add_tail(self, text: str) -> str:
+        """按位置添加小尾巴（原文本为空时只保留小尾巴）"""
+        if not self.tail_text:
+            return text
+        if not text.strip():
+            return self.tail_text
+        if self.tail_at_start:
+            return f"{self.tail_text}\n\n{text}"
+        return f"{text}\n\n{self.tail_text}"
+    
+    def process(self, text: str, add_tail: bool = True,
+                add_buttons: bool = True) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        """处理一条消息的文本，返回 (处理后的文本, 按钮)"""
+        processed_text = self.clean(text)
+        if add_tail:
+            processed_text = self.add_tail(processed_text)
+        return processed_text.strip(), self.reply_markup if add_buttons else None
+
+# 编译缓存：配置哈希 -> 流水线（最近使用的在末尾）
+_pipeline_cache: "OrderedDict[str, TextPipeline]" = OrderedDict()
+PIPELINE_CACHE_SIZE = 256
+# 自动机缓存：关键字/替换词内容 -> 自动机
+_keyword_matchers: "OrderedDict[tuple, AhoCorasick]" = OrderedDict()
+_replacement_matchers: "OrderedDict[tuple, Tuple[AhoCorasick, List[str]]]" = OrderedDict()
+
+def _cache_get(cache: OrderedDict, key, build):
+    value = cache.get(key)
+    if value is None:
+        value = cache[key] = build()
+        if len(cache) > PIPELINE_CACHE_SIZE:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(key)
+    return value
+
+def get_keyword_matcher(keywords) -> Optional[AhoCorasick]:
+    """过滤关键字的自动机（关键字按小写匹配，调用方需传入小写文本），没有有效关键字时返回 None"""
+    if not keywords or not isinstance(keywords, (list, tuple)):
+        return None
+    key = tuple(keyword for keyword in keywords if isinstance(keyword, str) and keyword)
+    if not key:
+        return None
+    return _cache_get(_keyword_matchers, key, lambda: AhoCorasick(keyword.lower() for keyword in key))
+
+def get_replacement_matcher(replacements) -> Optional[Tuple[AhoCorasick, List[str]]]:
+    """替换词的自动机和对应的替换文本（区分大小写），没有替换词时返回 None"""
+    if not replacements or not isinstance(replacements, dict):
+        return None
+    key = tuple((str(old), str(new)) for old, new in replacements.items() if old)
+    if not key:
+        return None
+    
+    def build():
+        mapping = dict(key)
+        matcher = AhoCorasick(mapping)
+        return matcher, [mapping[pattern] for pattern in matcher.patterns]
+    return _cache_get(_replacement_matchers, key, build)
+
+def invalidate_compiled_caches():
+    """用户修改配置（关键字、替换词等）后清空已编译的缓存"""
+    _pipeline_cache.clear()
+    _keyword_matchers.clear()
+    _replacement_matchers.clear()
+
+def config_fingerprint(config: Dict[str, Any]) -> str:
+    """参与编译的配置项的哈希"""
+    relevant = {key: config.get(key) for key in PIPELINE_CONFIG_KEYS}
+    data = json.dumps(relevant, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(data.encode("utf-8"), digest_size=16).hexdigest()
+
+def get_text_pipeline(config: Dict[str, Any]) -> TextPipeline:
+    """获取配置对应的流水线（配置未变化时复用已编译的流水线）"""
+    return _cache_get(_pipeline_cache, config_fingerprint(config), lambda: TextPipeline(config))